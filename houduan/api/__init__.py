@@ -5,6 +5,6 @@ from flask import Blueprint
 api_bp = Blueprint("api", __name__)
 
 # 子路由注册 - 临时只导入不依赖SQLAlchemy的模块
-from . import auth, users_simple as users, shops, messages, audit, statistics, kb, import_tasks  # noqa: E402,F401
+from . import auth, users_simple as users, shops, messages, audit, statistics, kb, import_tasks, search, metrics  # noqa: E402,F401
 
 
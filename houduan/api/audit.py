@@ -7,90 +7,96 @@ from . import api_bp
 from ..app import db
 from ..models import AuditQueueItem, AIReply, Message
 from ..utils.security import require_roles
-from ..services.qianniu_monitor import activate_window_by_title, send_text_in_active_window
+from ..utils.db_manager import get_request_session
+from ..utils.tracing import tracer
+from ..services.poll_engine import activate_and_send
+from ..services.stats_aggregator import stats_aggregator
+
+
+AUDIT_PAGE_SIZE = 100
+AUDIT_MAX_PAGE_SIZE = 500
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _serialize_audit_row(item: AuditQueueItem, msg: Message, ai: AIReply) -> dict:
+    return {
+        "id": item.id,
+        "message_id": item.message_id,
+        "status": item.status,
+        "assigned_to": item.assigned_to,
+        "note": item.note,
+        "created_at": _iso(item.created_at),
+        # 消息详情
+        "message": {
+            "id": msg.id,
+            "shop_id": msg.shop_id,
+            "customer_id": msg.customer_id,
+            "content": msg.content,
+            "status": msg.status,
+            "created_at": _iso(msg.created_at),
+        } if msg else None,
+        # AI 回复详情（该消息最新一条）
+        "ai_reply": {
+            "id": ai.id,
+            "model": ai.model,
+            "reply": ai.reply,
+            "confidence": ai.confidence,
+            "review_status": ai.review_status,
+            "created_at": _iso(ai.created_at),
+        } if ai else None,
+    }
 
 
 @api_bp.get("/audit")
 @login_required
 def list_audit():
+    """审核队列列表
+
+    单条关联查询取出队列项、消息与最新 AI 回复；按 id 升序做键集分页：
+    ?cursor=<上一页最后一个 id>&limit=<条数>&status=pending,rejected&shop_id=1，
+    还有下一页时在响应头 X-Next-Cursor 中返回游标。
+    """
     try:
-        import sqlite3
-        import os
-        
-        # 直接使用sqlite3连接
-        current_dir = os.getcwd()
-        db_path = os.path.join(current_dir, 'data', 'sqlite.db')
-        
-        if not os.path.exists(db_path):
-            # 尝试相对于当前文件的路径
-            db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'sqlite.db'))
-            
-            if not os.path.exists(db_path):
-                # 尝试项目根目录
-                project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-                db_path = os.path.join(project_root, 'data', 'sqlite.db')
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # 查询审核队列
-            cursor.execute("""
-                SELECT id, message_id, assigned_to, status, note, created_at 
-                FROM audit_queue 
-                ORDER BY id ASC 
-                LIMIT 100
-            """)
-            items = cursor.fetchall()
-            
-            result = []
-            for item in items:
-                item_id, message_id, assigned_to, status, note, created_at = item
-                
-                # 查询关联的消息
-                cursor.execute("SELECT id, shop_id, customer_id, content, status, created_at FROM messages WHERE id = ?", (message_id,))
-                msg_row = cursor.fetchone()
-                
-                # 查询AI回复
-                cursor.execute("""
-                    SELECT id, model, reply, confidence, review_status, created_at 
-                    FROM ai_replies 
-                    WHERE message_id = ? 
-                    ORDER BY id DESC 
-                    LIMIT 1
-                """, (message_id,))
-                ai_row = cursor.fetchone()
-                
-                result.append({
-                    "id": item_id,
-                    "message_id": message_id,
-                    "status": status,
-                    "assigned_to": assigned_to,
-                    "note": note,
-                    "created_at": created_at,
-                    # 消息详情
-                    "message": {
-                        "id": msg_row[0] if msg_row else None,
-                        "shop_id": msg_row[1] if msg_row else None,
-                        "customer_id": msg_row[2] if msg_row else None,
-                        "content": msg_row[3] if msg_row else None,
-                        "status": msg_row[4] if msg_row else None,
-                        "created_at": msg_row[5] if msg_row else None,
-                    } if msg_row else None,
-                    # AI 回复详情
-                    "ai_reply": {
-                        "id": ai_row[0] if ai_row else None,
-                        "model": ai_row[1] if ai_row else None,
-                        "reply": ai_row[2] if ai_row else None,
-                        "confidence": ai_row[3] if ai_row else None,
-                        "review_status": ai_row[4] if ai_row else None,
-                        "created_at": ai_row[5] if ai_row else None,
-                    } if ai_row else None,
-                })
-            
-            return jsonify(result)
-        finally:
-            conn.close()
+        from sqlalchemy import func, select
+
+        cursor = request.args.get("cursor", type=int)
+        limit = request.args.get("limit", AUDIT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, AUDIT_MAX_PAGE_SIZE))
+        statuses = [s for s in (request.args.get("status") or "").split(",") if s]
+        shop_id = request.args.get("shop_id", type=int)
+
+        # 每条消息最新一条 AI 回复（相关子查询，走 ai_replies.message_id 索引）
+        latest_reply_id = (
+            select(func.max(AIReply.id))
+            .where(AIReply.message_id == AuditQueueItem.message_id)
+            .correlate(AuditQueueItem)
+            .scalar_subquery()
+        )
+        stmt = (
+            select(AuditQueueItem, Message, AIReply)
+            .outerjoin(Message, Message.id == AuditQueueItem.message_id)
+            .outerjoin(AIReply, AIReply.id == latest_reply_id)
+        )
+        if cursor:
+            stmt = stmt.where(AuditQueueItem.id > cursor)
+        if statuses:
+            stmt = stmt.where(AuditQueueItem.status.in_(statuses))
+        if shop_id:
+            stmt = stmt.where(Message.shop_id == shop_id)
+        stmt = stmt.order_by(AuditQueueItem.id.asc()).limit(limit + 1)
+
+        session = get_request_session()
+        rows = session.execute(stmt).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        resp = jsonify([_serialize_audit_row(item, msg, ai) for item, msg, ai in rows])
+        if has_more:
+            resp.headers["X-Next-Cursor"] = str(rows[-1][0].id)
+        return resp
     except Exception as e:
         print(f"Error in list_audit: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -101,10 +107,6 @@ def list_audit():
 @require_roles("superadmin", "admin")
 def approve():
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
         data = request.get_json(force=True) or {}
         item_id = data.get("id")
         title_kw = data.get("title_kw", "千牛")
@@ -113,55 +115,51 @@ def approve():
         if not item_id:
             return jsonify({"error": "id_required"}), 400
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            it = session.get(AuditQueueItem, int(item_id))
-            if not it:
-                return jsonify({"error": "auditqueueitem_not_found"}), 404
-            it.status = "approved"
+        it = session.get(AuditQueueItem, int(item_id))
+        if not it:
+            return jsonify({"error": "auditqueueitem_not_found"}), 404
+        it.status = "approved"
             
-            ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
-            if ai:
-                ai.review_status = "approved"
-                # 如果提供了编辑后的回复，更新AI回复内容
-                if edited_reply:
-                    ai.reply = edited_reply
+        ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
+        if ai:
+            ai.review_status = "approved"
+            # 如果提供了编辑后的回复，更新AI回复内容
+            if edited_reply:
+                ai.reply = edited_reply
             
-            msg = session.get(Message, it.message_id)
-            if msg:
-                # 优先使用编辑后的回复，否则使用AI回复，最后使用消息内容
-                reply_text = edited_reply or (ai.reply if ai else msg.content)
+        msg = session.get(Message, it.message_id)
+        if msg:
+            # 优先使用编辑后的回复，否则使用AI回复，最后使用消息内容
+            reply_text = edited_reply or (ai.reply if ai else msg.content)
                 
-                # 发送实现：UI 自动化发送，发送成功后标记 answered
-                ok = activate_window_by_title(title_kw)
-                if ok:
-                    send_text_in_active_window(reply_text)
-                    msg.status = "answered"
-                else:
-                    # 即使UI自动化失败，也标记为已处理
-                    msg.status = "answered"
+            # 发送实现：UI 自动化发送，发送成功后标记 answered
+            with tracer.trace(shop_id=msg.shop_id):
+                ok = activate_and_send(title_kw, reply_text)
+            if ok:
+                msg.status = "answered"
+            else:
+                # 即使UI自动化失败，也标记为已处理
+                msg.status = "answered"
                 
-                # 创建一条新的消息记录来保存我们发送的回复，这样在历史记录中就能看到
-                from datetime import datetime
-                reply_message = Message(
-                    shop_id=msg.shop_id,
-                    customer_id=msg.customer_id,
-                    content=reply_text,
-                    source="system_reply",  # 标记为系统回复
-                    status="sent",  # 标记为已发送
-                    handled_by="admin"
-                )
-                session.add(reply_message)
+            # 创建一条新的消息记录来保存我们发送的回复，这样在历史记录中就能看到
+            from datetime import datetime
+            reply_message = Message(
+                shop_id=msg.shop_id,
+                customer_id=msg.customer_id,
+                content=reply_text,
+                source="system_reply",  # 标记为系统回复
+                status="sent",  # 标记为已发送
+                handled_by="admin"
+            )
+            session.add(reply_message)
             
-            session.commit()
-            return jsonify({"ok": True})
-        finally:
-            session.close()
+        shop_id = msg.shop_id if msg else 0
+        session.commit()
+        stats_aggregator.incr("manual_reviewed", shop_id)
+        return jsonify({"ok": True})
     except Exception as e:
         print(f"Error in approve: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -172,51 +170,41 @@ def approve():
 def get_audit_context(item_id: int):
     """获取审核项的历史消息上下文"""
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            it = session.get(AuditQueueItem, item_id)
-            if not it:
-                return jsonify({"error": "auditqueueitem_not_found"}), 404
-            msg = session.get(Message, it.message_id)
+        it = session.get(AuditQueueItem, item_id)
+        if not it:
+            return jsonify({"error": "auditqueueitem_not_found"}), 404
+        msg = session.get(Message, it.message_id)
             
-            if not msg:
-                return jsonify({"error": "message_not_found"}), 404
+        if not msg:
+            return jsonify({"error": "message_not_found"}), 404
             
-            # 获取该客户的最近10条消息
-            context_messages = session.query(Message).filter(
-                Message.shop_id == msg.shop_id,
-                Message.customer_id == msg.customer_id,
-                Message.id != msg.id  # 排除当前消息
-            ).order_by(Message.id.desc()).limit(10).all()
+        # 获取该客户的最近10条消息
+        context_messages = session.query(Message).filter(
+            Message.shop_id == msg.shop_id,
+            Message.customer_id == msg.customer_id,
+            Message.id != msg.id  # 排除当前消息
+        ).order_by(Message.id.desc()).limit(10).all()
             
-            return jsonify({
-                "current_message": {
-                    "id": msg.id,
-                    "content": msg.content,
-                    "status": msg.status,
-                    "created_at": msg.created_at.isoformat() if msg.created_at else None,
-                },
-                "context_messages": [
-                    {
-                        "id": m.id,
-                        "content": m.content,
-                        "status": m.status,
-                        "created_at": m.created_at.isoformat() if m.created_at else None,
-                    }
-                    for m in context_messages
-                ]
-            })
-        finally:
-            session.close()
+        return jsonify({
+            "current_message": {
+                "id": msg.id,
+                "content": msg.content,
+                "status": msg.status,
+                "created_at": msg.created_at.isoformat() if msg.created_at else None,
+            },
+            "context_messages": [
+                {
+                    "id": m.id,
+                    "content": m.content,
+                    "status": m.status,
+                    "created_at": m.created_at.isoformat() if m.created_at else None,
+                }
+                for m in context_messages
+            ]
+        })
     except Exception as e:
         print(f"Error in get_audit_context: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -227,36 +215,28 @@ def get_audit_context(item_id: int):
 @require_roles("superadmin", "admin")
 def reject():
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
         data = request.get_json(force=True) or {}
         item_id = data.get("id")
         if not item_id:
             return jsonify({"error": "id_required"}), 400
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            it = session.get(AuditQueueItem, int(item_id))
-            if not it:
-                return jsonify({"error": "auditqueueitem_not_found"}), 404
-            it.status = "rejected"
-            ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
-            if ai:
-                ai.review_status = "rejected"
-            msg = session.get(Message, it.message_id)
-            if msg:
-                msg.status = "queued"
-            session.commit()
-            return jsonify({"ok": True})
-        finally:
-            session.close()
+        it = session.get(AuditQueueItem, int(item_id))
+        if not it:
+            return jsonify({"error": "auditqueueitem_not_found"}), 404
+        it.status = "rejected"
+        ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
+        if ai:
+            ai.review_status = "rejected"
+        msg = session.get(Message, it.message_id)
+        if msg:
+            msg.status = "queued"
+        shop_id = msg.shop_id if msg else 0
+        session.commit()
+        stats_aggregator.incr("manual_reviewed", shop_id)
+        return jsonify({"ok": True})
     except Exception as e:
         print(f"Error in reject: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -268,41 +248,31 @@ def reject():
 def recall():
     """撤回已通过的审核项"""
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
         data = request.get_json(force=True) or {}
         item_id = data.get("id")
         if not item_id:
             return jsonify({"error": "id_required"}), 400
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            it = session.get(AuditQueueItem, int(item_id))
-            if not it:
-                return jsonify({"error": "auditqueueitem_not_found"}), 404
+        it = session.get(AuditQueueItem, int(item_id))
+        if not it:
+            return jsonify({"error": "auditqueueitem_not_found"}), 404
             
-            # 只有已通过的状态才能撤回
-            if it.status != "approved":
-                return jsonify({"error": "only_approved_can_be_recalled"}), 400
+        # 只有已通过的状态才能撤回
+        if it.status != "approved":
+            return jsonify({"error": "only_approved_can_be_recalled"}), 400
             
-            it.status = "pending"
-            ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
-            if ai:
-                ai.review_status = "pending"
-            msg = session.get(Message, it.message_id)
-            if msg:
-                msg.status = "new"
-            session.commit()
-            return jsonify({"ok": True})
-        finally:
-            session.close()
+        it.status = "pending"
+        ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
+        if ai:
+            ai.review_status = "pending"
+        msg = session.get(Message, it.message_id)
+        if msg:
+            msg.status = "new"
+        session.commit()
+        return jsonify({"ok": True})
     except Exception as e:
         print(f"Error in recall: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -314,41 +284,31 @@ def recall():
 def review_again():
     """重新审核已拒绝的审核项"""
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
         data = request.get_json(force=True) or {}
         item_id = data.get("id")
         if not item_id:
             return jsonify({"error": "id_required"}), 400
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            it = session.get(AuditQueueItem, int(item_id))
-            if not it:
-                return jsonify({"error": "auditqueueitem_not_found"}), 404
+        it = session.get(AuditQueueItem, int(item_id))
+        if not it:
+            return jsonify({"error": "auditqueueitem_not_found"}), 404
             
-            # 只有已拒绝的状态才能重新审核
-            if it.status != "rejected":
-                return jsonify({"error": "only_rejected_can_be_reviewed_again"}), 400
+        # 只有已拒绝的状态才能重新审核
+        if it.status != "rejected":
+            return jsonify({"error": "only_rejected_can_be_reviewed_again"}), 400
             
-            it.status = "pending"
-            ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
-            if ai:
-                ai.review_status = "pending"
-            msg = session.get(Message, it.message_id)
-            if msg:
-                msg.status = "new"
-            session.commit()
-            return jsonify({"ok": True})
-        finally:
-            session.close()
+        it.status = "pending"
+        ai = session.query(AIReply).filter_by(message_id=it.message_id).order_by(AIReply.id.desc()).first()
+        if ai:
+            ai.review_status = "pending"
+        msg = session.get(Message, it.message_id)
+        if msg:
+            msg.status = "new"
+        session.commit()
+        return jsonify({"ok": True})
     except Exception as e:
         print(f"Error in review_again: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -1,46 +1,108 @@
 from __future__ import annotations
 
+from datetime import datetime, timedelta
+from typing import Optional
+
 from flask import jsonify, request
 from flask_login import login_required
 
 from . import api_bp
 from ..app import db
 from ..models import Message
-from ..services.message_handler import process_message
+from ..utils.db_manager import get_request_session
+from ..services.fulltext import fulltext_search
+from ..services.message_handler import process_message, process_messages_batch
+
+
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_MAX_PAGE_SIZE = 500
+PREVIEW_LENGTH = 80
+
+
+def _parse_datetime(value: Optional[str], end_of_day: bool = False) -> Optional[datetime]:
+    """解析 ISO 日期/时间；仅给日期时 until 取当天结束"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
 
 
 @api_bp.get("/messages")
 @login_required
 def list_messages():
+    """消息列表
+
+    过滤：status（逗号分隔）、shop_id、customer_id、since/until（ISO 日期或时间）、q（全文检索）；
+    分页：按 id 倒序的键集分页，?cursor=<上一页最后一个 id>&limit=<条数>，
+    还有下一页时在响应头 X-Next-Cursor 中返回游标；
+    fields=summary 时不返回 content，只在数据库侧截取预览。
+    """
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        
+        from sqlalchemy import func, select
+
+        cursor = request.args.get("cursor", type=int)
+        limit = request.args.get("limit", MESSAGE_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MESSAGE_MAX_PAGE_SIZE))
+        statuses = [s for s in (request.args.get("status") or "").split(",") if s]
+        shop_id = request.args.get("shop_id", type=int)
+        customer_id = request.args.get("customer_id")
+        search = (request.args.get("q") or request.args.get("search") or "").strip()
+        summary = request.args.get("fields") == "summary"
         try:
-            items = session.query(Message).order_by(Message.id.desc()).limit(50).all()
-            return jsonify([
-                {
-                    "id": m.id,
-                    "shop_id": m.shop_id,
-                    "customer_id": m.customer_id,
-                    "content": m.content,
-                    "content_preview": (m.content or "")[:80],
-                    "source": m.source,
-                    "status": m.status,
-                    "handled_by": m.handled_by,
-                    "created_at": m.created_at.isoformat() if m.created_at else None,
-                }
-                for m in items
-            ])
-        finally:
-            session.close()
+            since = _parse_datetime(request.args.get("since"))
+            until = _parse_datetime(request.args.get("until"), end_of_day=True)
+        except ValueError:
+            return jsonify({"error": "invalid_date"}), 400
+
+        preview = func.substr(Message.content, 1, PREVIEW_LENGTH).label("content_preview")
+        columns = [Message.id, Message.shop_id, Message.customer_id, Message.source,
+                   Message.status, Message.handled_by, Message.created_at, preview]
+        if not summary:
+            columns.append(Message.content)
+        stmt = select(*columns)
+        if cursor:
+            stmt = stmt.where(Message.id < cursor)
+        if statuses:
+            stmt = stmt.where(Message.status.in_(statuses))
+        if shop_id:
+            stmt = stmt.where(Message.shop_id == shop_id)
+        if customer_id:
+            stmt = stmt.where(Message.customer_id == customer_id)
+        if since:
+            stmt = stmt.where(Message.created_at >= since)
+        if until:
+            stmt = stmt.where(Message.created_at < until)
+        session = get_request_session()
+        if search:
+            stmt = stmt.where(fulltext_search.match_clause(session.connection(), "messages", search))
+        stmt = stmt.order_by(Message.id.desc()).limit(limit + 1)
+
+        rows = session.execute(stmt).mappings().all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        items = []
+        for row in rows:
+            item = {
+                "id": row["id"],
+                "shop_id": row["shop_id"],
+                "customer_id": row["customer_id"],
+                "content_preview": row["content_preview"] or "",
+                "source": row["source"],
+                "status": row["status"],
+                "handled_by": row["handled_by"],
+                "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            }
+            if not summary:
+                item["content"] = row["content"]
+            items.append(item)
+
+        resp = jsonify(items)
+        if has_more:
+            resp.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+        return resp
     except Exception as e:
         print(f"Error in list_messages: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -50,34 +112,72 @@ def list_messages():
 @login_required
 def process_message_api():
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
-        
         data = request.get_json(force=True) or {}
         msg_id = data.get("message_id")
         if not msg_id:
             return jsonify({"error": "message_id_required"}), 400
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        
-        try:
-            m = session.get(Message, int(msg_id))
-            if not m:
-                return jsonify({"error": "message_not_found"}), 404
-            result = process_message(m)
-            return jsonify({
-                "reply": result.reply,
-                "source": result.source,
-                "auto_send": result.auto_send,
-                "confidence": result.confidence,
-            })
-        finally:
-            session.close()
+        session = get_request_session()
+        m = session.get(Message, int(msg_id))
+        if not m:
+            return jsonify({"error": "message_not_found"}), 404
+        result = process_message(m)
+        return jsonify({
+            "reply": result.reply,
+            "source": result.source,
+            "auto_send": result.auto_send,
+            "confidence": result.confidence,
+        })
     except Exception as e:
         print(f"Error in process_message_api: {e}")
-        return jsonify({"error": "internal_error", "detail": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "internal_error", "detail": str(e)}), 500
+
+
+@api_bp.post("/messages/process_batch")
+@login_required
+def process_messages_batch_api():
+    """批量处理消息：同一店铺的待生成问题合并为一次大模型请求
+
+    请求体: {"message_ids": [1, 2, ...]}；不传时处理最早的 limit 条新消息（默认 20）
+    指定 id 时只处理状态为 new 的消息，其余 id 列在 skipped 中
+    """
+    try:
+        data = request.get_json(force=True, silent=True) or {}
+        msg_ids = data.get("message_ids")
+        limit = min(int(data.get("limit", 20)), 200)
+
+        session = get_request_session()
+        query = session.query(Message)
+        if msg_ids:
+            try:
+                msg_ids = [int(i) for i in msg_ids]
+            except (TypeError, ValueError):
+                return jsonify({"error": "invalid_message_ids"}), 400
+            # 只处理仍为新消息的条目，已处理或不存在的 id 跳过并在响应中返回
+            messages = (query.filter(Message.id.in_(msg_ids), Message.status == "new")
+                        .order_by(Message.id.asc()).all())
+            found = {m.id for m in messages}
+            skipped = [i for i in dict.fromkeys(msg_ids) if i not in found]
+        else:
+            messages = query.filter(Message.status == "new").order_by(Message.id.asc()).limit(limit).all()
+            skipped = []
+
+        results = process_messages_batch(messages)
+        return jsonify({
+            "processed": len(results),
+            "skipped": skipped,
+            "results": [
+                {
+                    "message_id": m.id,
+                    "reply": r.reply,
+                    "source": r.source,
+                    "auto_send": r.auto_send,
+                    "confidence": r.confidence,
+                }
+                for m, r in zip(messages, results)
+            ],
+        })
+    except Exception as e:
+        print(f"Error in process_messages_batch_api: {e}")
+        return jsonify({"error": "internal_error", "detail": str(e)}), 500
+
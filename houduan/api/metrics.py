@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from flask import request, jsonify
+from flask_login import login_required
+
+from . import api_bp
+from ..utils.security import require_roles
+from ..utils.query_optimizer import query_optimizer
+from ..utils.tracing import STAGES, tracer
+
+
+@api_bp.get("/metrics/pipeline")
+@login_required
+def pipeline_metrics():
+    """消息处理各阶段耗时分布（本进程，按店铺 / 模型拆分）
+
+    参数：stage（逗号分隔，默认全部）、shop_id 或 model（只返回该维度的汇总）
+    """
+    snapshot = tracer.snapshot()
+    stages = [s for s in (request.args.get("stage") or "").split(",") if s]
+    shop_id = request.args.get("shop_id")
+    model = request.args.get("model")
+
+    result = {}
+    for stage, entry in snapshot["stages"].items():
+        if stages and stage not in stages:
+            continue
+        # 店铺与模型是两个独立维度，指定其一时只返回该序列
+        if shop_id:
+            entry = entry["by_shop"].get(shop_id)
+        elif model:
+            entry = entry["by_model"].get(model)
+        if entry:
+            result[stage] = entry
+
+    return jsonify({
+        "known_stages": list(STAGES),
+        "series": snapshot["series"],
+        "dropped": snapshot["dropped"],
+        "enabled": snapshot["enabled"],
+        "stages": result,
+    })
+
+
+@api_bp.post("/metrics/pipeline/reset")
+@login_required
+@require_roles("superadmin", "admin")
+def reset_pipeline_metrics():
+    """清空阶段耗时统计"""
+    tracer.reset()
+    return jsonify({"ok": True})
+
+
+@api_bp.get("/metrics/queries")
+@login_required
+@require_roles("superadmin", "admin")
+def query_metrics():
+    """SQL 指纹聚合与慢查询样本（含执行计划）
+
+    参数：order_by=total|count|p99|max、limit（默认 20，最多 200）
+    """
+    profiler = query_optimizer.profiler
+    order_by = request.args.get("order_by", "total")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 200))
+    return jsonify({
+        "stats": profiler.get_query_stats(),
+        "fingerprints": profiler.get_fingerprint_stats(limit, order_by),
+        "slow_queries": profiler.get_slow_queries(limit),
+        "index_suggestions": query_optimizer.suggest_indexes(),
+    })
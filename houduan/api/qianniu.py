@@ -7,12 +7,11 @@ from . import api_bp
 from ..utils.security import require_roles
 from ..services.qianniu_monitor import (
     list_windows_by_title,
-    activate_window_by_title,
-    send_text_in_active_window,
     screenshot_region,
     ocr_text,
     unread_score,
 )
+from ..services.poll_engine import activate_and_send
 from ..app import db
 from ..models import Message, Shop
 
@@ -31,10 +30,9 @@ def send_test():
     data = request.get_json(force=True) or {}
     title_kw = data.get("title_kw", "千牛")
     text = data.get("text", "[自动化探针测试]")
-    ok = activate_window_by_title(title_kw)
+    ok = activate_and_send(title_kw, text)
     if not ok:
         return jsonify({"ok": False, "error": "window_not_found"}), 404
-    send_text_in_active_window(text)
     return jsonify({"ok": True})
 
 
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from flask import request, jsonify
+from flask_login import login_required
+
+from . import api_bp
+from ..models import KnowledgeBaseItem, Message
+from ..utils.db_manager import get_request_session
+from ..services.fulltext import fulltext_search
+
+SEARCH_MAX_LIMIT = 100
+
+
+@api_bp.get("/search")
+@login_required
+def full_text_search():
+    """全文检索：消息内容与知识库问答，按相关度排序
+
+    参数：q（必填）、scope=all|messages|kb、shop_id、limit（默认 20）
+    """
+    try:
+        query = (request.args.get("q") or "").strip()
+        if not query:
+            return jsonify({"error": "q_required"}), 400
+        scope = request.args.get("scope", "all")
+        if scope not in ("all", "messages", "kb"):
+            return jsonify({"error": "invalid_scope"}), 400
+        shop_id = request.args.get("shop_id", type=int)
+        limit = max(1, min(request.args.get("limit", 20, type=int), SEARCH_MAX_LIMIT))
+
+        session = get_request_session()
+        conn = session.connection()
+        result = {"query": query, "backend": fulltext_search.backend(conn)}
+
+        if scope in ("all", "messages"):
+            ranked = fulltext_search.ranked_ids(conn, "messages", query, shop_id, limit)
+            rows = {m.id: m for m in session.query(Message).filter(Message.id.in_([i for i, _ in ranked]))}
+            result["messages"] = [
+                {
+                    "id": rows[i].id,
+                    "shop_id": rows[i].shop_id,
+                    "customer_id": rows[i].customer_id,
+                    "content": rows[i].content,
+                    "status": rows[i].status,
+                    "created_at": rows[i].created_at.isoformat() if rows[i].created_at else None,
+                    "score": round(score, 4),
+                }
+                for i, score in ranked if i in rows
+            ]
+
+        if scope in ("all", "kb"):
+            ranked = fulltext_search.ranked_ids(conn, "knowledge_base", query, shop_id, limit)
+            rows = {k.id: k for k in session.query(KnowledgeBaseItem).filter(
+                KnowledgeBaseItem.id.in_([i for i, _ in ranked]))}
+            result["kb"] = [
+                {
+                    "id": rows[i].id,
+                    "shop_id": rows[i].shop_id,
+                    "question": rows[i].question,
+                    "answer": rows[i].answer,
+                    "category": rows[i].category,
+                    "score": round(score, 4),
+                }
+                for i, score in ranked if i in rows
+            ]
+
+        return jsonify(result)
+    except Exception as e:
+        print(f"Error in search: {e}")
+        return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -6,6 +6,7 @@ from flask_login import login_required
 from ..app import db
 from ..models import Shop
 from ..utils.security import require_roles
+from ..utils.db_manager import get_request_session
 from . import api_bp
 
 
@@ -13,46 +14,36 @@ from . import api_bp
 @login_required
 def list_shops():
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        
-        try:
-            items = session.query(Shop).order_by(Shop.id.desc()).all()
-            result = []
-            for s in items:
-                # 解析配置JSON
-                config = {}
-                if s.config_json:
-                    try:
-                        import json as _json
-                        config = _json.loads(s.config_json)
-                    except Exception:
-                        config = {}
+        items = session.query(Shop).order_by(Shop.id.desc()).all()
+        result = []
+        for s in items:
+            # 解析配置JSON
+            config = {}
+            if s.config_json:
+                try:
+                    import json as _json
+                    config = _json.loads(s.config_json)
+                except Exception:
+                    config = {}
                 
-                result.append({
-                    "id": s.id, 
-                    "name": s.name, 
-                    "qianniu_title": s.qianniu_title,
-                    "ocr_region": config.get("ocr_region", []),
-                    "unread_threshold": config.get("unread_threshold", None),
-                    "ai_model": config.get("ai_model", "stub"),
-                    "auto_mode": config.get("auto_mode", False),
-                    "blacklist": config.get("blacklist", []),
-                    "whitelist": config.get("whitelist", []),
-                    "business_hours": config.get("business_hours", None),
-                    "reply_delay": config.get("reply_delay", 2)
-                })
+            result.append({
+                "id": s.id, 
+                "name": s.name, 
+                "qianniu_title": s.qianniu_title,
+                "ocr_region": config.get("ocr_region", []),
+                "unread_threshold": config.get("unread_threshold", None),
+                "ai_model": config.get("ai_model", "stub"),
+                "auto_mode": config.get("auto_mode", False),
+                "blacklist": config.get("blacklist", []),
+                "whitelist": config.get("whitelist", []),
+                "business_hours": config.get("business_hours", None),
+                "reply_delay": config.get("reply_delay", 2)
+            })
             
-            return jsonify(result)
-        finally:
-            session.close()
+        return jsonify(result)
     except Exception as e:
         print(f"Error in list_shops: {e}")
         return jsonify({"error": "database_error", "detail": str(e)}), 500
@@ -233,42 +224,33 @@ def update_shop(shop_id: int):
 @require_roles("superadmin")
 def delete_shop(shop_id: int):
     try:
-        from flask import current_app
-        from sqlalchemy import create_engine
-        from sqlalchemy.orm import sessionmaker
         from ..models import Message, KnowledgeBaseItem, ReplyTemplate, User
         
-        # 直接创建数据库连接
-        database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        session = Session()
+        # 请求级会话：共享连接池，请求结束时统一关闭
+        session = get_request_session()
         
-        try:
-            shop = session.get(Shop, shop_id)
-            if not shop:
-                return jsonify({"error": "shop_not_found"}), 404
+        shop = session.get(Shop, shop_id)
+        if not shop:
+            return jsonify({"error": "shop_not_found"}), 404
             
-            # 先删除相关的数据（外键约束）
-            # 删除相关消息
-            session.query(Message).filter_by(shop_id=shop_id).delete()
+        # 先删除相关的数据（外键约束）
+        # 删除相关消息
+        session.query(Message).filter_by(shop_id=shop_id).delete()
             
-            # 删除相关知识库条目
-            session.query(KnowledgeBaseItem).filter_by(shop_id=shop_id).delete()
+        # 删除相关知识库条目
+        session.query(KnowledgeBaseItem).filter_by(shop_id=shop_id).delete()
             
-            # 删除相关回复模板
-            session.query(ReplyTemplate).filter_by(shop_id=shop_id).delete()
+        # 删除相关回复模板
+        session.query(ReplyTemplate).filter_by(shop_id=shop_id).delete()
             
-            # 将相关用户设置为无店铺
-            session.query(User).filter_by(shop_id=shop_id).update({"shop_id": None})
+        # 将相关用户设置为无店铺
+        session.query(User).filter_by(shop_id=shop_id).update({"shop_id": None})
             
-            # 最后删除店铺
-            session.delete(shop)
-            session.commit()
+        # 最后删除店铺
+        session.delete(shop)
+        session.commit()
             
-            return jsonify({"ok": True})
-        finally:
-            session.close()
+        return jsonify({"ok": True})
     except Exception as e:
         print(f"Error in delete_shop: {e}")
         return jsonify({"error": "delete_failed", "detail": str(e)}), 500
@@ -9,6 +9,7 @@ from flask import request, jsonify
 from flask_login import UserMixin, login_user, logout_user
 
 from . import api_bp
+from ...utils.security import UserIdentity, cache_identity
 
 
 class LoginUser(UserMixin):
@@ -19,10 +20,18 @@ class LoginUser(UserMixin):
     def id(self) -> str:  # type: ignore[override]
         return str(self._user.id)
 
+    @property
+    def username(self) -> str:
+        return self._user.username
+
     @property
     def role(self) -> str:
         return self._user.role
 
+    @property
+    def shop_id(self):
+        return getattr(self._user, "shop_id", None)
+
 
 @api_bp.post("/auth/login")
 def login():
@@ -38,34 +47,27 @@ def login():
         
         # 从数据库获取用户数据（避免依赖 Flask-SQLAlchemy 绑定）
         try:
-            from flask import current_app
-            from sqlalchemy import create_engine, text
+            from sqlalchemy import text
             from werkzeug.security import check_password_hash
-            database_url = current_app.config.get('SQLALCHEMY_DATABASE_URI')
-            engine = create_engine(database_url)
-            with engine.connect() as conn:
+            from ...utils.db_manager import get_app_engine
+            with get_app_engine().connect() as conn:
                 row = conn.execute(
-                    text("SELECT id, username, password_hash, role FROM users WHERE username = :u LIMIT 1"),
+                    text("SELECT id, username, password_hash, role, shop_id FROM users WHERE username = :u LIMIT 1"),
                     {"u": username},
                 ).mappings().first()
             if not row or not check_password_hash(row["password_hash"], password):
                 return jsonify({"error": "invalid_credentials"}), 401
             
-            user_data = {"id": row["id"], "username": row["username"], "role": row["role"]}
+            user_data = {"id": row["id"], "username": row["username"], "role": row["role"], "shop_id": row["shop_id"]}
         except Exception as e:
             # 数据库查询失败
             return jsonify({"error": "database_error", "detail": str(e)}), 500
         
-        # 创建模拟用户对象
-        class MockUser:
-            def __init__(self, data):
-                self.id = data["id"]
-                self.username = data["username"]
-                self.role = data["role"]
-        
-        mock_user = MockUser(user_data)
-        login_user(LoginUser(mock_user))
-        return jsonify({"ok": True, "user": {"id": mock_user.id, "username": mock_user.username, "role": mock_user.role}})
+        # 登录时顺带写入身份缓存，后续请求的 user_loader 无需再查库
+        identity = UserIdentity(**user_data)
+        cache_identity(identity)
+        login_user(LoginUser(identity))
+        return jsonify({"ok": True, "user": {"id": identity.id, "username": identity.username, "role": identity.role}})
     except Exception as e:
         # 生产环境不暴露详细错误，开发环境可以打印日志
         import traceback
@@ -3,67 +3,73 @@ from __future__ import annotations
 from datetime import datetime, date, timedelta
 from flask import request, jsonify
 from flask_login import login_required
+from sqlalchemy import func
 
 from . import api_bp
+from ..models import KnowledgeBaseItem
+from ..utils.db_manager import get_request_session
+from ..services.stats_aggregator import histogram_percentile, stats_aggregator
+from ..utils.tracing import tracer
+
+
+def _rate(part: int, total: int) -> float:
+    return round(part / total, 4) if total else 0.0
+
+
+def _date_range(default_days: int):
+    """解析 start_date / end_date 参数，默认最近 default_days 天"""
+    start_date = request.args.get("start_date") or (date.today() - timedelta(days=default_days)).isoformat()
+    end_date = request.args.get("end_date") or date.today().isoformat()
+    return datetime.fromisoformat(start_date).date(), datetime.fromisoformat(end_date).date()
 
 
 @api_bp.get("/statistics/daily")
 @login_required
 def get_daily_statistics():
-    """获取日统计数据 - 简化版"""
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
-    
-    # 默认查询最近30天
-    if not start_date:
-        start_date = (date.today() - timedelta(days=30)).isoformat()
-    if not end_date:
-        end_date = date.today().isoformat()
-    
+    """获取日统计数据（读取预聚合计数，可按 shop_id 过滤）"""
     try:
-        start_dt = datetime.fromisoformat(start_date).date()
-        end_dt = datetime.fromisoformat(end_date).date()
+        start_dt, end_dt = _date_range(30)
     except ValueError:
         return jsonify({"error": "invalid_date_format"}), 400
-    
-    # 生成模拟数据
+    shop_id = request.args.get("shop_id", type=int)
+
+    try:
+        session = get_request_session()
+        totals = stats_aggregator.daily_totals(session.connection(), start_dt, end_dt, shop_id)
+    except Exception as e:
+        print(f"Error in get_daily_statistics: {e}")
+        return jsonify({"error": "database_error", "detail": str(e)}), 500
+
     daily_data = []
     current_date = start_dt
     while current_date <= end_dt:
-        # 模拟数据：每天随机生成一些消息
-        import random
-        daily_messages = random.randint(0, 20)
-        daily_kb_hits = int(daily_messages * 0.75)
-        daily_ai_suggestions = int(daily_messages * 0.6)
-        daily_auto_sent = int(daily_messages * 0.4)
-        daily_manual_reviewed = int(daily_messages * 0.2)
-        
+        metrics = totals.get(current_date, {})
+        daily_messages = metrics.get("messages", 0)
+        daily_kb_hits = metrics.get("kb_hits", 0)
+        daily_auto_sent = metrics.get("auto_sent", 0)
         daily_data.append({
             "date": current_date.isoformat(),
             "total_messages": daily_messages,
             "kb_hits": daily_kb_hits,
-            "ai_suggestions": daily_ai_suggestions,
+            "ai_suggestions": metrics.get("ai_suggestions", 0),
             "auto_sent": daily_auto_sent,
-            "manual_reviewed": daily_manual_reviewed,
-            "kb_hit_rate": 0.75 if daily_messages > 0 else 0.0,
-            "auto_send_rate": 0.4 if daily_messages > 0 else 0.0
+            "manual_reviewed": metrics.get("manual_reviewed", 0),
+            "kb_hit_rate": _rate(daily_kb_hits, daily_messages),
+            "auto_send_rate": _rate(daily_auto_sent, daily_messages),
         })
         current_date += timedelta(days=1)
-    
+
     # 计算汇总数据
     total_messages = sum(data["total_messages"] for data in daily_data)
     total_kb_hits = sum(data["kb_hits"] for data in daily_data)
     total_ai_suggestions = sum(data["ai_suggestions"] for data in daily_data)
     total_auto_sent = sum(data["auto_sent"] for data in daily_data)
     total_manual_reviewed = sum(data["manual_reviewed"] for data in daily_data)
-    
-    avg_kb_hit_rate = 0.75 if total_messages > 0 else 0.0
-    avg_auto_send_rate = 0.4 if total_messages > 0 else 0.0
-    
+
     return jsonify({
         "period": {
-            "start_date": start_date,
-            "end_date": end_date
+            "start_date": start_dt.isoformat(),
+            "end_date": end_dt.isoformat()
         },
         "daily_data": daily_data,
         "summary": {
@@ -72,54 +78,123 @@ def get_daily_statistics():
             "total_ai_suggestions": total_ai_suggestions,
             "total_auto_sent": total_auto_sent,
             "total_manual_reviewed": total_manual_reviewed,
-            "avg_kb_hit_rate": avg_kb_hit_rate,
-            "avg_auto_send_rate": avg_auto_send_rate
+            "avg_kb_hit_rate": _rate(total_kb_hits, total_messages),
+            "avg_auto_send_rate": _rate(total_auto_sent, total_messages)
         }
     })
 
 
+@api_bp.get("/statistics/hourly")
+@login_required
+def get_hourly_statistics():
+    """获取某天按小时的统计（默认今天）"""
+    try:
+        day = datetime.fromisoformat(request.args.get("date") or date.today().isoformat()).date()
+    except ValueError:
+        return jsonify({"error": "invalid_date_format"}), 400
+    shop_id = request.args.get("shop_id", type=int)
+
+    try:
+        session = get_request_session()
+        totals = stats_aggregator.hourly_totals(session.connection(), day, shop_id)
+    except Exception as e:
+        print(f"Error in get_hourly_statistics: {e}")
+        return jsonify({"error": "database_error", "detail": str(e)}), 500
+
+    hourly_data = []
+    for hour in range(24):
+        metrics = totals.get(hour, {})
+        hourly_data.append({
+            "hour": hour,
+            "total_messages": metrics.get("messages", 0),
+            "kb_hits": metrics.get("kb_hits", 0),
+            "ai_suggestions": metrics.get("ai_suggestions", 0),
+            "auto_sent": metrics.get("auto_sent", 0),
+            "manual_reviewed": metrics.get("manual_reviewed", 0),
+            "p95_latency_ms": histogram_percentile(metrics, 0.95),
+        })
+    return jsonify({"date": day.isoformat(), "hourly_data": hourly_data})
+
+
 @api_bp.get("/statistics/knowledge_base")
 @login_required
 def get_kb_statistics():
-    """获取知识库统计 - 简化版"""
-    # 模拟知识库数据
+    """获取知识库统计（按分类、按店铺分组计数）"""
+    try:
+        session = get_request_session()
+        by_category = (
+            session.query(KnowledgeBaseItem.category, func.count(KnowledgeBaseItem.id))
+            .group_by(KnowledgeBaseItem.category)
+            .order_by(func.count(KnowledgeBaseItem.id).desc())
+            .all()
+        )
+        by_shop = (
+            session.query(KnowledgeBaseItem.shop_id, func.count(KnowledgeBaseItem.id))
+            .group_by(KnowledgeBaseItem.shop_id)
+            .all()
+        )
+    except Exception as e:
+        print(f"Error in get_kb_statistics: {e}")
+        return jsonify({"error": "database_error", "detail": str(e)}), 500
+
     return jsonify({
-        "total_items": 40,
-        "by_category": [
-            {"category": "产品咨询", "count": 15},
-            {"category": "技术支持", "count": 12},
-            {"category": "售后服务", "count": 8},
-            {"category": "价格咨询", "count": 3},
-            {"category": "物流查询", "count": 2}
-        ],
-        "by_shop": [
-            {"shop_id": "1", "count": 20},
-            {"shop_id": "2", "count": 15},
-            {"shop_id": "全局", "count": 5}
-        ]
+        "total_items": sum(count for _, count in by_category),
+        "by_category": [{"category": category or "未分类", "count": count} for category, count in by_category],
+        "by_shop": [{"shop_id": str(shop_id) if shop_id else "全局", "count": count} for shop_id, count in by_shop],
     })
 
 
 @api_bp.get("/statistics/performance")
 @login_required
 def get_performance_statistics():
-    """获取性能统计 - 简化版"""
-    # 模拟性能数据
+    """获取性能统计（模型使用量与置信度、处理耗时分布）"""
+    try:
+        start_dt, end_dt = _date_range(7)
+    except ValueError:
+        return jsonify({"error": "invalid_date_format"}), 400
+    shop_id = request.args.get("shop_id", type=int)
+
+    try:
+        session = get_request_session()
+        totals = stats_aggregator.daily_totals(session.connection(), start_dt, end_dt, shop_id)
+    except Exception as e:
+        print(f"Error in get_performance_statistics: {e}")
+        return jsonify({"error": "database_error", "detail": str(e)}), 500
+
+    merged: dict = {}
+    for metrics in totals.values():
+        for metric, value in metrics.items():
+            merged[metric] = merged.get(metric, 0) + value
+
+    model_performance = {}
+    for metric, count in merged.items():
+        if metric.startswith("model_count:") and count:
+            model = metric.split(":", 1)[1]
+            confidence_milli = merged.get(f"model_confidence_milli:{model}", 0)
+            model_performance[model] = {
+                "count": count,
+                "avg_confidence": round(confidence_milli / 1000 / count, 3),
+            }
+
+    latency_count = merged.get("latency_count", 0)
+    avg_ms = merged.get("latency_sum_ms", 0) / latency_count if latency_count else None
+    p50 = histogram_percentile(merged, 0.5)
+    p95 = histogram_percentile(merged, 0.95)
+
     return jsonify({
         "period": {
-            "start_date": (date.today() - timedelta(days=7)).isoformat(),
-            "end_date": date.today().isoformat()
-        },
-        "total_messages": 150,
-        "total_ai_replies": 120,
-        "model_performance": {
-            "stub": {"count": 80, "avg_confidence": 0.85},
-            "qwen": {"count": 60, "avg_confidence": 0.82},
-            "ernie": {"count": 40, "avg_confidence": 0.88}
+            "start_date": start_dt.isoformat(),
+            "end_date": end_dt.isoformat()
         },
+        "total_messages": merged.get("messages", 0),
+        "total_ai_replies": merged.get("kb_hits", 0) + merged.get("ai_suggestions", 0) + merged.get("rule_replies", 0),
+        "model_performance": model_performance,
         "response_times": {
-            "avg_processing_time": "1.2s",
-            "fastest_response": "0.8s",
-            "slowest_response": "2.1s"
-        }
+            "processed": latency_count,
+            "avg_processing_time": f"{avg_ms / 1000:.2f}s" if avg_ms is not None else None,
+            "p50_processing_time": f"≤{p50 / 1000:g}s" if p50 else None,
+            "p95_processing_time": f"≤{p95 / 1000:g}s" if p95 else None,
+        },
+        # 本进程启动以来各阶段耗时分布
+        "stages": {stage: entry["all"] for stage, entry in tracer.snapshot()["stages"].items()},
     })
@@ -7,7 +7,7 @@ from werkzeug.security import generate_password_hash
 from . import api_bp
 from ..app import db
 from ..models import User, Shop
-from ..utils.security import require_roles
+from ..utils.security import require_roles, invalidate_user_identity
 
 
 def get_shop_name(shop_id):
@@ -167,6 +167,7 @@ def update_user(user_id: int):
         user.shop_id = data["shop_id"]
     
     db.session.commit()
+    invalidate_user_identity(user_id)
     
     return jsonify({"message": "用户更新成功"})
 
@@ -186,6 +187,7 @@ def delete_user(user_id: int):
     
     db.session.delete(user)
     db.session.commit()
+    invalidate_user_identity(user_id)
     
     return jsonify({"message": "用户删除成功"})
 
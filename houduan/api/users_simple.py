@@ -5,7 +5,7 @@ from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 
 from . import api_bp
-from ..utils.security import require_roles
+from ..utils.security import require_roles, invalidate_user_identity
 from ..app import db
 from ..models import User, Shop
 
@@ -158,6 +158,7 @@ def update_user(user_id: int):
         user.shop_id = data["shop_id"]
     
     db.session.commit()
+    invalidate_user_identity(user_id)
     
     return jsonify({
         "message": "用户更新成功",
@@ -20,7 +20,7 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 
 from .config import Config
-from .utils.db_manager import init_database_manager, db_manager
+from .utils.db_manager import init_database_manager, init_shared_engine, db_manager
 
 # 全局扩展实例(延迟绑定)
 db = SQLAlchemy()
@@ -46,10 +46,13 @@ def create_app() -> Flask:
     app.config["SESSION_COOKIE_SECURE"] = bool(is_https)
     app.config["SESSION_COOKIE_HTTPONLY"] = True
 
-    # 初始化扩展
+    # 初始化扩展：Flask-SQLAlchemy 引擎使用与共享连接池相同的配置，并登记为进程内唯一引擎
+    from .utils.connection_pool import pool_options
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", pool_options(app.config["SQLALCHEMY_DATABASE_URI"]))
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    init_shared_engine(app)
     
     # 初始化数据库管理器
     try:
@@ -63,6 +66,17 @@ def create_app() -> Flask:
             print("数据库健康监控已启动")
         except Exception as e:
             print(f"数据库健康监控启动失败: {e}")
+
+        # 核对热点查询依赖的索引，缺失时仅告警
+        try:
+            from .utils.query_optimizer import index_manager
+            index_report = index_manager.verify_required_indexes(
+                db_manager.get_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+            )
+            if index_report["missing"]:
+                print(f"缺少 {len(index_report['missing'])} 个索引，请执行数据库迁移")
+        except Exception as e:
+            print(f"索引检查失败: {e}")
             
     except Exception as e:
         print(f"数据库管理器初始化失败: {e}")
@@ -82,6 +96,7 @@ def create_app() -> Flask:
         app,
         resources={r"/*": {"origins": static_origins + [lan_origin_pattern], "supports_credentials": True}},
         allow_headers=["Content-Type", "Authorization"],
+        expose_headers=["X-Next-Cursor"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         supports_credentials=True,
     )
@@ -145,31 +160,53 @@ def create_app() -> Flask:
         ReplyTemplate,
         AuditQueueItem,
         StatisticsDaily,
+        StatisticsCounter,
     )
 
+    # 统计聚合：消息入库即在内存中计数，由调度器批量落库，进程退出时补写剩余增量
+    from .services.stats_aggregator import stats_aggregator
+    stats_aggregator.install_hooks()
+    with app.app_context():
+        # 与调度器落库使用同一引擎
+        stats_aggregator.bind(db.engine)
+
+    # 全文检索：SQLite 建 FTS5 虚表并注册写入钩子，MySQL 使用迁移创建的 ngram 全文索引
+    try:
+        from .services.fulltext import init_fulltext
+        backend = init_fulltext(db_manager.get_engine(app.config["SQLALCHEMY_DATABASE_URI"]))
+        print(f"全文检索后端: {backend}")
+    except Exception as e:
+        print(f"全文检索初始化失败，使用 LIKE 检索: {e}")
+
+    # 自动 SQL 计时：共享引擎上的每条语句按指纹聚合，慢查询附执行计划
+    try:
+        from .utils.query_optimizer import query_optimizer
+        query_optimizer.install(db_manager.get_engine(app.config["SQLALCHEMY_DATABASE_URI"]))
+    except Exception as e:
+        print(f"SQL 计时监听注册失败: {e}")
+
     # 配置 user_loader
     @login_manager.user_loader
     def load_user(user_id: str):
-        """从数据库加载用户（使用原生引擎，避免绑定问题）"""
+        """加载登录用户：优先命中身份缓存，未命中时走共享连接池引擎查库"""
         try:
-            from flask import current_app
-            from sqlalchemy import create_engine, text
-            database_url = current_app.config.get("SQLALCHEMY_DATABASE_URI")
-            engine = create_engine(database_url)
-            with engine.connect() as conn:
-                row = conn.execute(
-                    text("SELECT id, username, role FROM users WHERE id = :i LIMIT 1"),
-                    {"i": int(user_id)},
-                ).mappings().first()
-            if not row:
-                return None
-            class UserObj:
-                def __init__(self, row):
-                    self.id = row["id"]
-                    self.username = row["username"]
-                    self.role = row["role"]
             from .api.auth import LoginUser
-            return LoginUser(UserObj(row))
+            from .utils.security import UserIdentity, cache_identity, get_cached_identity
+            identity = get_cached_identity(user_id)
+            if identity is None:
+                from sqlalchemy import text
+                from .utils.db_manager import get_app_engine
+                with get_app_engine().connect() as conn:
+                    row = conn.execute(
+                        text("SELECT id, username, role, shop_id FROM users WHERE id = :i LIMIT 1"),
+                        {"i": int(user_id)},
+                    ).mappings().first()
+                if not row:
+                    return None
+                identity = UserIdentity(id=row["id"], username=row["username"],
+                                        role=row["role"], shop_id=row["shop_id"])
+                cache_identity(identity)
+            return LoginUser(identity)
         except Exception:
             return None
 
@@ -211,88 +248,34 @@ def create_app() -> Flask:
             # 调度器失败不应影响主服务可用性
             pass
 
+    # 组件健康探测在后台按各自间隔运行（调度器启动之后，首轮同步执行）
+    try:
+        from .services.health_probes import start_health_probes
+        start_health_probes(app)
+    except Exception as e:
+        print(f"健康探测启动失败: {e}")
+
     @app.get("/health")
     def health_check():
-        """健康检查接口"""
-        try:
-            # 检查数据库连接
-            from sqlalchemy import text
-            db.session.execute(text("SELECT 1"))
-            db_status = "ok"
-        except Exception:
-            db_status = "error"
-        
-        # 使用数据库管理器进行更详细的健康检查
-        try:
-            from .utils.db_manager import get_database_url
-            health_info = db_manager.health_check(get_database_url())
-            if health_info['status'] == 'healthy':
-                db_status = "ok"
-            else:
-                db_status = "error"
-        except Exception:
-            db_status = "error"
-        
-        # 获取数据库健康监控状态
-        db_health_status = {}
-        try:
-            from .services.db_health import get_db_health_status
-            db_health_status = get_db_health_status()
-        except Exception:
-            pass
-        
-        try:
-            # 检查OCR服务（检查PaddleOCR模块是否可导入）
-            from paddleocr import PaddleOCR
-            ocr_status = "ok"
-        except ImportError:
-            ocr_status = "not_installed"
-        except Exception:
-            ocr_status = "error"
-        
-        try:
-            # 检查AI服务（检查环境变量）
-            import os
-            ai_services = []
-            if os.environ.get("OPENAI_API_KEY"):
-                ai_services.append("openai")
-            if os.environ.get("QWEN_API_KEY"):
-                ai_services.append("qwen")
-            if os.environ.get("ERNIE_API_KEY"):
-                ai_services.append("ernie")
-            ai_status = "ok" if ai_services else "no_config"
-        except Exception:
-            ai_status = "error"
-        
-        # 检查调度器状态
-        try:
-            from .services.scheduler import _scheduler
-            scheduler_status = "ok" if _scheduler and _scheduler.running else "stopped"
-        except Exception:
-            scheduler_status = "error"
-        
+        """存活检查：只读取后台探测的缓存结果，不访问数据库、不导入依赖"""
+        from .services.health_probes import health_probes
+
+        statuses = health_probes.statuses()
+        db_status = statuses.get("database", "unknown")
+        ocr_status = statuses.get("ocr", "unknown")
+        ai_status = statuses.get("ai", "unknown")
+        scheduler_status = statuses.get("scheduler", "unknown")
+
         # 计算整体状态
         overall_status = "ok"
         if db_status != "ok":
             overall_status = "error"
         elif ocr_status == "error" or ai_status == "error" or scheduler_status == "error":
             overall_status = "warning"
-        
-        # 获取性能监控数据
-        performance_data = {}
-        try:
-            from .utils.query_optimizer import get_query_performance_report
-            from .utils.connection_pool import get_pool_health_report
-            from .utils.cache_manager import get_cache_stats
-            
-            performance_data = {
-                "query_performance": get_query_performance_report(),
-                "connection_pool": get_pool_health_report(),
-                "cache_stats": get_cache_stats()
-            }
-        except Exception as e:
-            performance_data = {"error": str(e)}
-        
+
+        # 性能数据由后台探测定期汇总
+        snapshot = health_probes.detail("performance") or {}
+
         return jsonify({
             "status": overall_status,
             "timestamp": datetime.utcnow().isoformat(),
@@ -302,12 +285,36 @@ def create_app() -> Flask:
                 "ai": ai_status,
                 "scheduler": scheduler_status
             },
-            "ai_services": ai_services if ai_status == "ok" else [],
-            "db_health": db_health_status,
-            "performance": performance_data,
+            "ai_services": health_probes.detail("ai") or [],
+            "db_health": snapshot.get("db_health", {}),
+            "ocr_service": snapshot.get("ocr_service", {}),
+            "performance": snapshot.get("performance", {}),
             "message": "服务运行正常" if overall_status == "ok" else "部分服务异常"
         })
 
+    @app.get("/health/ready")
+    def readiness_check():
+        """就绪检查：关键组件探测失败或结果过期时返回 503（供负载均衡摘除实例）"""
+        from .services.health_probes import health_probes
+
+        readiness = health_probes.readiness()
+        return jsonify({
+            "status": "ready" if readiness["ready"] else "not_ready",
+            "timestamp": datetime.utcnow().isoformat(),
+            **readiness,
+        }), 200 if readiness["ready"] else 503
+
+    @app.get("/metrics")
+    def metrics():
+        """OpenMetrics 指标（只读内存统计，不访问数据库）；设置 METRICS_TOKEN 后需 Bearer 认证"""
+        from flask import Response
+        from .utils.metrics import CONTENT_TYPE, render_metrics
+
+        token = os.environ.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return jsonify({"error": "unauthorized"}), 401
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
+
     @app.get("/")
     def index():
         # 若存在打包后的前端，则默认返回前端首页；否则返回服务信息
@@ -43,6 +43,10 @@ class Shop(db.Model, TimestampMixin):
 
 class Message(db.Model, TimestampMixin):
     __tablename__ = "messages"
+    __table_args__ = (
+        db.Index("ix_messages_shop_customer_id", "shop_id", "customer_id", "id"),
+        db.Index("ix_messages_status_created_at", "status", "created_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     shop_id = db.Column(db.Integer, db.ForeignKey("shops.id"), nullable=False)
@@ -55,6 +59,9 @@ class Message(db.Model, TimestampMixin):
 
 class KnowledgeBaseItem(db.Model, TimestampMixin):
     __tablename__ = "knowledge_base"
+    __table_args__ = (
+        db.Index("ix_knowledge_base_shop_category", "shop_id", "category"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     shop_id = db.Column(db.Integer, db.ForeignKey("shops.id"), nullable=True)  # 为空表示全局
@@ -75,6 +82,10 @@ class KnowledgeVector(db.Model, TimestampMixin):
 
 class AIReply(db.Model, TimestampMixin):
     __tablename__ = "ai_replies"
+    __table_args__ = (
+        db.Index("ix_ai_replies_message_id_id", "message_id", "id"),
+        db.Index("ix_ai_replies_created_at_model", "created_at", "model"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey("messages.id"), nullable=False)
@@ -95,6 +106,10 @@ class ReplyTemplate(db.Model, TimestampMixin):
 
 class AuditQueueItem(db.Model, TimestampMixin):
     __tablename__ = "audit_queue"
+    __table_args__ = (
+        db.Index("ix_audit_queue_message_id", "message_id"),
+        db.Index("ix_audit_queue_status_id", "status", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey("messages.id"), nullable=False)
@@ -112,6 +127,24 @@ class StatisticsDaily(db.Model, TimestampMixin):
     ai_accuracy = db.Column(db.Float, nullable=True)
 
 
+class StatisticsCounter(db.Model):
+    """统计计数器长表：按 日期/小时/店铺/指标 累加，由统计聚合器批量写入"""
+
+    __tablename__ = "statistics_counters"
+    __table_args__ = (
+        db.UniqueConstraint("bucket_date", "bucket_hour", "shop_id", "metric",
+                            name="uq_statistics_counters_bucket"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_date = db.Column(db.Date, nullable=False)
+    bucket_hour = db.Column(db.SmallInteger, nullable=False)  # 0-23
+    shop_id = db.Column(db.Integer, nullable=False, default=0)  # 0 表示未归属店铺
+    metric = db.Column(db.String(64), nullable=False)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
 class ImportTask(db.Model, TimestampMixin):
     __tablename__ = "import_tasks"
 
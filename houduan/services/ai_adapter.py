@@ -2,14 +2,21 @@
 AI 模型适配器
 
 支持多种AI模型：通义千问、文心一言、OpenAI GPT等，通过环境变量与配置切换。
+
+各适配器支持通过环境变量覆盖接口地址（用于私有化部署或本地模拟服务压测）：
+- OPENAI_BASE_URL 例: http://127.0.0.1:8900/v1
+- QWEN_BASE_URL   例: http://127.0.0.1:8900/api/v1
+- ERNIE_BASE_URL  例: http://127.0.0.1:8900
 """
 
 from __future__ import annotations
 
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 import os
+import re
 import json
 import requests
+from loguru import logger
 
 try:
     from openai import OpenAI  # type: ignore
@@ -17,7 +24,18 @@ except Exception:  # pragma: no cover
     OpenAI = None  # type: ignore
 
 
-def generate_reply_qwen(prompt: str, context: Optional[str] = None) -> str:
+SYSTEM_PROMPT = "你是淘宝客服助手，请根据用户问题提供专业、友好的回复。"
+
+# 批量生成：多个独立问题合并为一次结构化输出请求
+BATCH_SYSTEM_PROMPT = (
+    SYSTEM_PROMPT
+    + "\n下面会给出多个互相独立的顾客问题（JSON 数组，每项含 id、question，可能含参考信息 context）。"
+    + "请逐一作答，只输出 JSON 对象，格式为 {\"replies\": [{\"id\": 问题id, \"reply\": \"回复内容\"}]}，不要输出其他内容。"
+)
+
+
+def generate_reply_qwen(prompt: str, context: Optional[str] = None,
+                        system_prompt: str = SYSTEM_PROMPT, max_tokens: int = 500) -> str:
     """使用通义千问生成回复"""
     api_key = os.environ.get("QWEN_API_KEY")
     model = os.environ.get("QWEN_MODEL", "qwen-turbo")
@@ -30,6 +48,9 @@ def generate_reply_qwen(prompt: str, context: Optional[str] = None) -> str:
         from dashscope import Generation
         
         dashscope.api_key = api_key
+        base_url = os.environ.get("QWEN_BASE_URL")
+        if base_url:
+            dashscope.base_http_api_url = base_url.rstrip("/")
         
         # 构建输入文本
         input_text = prompt
@@ -39,8 +60,8 @@ def generate_reply_qwen(prompt: str, context: Optional[str] = None) -> str:
         # 调用通义千问API
         response = Generation.call(
             model=model,
-            prompt=f"你是淘宝客服助手，请根据用户问题提供专业、友好的回复。\n\n{input_text}",
-            max_tokens=500,
+            prompt=f"{system_prompt}\n\n{input_text}",
+            max_tokens=max_tokens,
             temperature=0.3
         )
         
@@ -55,11 +76,13 @@ def generate_reply_qwen(prompt: str, context: Optional[str] = None) -> str:
         return f"【通义千问】调用失败: {str(e)}"
 
 
-def generate_reply_ernie(prompt: str, context: Optional[str] = None) -> str:
+def generate_reply_ernie(prompt: str, context: Optional[str] = None,
+                         system_prompt: str = SYSTEM_PROMPT, max_tokens: int = 500) -> str:
     """使用文心一言生成回复"""
     api_key = os.environ.get("ERNIE_API_KEY")
     secret_key = os.environ.get("ERNIE_SECRET_KEY")
     model = os.environ.get("ERNIE_MODEL", "ernie-bot-turbo")
+    base_url = os.environ.get("ERNIE_BASE_URL", "https://aip.baidubce.com").rstrip("/")
     
     if not api_key or not secret_key:
         return "【文心一言】API密钥未配置"
@@ -68,7 +91,7 @@ def generate_reply_ernie(prompt: str, context: Optional[str] = None) -> str:
         import requests
         
         # 获取访问令牌
-        token_url = "https://aip.baidubce.com/oauth/2.0/token"
+        token_url = f"{base_url}/oauth/2.0/token"
         token_params = {
             "grant_type": "client_credentials",
             "client_id": api_key,
@@ -89,14 +112,14 @@ def generate_reply_ernie(prompt: str, context: Optional[str] = None) -> str:
             input_text = f"参考信息：{context}\n\n用户问题：{prompt}"
         
         # 调用文心一言API
-        api_url = f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{model}"
+        api_url = f"{base_url}/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{model}"
         headers = {"Content-Type": "application/json"}
         data = {
             "messages": [
-                {"role": "user", "content": f"你是淘宝客服助手，请根据用户问题提供专业、友好的回复。\n\n{input_text}"}
+                {"role": "user", "content": f"{system_prompt}\n\n{input_text}"}
             ],
             "temperature": 0.3,
-            "max_output_tokens": 500
+            "max_output_tokens": max_tokens
         }
         
         response = requests.post(f"{api_url}?access_token={access_token}", 
@@ -116,7 +139,9 @@ def generate_reply_ernie(prompt: str, context: Optional[str] = None) -> str:
         return f"【文心一言】调用失败: {str(e)}"
 
 
-def generate_reply_openai(prompt: str, context: Optional[str] = None) -> str:
+def generate_reply_openai(prompt: str, context: Optional[str] = None,
+                          system_prompt: str = SYSTEM_PROMPT, max_tokens: int = 500,
+                          json_mode: bool = False) -> str:
     """使用OpenAI GPT生成回复"""
     api_key = os.environ.get("OPENAI_API_KEY")
     model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
@@ -125,21 +150,23 @@ def generate_reply_openai(prompt: str, context: Optional[str] = None) -> str:
         return "【OpenAI】API密钥未配置或库未安装"
     
     try:
-        client = OpenAI(api_key=api_key)
+        client = OpenAI(api_key=api_key, base_url=os.environ.get("OPENAI_BASE_URL") or None)
         
         # 构建输入文本
         input_text = prompt
         if context:
             input_text = f"参考信息：{context}\n\n用户问题：{prompt}"
         
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
         response = client.chat.completions.create(
             model=model,
             messages=[
-                {"role": "system", "content": "你是淘宝客服助手，请根据用户问题提供专业、友好的回复。"},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": input_text}
             ],
             temperature=0.3,
-            max_tokens=500
+            max_tokens=max_tokens,
+            **extra
         )
         
         return response.choices[0].message.content or "【OpenAI】生成失败"
@@ -162,7 +189,115 @@ def generate_reply(prompt: str, context: Optional[str] = None, model: str = "stu
         return generate_reply_openai(prompt, context)
     else:
         # 默认占位回复
-        base = (context + "\n") if context else ""
-        return base + "【AI建议回复】我们已收到您的问题，将尽快为您处理。"
+        return _stub_reply(prompt, context)
+
+
+def _stub_reply(prompt: str, context: Optional[str] = None) -> str:
+    base = (context + "\n") if context else ""
+    return base + "【AI建议回复】我们已收到您的问题，将尽快为您处理。"
+
+
+def _build_batch_prompt(items: List[Tuple[str, Optional[str]]]) -> str:
+    """将多个问题打包为 JSON 数组作为用户输入，id 从 1 开始"""
+    payload = []
+    for idx, (prompt, context) in enumerate(items, start=1):
+        entry: Dict[str, object] = {"id": idx, "question": prompt}
+        if context:
+            entry["context"] = context
+        payload.append(entry)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def parse_batch_replies(raw: str, expected: int) -> Dict[int, str]:
+    """解析批量生成的结构化输出，返回 id -> 回复；无法解析时返回空字典。
+
+    兼容 {"replies": [...]}、裸数组以及被 ```json 代码块包裹的输出。
+    """
+    if not raw:
+        return {}
+    text = raw.strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.S)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    data = None
+    # 以最先出现的括号类型为准，避免把数组中的第一个对象当成整体
+    pairs = sorted((("{", "}"), ("[", "]")), key=lambda pair: (text.find(pair[0]) == -1, text.find(pair[0])))
+    for start, end in pairs:
+        i, j = text.find(start), text.rfind(end)
+        if i == -1 or j <= i:
+            continue
+        try:
+            data = json.loads(text[i:j + 1])
+            break
+        except ValueError:
+            continue
+    if isinstance(data, dict):
+        data = data.get("replies")
+    if not isinstance(data, list):
+        return {}
+
+    replies: Dict[int, str] = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            idx = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        reply = entry.get("reply")
+        if 1 <= idx <= expected and isinstance(reply, str) and reply.strip():
+            replies[idx] = reply.strip()
+    return replies
+
+
+def _generate_batch_raw(batch_prompt: str, model: str, max_tokens: int) -> str:
+    if model == "qwen":
+        return generate_reply_qwen(batch_prompt, system_prompt=BATCH_SYSTEM_PROMPT, max_tokens=max_tokens)
+    if model == "ernie":
+        return generate_reply_ernie(batch_prompt, system_prompt=BATCH_SYSTEM_PROMPT, max_tokens=max_tokens)
+    if model == "openai":
+        return generate_reply_openai(batch_prompt, system_prompt=BATCH_SYSTEM_PROMPT, max_tokens=max_tokens, json_mode=True)
+    return ""
+
+
+def generate_replies_batch(items: List[Tuple[str, Optional[str]]], model: str = "stub",
+                           batch_size: Optional[int] = None) -> List[str]:
+    """批量生成回复：将同一店铺的多个独立问题合并为一次大模型请求。
+
+    items: [(prompt, context), ...]，返回与 items 等长的回复列表。
+    解析失败或缺失的条目回退为单条 generate_reply 调用。
+    环境变量 AI_BATCH_SIZE 控制单次请求最多打包的问题数（默认 8）。
+    """
+    if not items:
+        return []
+    if model not in ("qwen", "ernie", "openai"):
+        # 占位模型无网络开销，逐条生成即可
+        return [generate_reply(prompt, context, model) for prompt, context in items]
+
+    size = batch_size or int(os.environ.get("AI_BATCH_SIZE", "8"))
+    size = max(1, size)
+    per_item_tokens = int(os.environ.get("AI_BATCH_TOKENS_PER_ITEM", "300"))
+
+    results: List[str] = []
+    for offset in range(0, len(items), size):
+        chunk = items[offset:offset + size]
+        if len(chunk) == 1:
+            results.append(generate_reply(chunk[0][0], chunk[0][1], model))
+            continue
 
+        valid = [(i, p, c) for i, (p, c) in enumerate(chunk) if p and p.strip()]
+        raw = _generate_batch_raw(
+            _build_batch_prompt([(p, c) for _, p, c in valid]),
+            model,
+            max_tokens=per_item_tokens * len(valid),
+        ) if valid else ""
+        parsed = parse_batch_replies(raw, len(valid))
+        if valid and len(parsed) < len(valid):
+            logger.warning(f"批量生成解析不完整({len(parsed)}/{len(valid)})，缺失条目回退为单条调用: model={model}")
 
+        positions = {i: pos for pos, (i, _, _) in enumerate(valid, start=1)}
+        for i, (p, c) in enumerate(chunk):
+            reply = parsed.get(positions[i]) if i in positions else None
+            results.append(reply or generate_reply(p, c, model))
+    return results
@@ -0,0 +1,54 @@
+"""
+变化检测：基于 NumPy 的整数差异哈希（dHash）
+
+- 哈希直接以 64 位整数保存，汉明距离用 popcount（int.bit_count）计算，
+  不再经过 imagehash 的十六进制字符串往返
+- 缩放使用块均值（np.add.reduceat），直接作用于灰度数组，无需构造 PIL 图像
+- 灰度平面由 CapturedFrame 每帧只计算一次，区域哈希、聊天气泡切分与 OCR 缓存键
+  都在同一灰度平面的切片上计算
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+HASH_SIZE = 8
+
+
+def to_gray(pixels: np.ndarray) -> np.ndarray:
+    """RGB(A) 数组转 uint8 灰度（ITU-R 601 近似整数系数）"""
+    if pixels.ndim == 2:
+        return pixels.astype(np.uint8, copy=False)
+    rgb = pixels[..., :3].astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def _block_mean(gray: np.ndarray, width: int, height: int) -> np.ndarray:
+    """块均值缩放到 (height, width)"""
+    h, w = gray.shape
+    if h == 0 or w == 0:
+        return np.zeros((height, width), dtype=np.float32)
+    ys = (np.arange(height) * h) // height
+    xs = (np.arange(width) * w) // width
+    row_counts = np.maximum(np.diff(np.append(ys, h)), 1)
+    col_counts = np.maximum(np.diff(np.append(xs, w)), 1)
+    rows = np.add.reduceat(gray.astype(np.float32), ys, axis=0) / row_counts[:, None]
+    return np.add.reduceat(rows, xs, axis=1) / col_counts[None, :]
+
+
+def dhash_int(pixels: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """差异哈希：相邻列亮度比较，返回 hash_size*hash_size 位整数"""
+    gray = to_gray(pixels)
+    small = _block_mean(gray, hash_size + 1, hash_size)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    """两个整数哈希的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+def hash_hex(value: int, hash_size: int = HASH_SIZE) -> str:
+    """整数哈希的十六进制表示（定长，用作缓存键）"""
+    return f"{value:0{hash_size * hash_size // 4}x}"
@@ -0,0 +1,127 @@
+"""
+聊天区域增量差分
+
+聊天窗口的新消息从底部出现、旧消息向上滚动，气泡内容本身不变。
+按行把聊天区域切分为气泡（由纯背景行分隔的连续非空行），
+为每个气泡计算内容签名，与上一帧的签名比对：
+最后一个与上一帧相同的气泡之后出现的气泡即为新滚入的内容，只对这些气泡做 OCR。
+
+- 顶部被截断的气泡（贴着区域上边缘）内容不完整，不参与比对和识别
+- 首帧或与上一帧完全没有重叠（如切换了会话）时，返回全部完整气泡
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from .change_detect import to_gray
+
+
+@dataclass
+class Bubble:
+    """气泡：聊天区域内的行区间 [top, bottom)"""
+
+    top: int
+    bottom: int
+    signature: str
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+
+def blank_rows(pixels: np.ndarray, tolerance: int = 8) -> np.ndarray:
+    """纯背景行掩码：整行灰度极差不超过 tolerance（pixels 可为 RGB 或已转换的灰度）"""
+    gray = to_gray(pixels)
+    if gray.size == 0:
+        return np.zeros(gray.shape[0], dtype=bool)
+    return (gray.max(axis=1).astype(np.int16) - gray.min(axis=1)) <= tolerance
+
+
+def split_bubbles(pixels: np.ndarray, min_gap: int = 2, min_height: int = 6,
+                  tolerance: int = 8) -> List[Bubble]:
+    """按纯背景行把区域切分为气泡，返回自上而下的气泡列表
+
+    pixels 可直接传入共享帧的灰度切片，避免重复转换。
+    """
+    gray = to_gray(pixels)
+    blank = blank_rows(gray, tolerance)
+    height = blank.shape[0]
+    # 量化到 16 级灰度，抵消抗锯齿/亮度的轻微抖动
+    quantized = gray >> 4
+
+    bubbles: List[Bubble] = []
+    top = None
+    gap = 0
+    for y in range(height + 1):
+        is_blank = y == height or blank[y]
+        if not is_blank:
+            if top is None:
+                top = y
+            gap = 0
+            continue
+        if top is None:
+            continue
+        gap += 1
+        if gap >= min_gap or y == height:
+            bottom = y - gap + 1
+            if bottom - top >= min_height:
+                digest = hashlib.blake2b(quantized[top:bottom].tobytes(), digest_size=8).hexdigest()
+                bubbles.append(Bubble(top=top, bottom=bottom, signature=f"{bottom - top}:{digest}"))
+            top = None
+            gap = 0
+    return bubbles
+
+
+def new_bubbles(previous: List[str], current: List[Bubble]) -> List[Bubble]:
+    """current 中位于最后一个已见气泡之后的气泡"""
+    if not previous:
+        return list(current)
+    seen = set(previous)
+    last_seen = -1
+    for index, bubble in enumerate(current):
+        if bubble.signature in seen:
+            last_seen = index
+    return current[last_seen + 1:]
+
+
+class ChatDiffer:
+    """按区域维护上一帧的气泡签名，返回新出现的气泡（区域数超过上限时淘汰最久未比对的区域）"""
+
+    def __init__(self, max_regions: int = 200):
+        self._signatures: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_regions = max_regions
+
+    def diff(self, key: str, pixels: np.ndarray, min_gap: int = 2,
+             min_height: int = 6) -> List[Bubble]:
+        bubbles = [b for b in split_bubbles(pixels, min_gap=min_gap, min_height=min_height) if b.top > 0]
+        with self._lock:
+            previous = self._signatures.pop(key, [])
+            while len(self._signatures) >= self._max_regions:
+                self._signatures.popitem(last=False)
+            self._signatures[key] = [b.signature for b in bubbles]
+        return new_bubbles(previous, bubbles)
+
+    def reset(self, key: str = None) -> None:
+        with self._lock:
+            if key is None:
+                self._signatures.clear()
+            else:
+                self._signatures.pop(key, None)
+
+
+# 全局聊天差分器
+chat_differ = ChatDiffer()
+
+
+def diff_chat_region(key: str, pixels: np.ndarray, min_gap: int = 2,
+                     min_height: int = 6) -> List[Tuple[int, int]]:
+    """返回新出现气泡的行区间 [(top, bottom)]"""
+    return [(b.top, b.bottom) for b in chat_differ.diff(key, pixels, min_gap, min_height)]
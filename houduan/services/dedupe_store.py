@@ -0,0 +1,176 @@
+"""
+消息去重存储：按分钟分桶的滚动窗口
+
+- 每条消息用 (店铺ID, 清洗后文本) 计算 64 位整数指纹，不再把时间窗口拼进哈希，
+  同一条文本跨越时间边界也只会通过一次
+- 指纹存放在按分钟划分的桶中，只保留最近 window_minutes 个桶，
+  过期桶整体丢弃，不再出现"整表清空后所有可见消息重新变为新消息"的问题
+- 命中时把指纹刷新到当前桶：只要消息仍显示在屏幕上就一直视为已见
+- 条目总数受 max_entries 限制，超出时从最旧的桶开始淘汰（当前分钟的桶保留，
+  同一分钟内涌入的指纹可暂时超出上限）
+- 可选持久化到 JSON 文件，重启后不会把屏幕上的历史消息重新入库
+
+环境变量：
+- DEDUPE_WINDOW_MINUTES: 滚动窗口（分钟），默认 3。窗口只需覆盖轮询重复识别同一屏内容的间隔
+  （命中会刷新）；过长会把客户隔段时间重复发送的短句（如"在吗"）当作重复丢弃
+- DEDUPE_MAX_ENTRIES: 最大指纹数，默认 50000
+- DEDUPE_STORE_PATH: 持久化文件路径，为空时不持久化
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+
+def normalize_text(text: str) -> str:
+    """清理文本：去除标点符号与多余空白"""
+    cleaned = "".join(c for c in text if c.isalnum() or c.isspace())
+    return " ".join(cleaned.split())
+
+
+def message_fingerprint(text: str, shop_id: int) -> int:
+    """64 位消息指纹"""
+    payload = f"{shop_id}:{normalize_text(text)}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big")
+
+
+class DedupeStore:
+    """按分钟分桶的滚动去重集合"""
+
+    def __init__(self, window_minutes: Optional[int] = None, max_entries: Optional[int] = None,
+                 persist_path: Optional[str] = None, flush_interval: float = 30.0):
+        self.window_minutes = int(window_minutes or os.environ.get("DEDUPE_WINDOW_MINUTES", 3))
+        self.max_entries = int(max_entries or os.environ.get("DEDUPE_MAX_ENTRIES", 50000))
+        self.persist_path = persist_path if persist_path is not None else os.environ.get("DEDUPE_STORE_PATH") or None
+        self.flush_interval = flush_interval
+
+        self._buckets: "OrderedDict[int, Set[int]]" = OrderedDict()
+        self._index: Dict[int, int] = {}  # 指纹 -> 所在桶（分钟）
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.time()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+        if self.persist_path:
+            self._load()
+
+    @staticmethod
+    def _minute(now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // 60)
+
+    def _expire(self, minute: int) -> None:
+        oldest_allowed = minute - self.window_minutes + 1
+        while self._buckets:
+            bucket_minute, bucket = next(iter(self._buckets.items()))
+            if bucket_minute >= oldest_allowed and len(self._index) <= self.max_entries:
+                break
+            if bucket_minute >= minute:
+                # 当前分钟的桶不因容量淘汰，否则刚记录的指纹也会被丢弃，下次轮询重复放行
+                break
+            self._buckets.popitem(last=False)
+            for fp in bucket:
+                if self._index.get(fp) == bucket_minute:
+                    del self._index[fp]
+            self._stats["evicted"] += len(bucket)
+            self._dirty = True
+
+    def _put(self, fp: int, minute: int) -> None:
+        previous = self._index.get(fp)
+        if previous == minute:
+            return
+        if previous is not None and previous in self._buckets:
+            self._buckets[previous].discard(fp)
+        self._buckets.setdefault(minute, set()).add(fp)
+        self._index[fp] = minute
+        self._dirty = True
+
+    def seen(self, text: str, shop_id: int, now: Optional[float] = None) -> bool:
+        """是否已见过该消息；未见过时记录下来"""
+        fp = message_fingerprint(text, shop_id)
+        minute = self._minute(now)
+        with self._lock:
+            self._expire(minute)
+            hit = fp in self._index
+            self._put(fp, minute)
+            self._expire(minute)
+            self._stats["hits" if hit else "misses"] += 1
+        self.maybe_flush()
+        return hit
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._index.clear()
+            self._dirty = True
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._index), "buckets": len(self._buckets)}
+
+    # ------------------------------------------------------------------ 持久化
+
+    def _load(self) -> None:
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"去重存储加载失败: {e}")
+            return
+        current = self._minute()
+        for minute_str, fps in sorted(data.get("buckets", {}).items(), key=lambda kv: int(kv[0])):
+            minute = int(minute_str)
+            if minute <= current - self.window_minutes:
+                continue
+            for fp in fps:
+                self._put(int(fp), minute)
+        self._expire(current)
+        self._dirty = False
+
+    def maybe_flush(self) -> None:
+        """距上次写入超过 flush_interval 且有变更时写入"""
+        if self.persist_path and self._dirty and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """写入持久化文件（临时文件 + 原子替换）"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {"buckets": {str(m): list(b) for m, b in self._buckets.items() if b}}
+            self._dirty = False
+            self._last_flush = time.time()
+        try:
+            directory = os.path.dirname(os.path.abspath(self.persist_path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            logger.warning(f"去重存储写入失败: {e}")
+
+
+# 全局去重存储
+dedupe_store = DedupeStore()
+atexit.register(dedupe_store.flush)
+
+
+def is_duplicate(text: str, shop_id: int) -> bool:
+    """检查消息是否重复（首次出现时记录）"""
+    return dedupe_store.seen(text, shop_id)
@@ -0,0 +1,311 @@
+"""
+全文检索：消息内容与知识库问答
+
+- SQLite：FTS5 虚表（messages_fts / knowledge_base_fts），rowid 与源表 id 一致；
+  中文按二元组（bigram）切分后写入，查询用同样的切分，按 bm25 排序
+- MySQL：源表上的 FULLTEXT 索引（WITH PARSER ngram，由迁移创建），MATCH ... AGAINST 排序，
+  由数据库自行维护
+- 其他数据库或 FTS5 不可用时退化为 LIKE
+
+SQLite 下由 ORM 写入钩子（after_insert / after_update / after_delete）在同一事务内同步索引；
+启动时若索引行数与源表不一致则整表重建，覆盖绕过 ORM 的写入。
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import column, event, inspect as sa_inspect, or_, table, text
+from sqlalchemy.engine import Connection
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_CJK_RE = re.compile(rf"[{_CJK}]")
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[^\W{_CJK}_]+")
+
+REBUILD_CHUNK = 1000
+
+
+@dataclass(frozen=True)
+class SearchSource:
+    """可检索的源表"""
+
+    table: str
+    fts_table: str
+    columns: Tuple[str, ...]
+    mysql_index: str
+    shop_clause: str
+
+
+SOURCES: Dict[str, SearchSource] = {
+    "messages": SearchSource(
+        table="messages",
+        fts_table="messages_fts",
+        columns=("content",),
+        mysql_index="ft_messages_content",
+        shop_clause="t.shop_id = :shop_id",
+    ),
+    "knowledge_base": SearchSource(
+        table="knowledge_base",
+        fts_table="knowledge_base_fts",
+        columns=("question", "answer"),
+        mysql_index="ft_knowledge_base_qa",
+        # 店铺检索同时包含全局知识库
+        shop_clause="(t.shop_id = :shop_id OR t.shop_id IS NULL)",
+    ),
+}
+
+
+def tokenize(value: str) -> List[str]:
+    """中文连续片段切为二元组并补上末字（单字也能前缀命中），其余按词小写"""
+    tokens: List[str] = []
+    for match in _TOKEN_RE.finditer(value or ""):
+        run = match.group(0)
+        if _CJK_RE.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def to_document(value: str) -> str:
+    """写入 FTS5 的文档：空格分隔的词元"""
+    return " ".join(tokenize(value))
+
+
+def fts5_query(query: str) -> Optional[str]:
+    """把用户输入转换为 FTS5 MATCH 表达式（词元全部命中，单字与英文词按前缀）"""
+    terms: List[str] = []
+    for match in _TOKEN_RE.finditer(query or ""):
+        run = match.group(0)
+        if _CJK_RE.match(run):
+            parts = [f'"{run}"*'] if len(run) == 1 else [f'"{run[i:i + 2]}"' for i in range(len(run) - 1)]
+        else:
+            parts = [f'"{run.lower()}"*']
+        for part in parts:
+            if part not in terms:
+                terms.append(part)
+    return " AND ".join(terms) or None
+
+
+def mysql_query(query: str) -> Optional[str]:
+    """MySQL 布尔模式短语查询：每个片段都必须以短语形式出现"""
+    runs = [m.group(0) for m in _TOKEN_RE.finditer(query or "")]
+    return " ".join(f'+"{run}"' for run in runs) or None
+
+
+def _insert_sql(source: SearchSource):
+    return text(
+        f"INSERT INTO {source.fts_table} (rowid, {', '.join(source.columns)}) "
+        f"VALUES (:id, {', '.join(':' + c for c in source.columns)})"
+    )
+
+
+class FullTextSearch:
+    """全文检索（SQLite FTS5 / MySQL ngram FULLTEXT / LIKE 回退）"""
+
+    def __init__(self):
+        self._backends: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._hooks_installed = False
+
+    # ---- 后端探测与建表 ----
+
+    def backend(self, conn: Connection) -> str:
+        """当前连接可用的检索后端：fts5 / mysql / like（按库缓存）"""
+        key = str(conn.engine.url)
+        cached = self._backends.get(key)
+        if cached is not None:
+            return cached
+        backend = "like"
+        try:
+            if conn.dialect.name == "sqlite":
+                names = {row[0] for row in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%_fts'"
+                ))}
+                if all(source.fts_table in names for source in SOURCES.values()):
+                    backend = "fts5"
+            elif conn.dialect.name == "mysql":
+                names = {row[0] for row in conn.execute(text(
+                    "SELECT DISTINCT index_name FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND index_type = 'FULLTEXT'"
+                ))}
+                if all(source.mysql_index in names for source in SOURCES.values()):
+                    backend = "mysql"
+        except Exception as e:
+            logger.warning(f"全文检索后端探测失败，使用 LIKE: {e}")
+        with self._lock:
+            self._backends[key] = backend
+        return backend
+
+    def ensure_schema(self, conn: Connection) -> str:
+        """SQLite 下创建 FTS5 虚表，并在索引与源表行数不一致时重建；返回可用后端"""
+        if conn.dialect.name != "sqlite":
+            return self.backend(conn)
+        try:
+            for source in SOURCES.values():
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {source.fts_table} "
+                    f"USING fts5({', '.join(source.columns)}, tokenize='unicode61')"
+                ))
+        except Exception as e:
+            logger.warning(f"FTS5 不可用，全文检索退化为 LIKE: {e}")
+            self._backends[str(conn.engine.url)] = "like"
+            return "like"
+        with self._lock:
+            self._backends[str(conn.engine.url)] = "fts5"
+
+        existing = set(sa_inspect(conn).get_table_names())
+        for name, source in SOURCES.items():
+            if source.table not in existing:
+                continue
+            indexed = conn.execute(text(f"SELECT COUNT(*) FROM {source.fts_table}")).scalar()
+            total = conn.execute(text(f"SELECT COUNT(*) FROM {source.table}")).scalar()
+            if indexed != total:
+                logger.info(f"全文索引 {source.fts_table} 与源表不一致（{indexed}/{total}），重建")
+                self.rebuild(conn, name)
+        return "fts5"
+
+    def rebuild(self, conn: Connection, source_name: str) -> int:
+        """整表重建某个源表的 FTS5 索引，返回写入行数"""
+        source = SOURCES[source_name]
+        conn.execute(text(f"DELETE FROM {source.fts_table}"))
+        insert = _insert_sql(source)
+        result = conn.execute(text(f"SELECT id, {', '.join(source.columns)} FROM {source.table}"))
+        written = 0
+        while True:
+            rows = result.fetchmany(REBUILD_CHUNK)
+            if not rows:
+                break
+            conn.execute(insert, [
+                {"id": row[0], **{c: to_document(row[i + 1]) for i, c in enumerate(source.columns)}}
+                for row in rows
+            ])
+            written += len(rows)
+        return written
+
+    # ---- ORM 写入同步 ----
+
+    def index_row(self, conn: Connection, source_name: str, row_id: int, values: Dict[str, str]) -> None:
+        source = SOURCES[source_name]
+        conn.execute(text(f"DELETE FROM {source.fts_table} WHERE rowid = :id"), {"id": row_id})
+        conn.execute(_insert_sql(source),
+                     {"id": row_id, **{c: to_document(values.get(c)) for c in source.columns}})
+
+    def index_rows(self, conn: Connection, source_name: str, rows: List[Dict[str, str]]) -> None:
+        """批量写入新插入行的索引（绕过 ORM 的批量插入使用，rows 含 id 与检索字段）"""
+        source = SOURCES[source_name]
+        conn.execute(_insert_sql(source), [
+            {"id": row["id"], **{c: to_document(row.get(c)) for c in source.columns}} for row in rows
+        ])
+
+    def delete_row(self, conn: Connection, source_name: str, row_id: int) -> None:
+        source = SOURCES[source_name]
+        conn.execute(text(f"DELETE FROM {source.fts_table} WHERE rowid = :id"), {"id": row_id})
+
+    def install_hooks(self) -> None:
+        """注册 Message / KnowledgeBaseItem 的写入钩子（幂等）"""
+        with self._lock:
+            if self._hooks_installed:
+                return
+            self._hooks_installed = True
+        from ..models import KnowledgeBaseItem, Message
+
+        for model, source_name in ((Message, "messages"), (KnowledgeBaseItem, "knowledge_base")):
+            columns = SOURCES[source_name].columns
+
+            def after_update(mapper, connection, target, _name=source_name, _columns=columns):
+                if self.backend(connection) != "fts5":
+                    return
+                # 状态等非检索字段的更新不触碰索引
+                state = sa_inspect(target)
+                if any(state.attrs[c].history.has_changes() for c in _columns):
+                    self.index_row(connection, _name, target.id, {c: getattr(target, c) for c in _columns})
+
+            def after_insert(mapper, connection, target, _name=source_name, _columns=columns):
+                if self.backend(connection) == "fts5":
+                    self.index_row(connection, _name, target.id, {c: getattr(target, c) for c in _columns})
+
+            def after_delete(mapper, connection, target, _name=source_name):
+                if self.backend(connection) == "fts5":
+                    self.delete_row(connection, _name, target.id)
+
+            event.listen(model, "after_insert", after_insert)
+            event.listen(model, "after_update", after_update)
+            event.listen(model, "after_delete", after_delete)
+
+    # ---- 查询 ----
+
+    def match_clause(self, conn: Connection, source_name: str, query: str):
+        """源表 id 过滤条件（可直接拼进 ORM/Core 查询的 where）"""
+        source = SOURCES[source_name]
+        backend = self.backend(conn)
+        if backend == "fts5":
+            expression = fts5_query(query)
+            if expression:
+                return text(
+                    f"{source.table}.id IN (SELECT rowid FROM {source.fts_table} "
+                    f"WHERE {source.fts_table} MATCH :fts_query)"
+                ).bindparams(fts_query=expression)
+        elif backend == "mysql":
+            expression = mysql_query(query)
+            if expression:
+                columns = ", ".join(f"{source.table}.{c}" for c in source.columns)
+                return text(f"MATCH({columns}) AGAINST(:fts_query IN BOOLEAN MODE)").bindparams(
+                    fts_query=expression)
+        source_table = table(source.table, *(column(c) for c in source.columns))
+        return or_(*(source_table.c[c].contains(query, autoescape=True) for c in source.columns))
+
+    def ranked_ids(self, conn: Connection, source_name: str, query: str,
+                   shop_id: Optional[int] = None, limit: int = 20) -> List[Tuple[int, float]]:
+        """按相关度排序的 (id, score)，score 越大越相关"""
+        source = SOURCES[source_name]
+        params = {"limit": limit}
+        shop_sql = ""
+        if shop_id:
+            shop_sql = f" AND {source.shop_clause}"
+            params["shop_id"] = shop_id
+
+        backend = self.backend(conn)
+        if backend == "fts5":
+            expression = fts5_query(query)
+            if not expression:
+                return []
+            params["q"] = expression
+            sql = (f"SELECT t.id, -bm25({source.fts_table}) AS score FROM {source.fts_table} "
+                   f"JOIN {source.table} t ON t.id = {source.fts_table}.rowid "
+                   f"WHERE {source.fts_table} MATCH :q{shop_sql} ORDER BY score DESC LIMIT :limit")
+        elif backend == "mysql":
+            expression = mysql_query(query)
+            if not expression:
+                return []
+            params["q"] = expression
+            match = f"MATCH({', '.join('t.' + c for c in source.columns)}) AGAINST(:q IN BOOLEAN MODE)"
+            sql = (f"SELECT t.id, {match} AS score FROM {source.table} t "
+                   f"WHERE {match}{shop_sql} ORDER BY score DESC LIMIT :limit")
+        else:
+            if not query.strip():
+                return []
+            params["q"] = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            like = " OR ".join(f"t.{c} LIKE :q ESCAPE '\\'" for c in source.columns)
+            sql = (f"SELECT t.id, 0 AS score FROM {source.table} t "
+                   f"WHERE ({like}){shop_sql} ORDER BY t.id DESC LIMIT :limit")
+        return [(int(row[0]), float(row[1] or 0)) for row in conn.execute(text(sql), params)]
+
+    def get_stats(self) -> Dict[str, str]:
+        return dict(self._backends)
+
+
+# 全局全文检索
+fulltext_search = FullTextSearch()
+
+
+def init_fulltext(engine) -> str:
+    """启动时建表/校验索引并注册写入钩子，返回可用后端"""
+    fulltext_search.install_hooks()
+    with engine.begin() as conn:
+        return fulltext_search.ensure_schema(conn)
@@ -0,0 +1,196 @@
+"""
+健康探测：组件检查在后台按各自间隔运行，接口只读缓存结果
+
+- /health：存活检查，直接返回缓存的组件状态，不访问数据库、不导入任何依赖
+- /health/ready：就绪检查，关键探测（数据库）失败或结果过期时返回 503
+- 每个探测一个下次到期时间，由单个守护线程依次执行；结果超过 3 个间隔未刷新视为过期
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from ..utils.context_manager import context_manager
+
+STALE_FACTOR = 3
+
+
+@dataclass
+class Probe:
+    """一个组件探测：fn 返回 (status, detail)，status 为 ok / warning / error / not_installed 等"""
+
+    name: str
+    fn: Callable[[], Any]
+    interval: float
+    critical: bool = False
+    next_due: float = 0.0
+    result: Dict[str, Any] = field(default_factory=lambda: {"status": "unknown"})
+
+
+class HealthProbes:
+    """后台健康探测"""
+
+    def __init__(self):
+        self._probes: Dict[str, Probe] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._app = None
+
+    def register(self, name: str, fn: Callable[[], Any], interval: float, critical: bool = False) -> None:
+        with self._lock:
+            self._probes[name] = Probe(name=name, fn=fn, interval=interval, critical=critical)
+
+    def _run(self, probe: Probe) -> None:
+        started = time.perf_counter()
+        try:
+            with context_manager.app_context(self._app):
+                status, detail = probe.fn()
+            error = None
+        except Exception as e:
+            status, detail, error = "error", None, str(e)
+            logger.warning(f"健康探测失败 {probe.name}: {e}")
+        result = {
+            "status": status,
+            "detail": detail,
+            "error": error,
+            "checked_at": time.time(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        with self._lock:
+            probe.result = result
+            probe.next_due = time.monotonic() + probe.interval
+
+    def run_all(self) -> None:
+        """立即执行全部探测（启动时同步执行一轮，保证首个请求就有结果）"""
+        with self._lock:
+            probes = list(self._probes.values())
+        for probe in probes:
+            self._run(probe)
+
+    def start(self, app) -> None:
+        """绑定应用并启动后台线程（重复调用只更新绑定的应用并刷新一轮）"""
+        self._app = app
+        self.run_all()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="health-probes", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                due = [p for p in self._probes.values() if p.next_due <= now]
+                next_due = min((p.next_due for p in self._probes.values()), default=now + 1)
+            for probe in due:
+                self._run(probe)
+            if not due:
+                time.sleep(min(1.0, max(0.05, next_due - now)))
+
+    # ---- 读取（只读缓存） ----
+
+    def _is_stale(self, probe: Probe, now: float) -> bool:
+        checked_at = probe.result.get("checked_at")
+        return checked_at is None or now - checked_at > probe.interval * STALE_FACTOR
+
+    def statuses(self) -> Dict[str, str]:
+        with self._lock:
+            return {name: probe.result["status"] for name, probe in self._probes.items()}
+
+    def detail(self, name: str) -> Any:
+        with self._lock:
+            probe = self._probes.get(name)
+            return probe.result.get("detail") if probe else None
+
+    def readiness(self) -> Dict[str, Any]:
+        """就绪状态：关键探测必须为 ok 且未过期"""
+        now = time.time()
+        probes: Dict[str, Dict[str, Any]] = {}
+        failing: List[str] = []
+        with self._lock:
+            for name, probe in self._probes.items():
+                result = dict(probe.result)
+                stale = self._is_stale(probe, now)
+                checked_at = result.pop("checked_at", None)
+                result.update({
+                    "critical": probe.critical,
+                    "stale": stale,
+                    "age_seconds": round(now - checked_at, 1) if checked_at else None,
+                    "checked_at": datetime.fromtimestamp(checked_at).isoformat() if checked_at else None,
+                })
+                probes[name] = result
+                if probe.critical and (stale or result["status"] != "ok"):
+                    failing.append(name)
+        return {"ready": not failing, "failing": failing, "probes": probes}
+
+
+# ---- 内置探测 ----
+
+def _probe_database():
+    from flask import current_app
+    from sqlalchemy import text
+    from ..utils.db_manager import db_manager
+    started = time.perf_counter()
+    with db_manager.get_engine(current_app.config["SQLALCHEMY_DATABASE_URI"]).connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return "ok", {"response_time": round(time.perf_counter() - started, 4)}
+
+
+def _probe_ocr():
+    # 只查找模块、不导入（PaddleOCR 导入需数秒并占用大量内存）
+    if importlib.util.find_spec("paddleocr") is None:
+        return "not_installed", None
+    return "ok", None
+
+
+def _probe_ai():
+    ai_services = [name for name, env in (("openai", "OPENAI_API_KEY"), ("qwen", "QWEN_API_KEY"),
+                                          ("ernie", "ERNIE_API_KEY")) if os.environ.get(env)]
+    return ("ok" if ai_services else "no_config"), ai_services
+
+
+def _probe_scheduler():
+    from .scheduler import _scheduler
+    return ("ok" if _scheduler and _scheduler.running else "stopped"), None
+
+
+def _probe_performance():
+    """汇总各组件内存统计，供 /health 直接返回"""
+    from ..utils.query_optimizer import get_query_performance_report
+    from ..utils.connection_pool import get_pool_health_report
+    from ..utils.cache_manager import get_cache_stats
+    from ..utils.tracing import get_tracing_stats
+    from .db_health import get_db_health_status
+    from .ocr_service import get_ocr_stats
+    return "ok", {
+        "performance": {
+            "query_performance": get_query_performance_report(),
+            "connection_pool": get_pool_health_report(),
+            "cache_stats": get_cache_stats(),
+            "pipeline_latency": get_tracing_stats(),
+        },
+        "db_health": get_db_health_status(),
+        "ocr_service": get_ocr_stats(),
+    }
+
+
+# 全局健康探测
+health_probes = HealthProbes()
+health_probes.register("database", _probe_database,
+                       float(os.environ.get("HEALTH_DB_INTERVAL", "10")), critical=True)
+health_probes.register("scheduler", _probe_scheduler, float(os.environ.get("HEALTH_SCHEDULER_INTERVAL", "10")))
+health_probes.register("ai", _probe_ai, float(os.environ.get("HEALTH_AI_INTERVAL", "60")))
+health_probes.register("ocr", _probe_ocr, float(os.environ.get("HEALTH_OCR_INTERVAL", "300")))
+health_probes.register("performance", _probe_performance,
+                       float(os.environ.get("HEALTH_PERFORMANCE_INTERVAL", "15")))
+
+
+def start_health_probes(app) -> None:
+    health_probes.start(app)
@@ -5,17 +5,26 @@
 1) 输入消息文本 -> 知识库匹配
 2) 命中高置信度: 直接使用知识库答案, 标记可自动发送
 3) 中低置信度: 组合上下文 -> 走 AI 生成, 进入审核
+
+批量模式: 同一店铺的多条待生成消息合并为一次大模型请求（process_messages_batch）
 """
 
 from __future__ import annotations
 
+import json
+import time
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from ..app import db
-from ..models import Message, AIReply, AuditQueueItem, StatisticsDaily
-from .knowledge_base import match_from_knowledge_base
-from .ai_adapter import generate_reply
+from ..models import Message, AIReply, AuditQueueItem
+from .knowledge_base import match_from_knowledge_base, KBMatchResult
+from .ai_adapter import generate_reply, generate_replies_batch
+from .stats_aggregator import stats_aggregator
+from ..utils.tracing import (
+    STAGE_CONFIG_LOAD, STAGE_DB_COMMIT, STAGE_KB_MATCH, STAGE_LLM_CALL, STAGE_PIPELINE, STAGE_RULE_CHECK,
+    span, tracer,
+)
 from ..models import Shop
 from datetime import datetime, date
 
@@ -28,110 +37,190 @@ class ProcessResult:
     confidence: float
 
 
-def update_daily_statistics(shop_id: int, source: str, auto_send: bool):
-    """更新日统计数据"""
+def update_daily_statistics(shop_id: int, source: str, auto_send: bool, latency: Optional[float] = None,
+                            model: Optional[str] = None, confidence: Optional[float] = None):
+    """记录处理结果（仅内存累加，由调度器批量写入统计计数表）"""
     try:
-        today = date.today()
-        stats = StatisticsDaily.query.filter_by(date=today).first()
-        
-        if not stats:
-            stats = StatisticsDaily(date=today)
-            db.session.add(stats)
-        
-        # 这里可以添加更多统计指标
-        # 由于当前模型设计较简单，这里先记录基本统计
-        # 实际项目中可以扩展为更详细的统计表
-        
-        db.session.commit()
+        stats_aggregator.record_result(shop_id, source, auto_send, latency=latency,
+                                       model=model, confidence=confidence)
     except Exception:
         # 统计失败不影响主流程
         pass
 
 
-def process_message(message: Message) -> ProcessResult:
-    # 检查黑白名单
-    shop = db.session.get(Shop, message.shop_id)
-    if shop and shop.config_json:
-        import json as _json
-        try:
-            cfg = _json.loads(shop.config_json)
-            customer_id = message.customer_id
-            
-            # 检查黑名单
-            blacklist = cfg.get("blacklist", [])
-            if blacklist and customer_id in blacklist:
-                # 黑名单用户，直接拒绝
-                ai = AIReply(message_id=message.id, model="blacklist", reply="抱歉，您已被加入黑名单，无法获得自动回复服务。", confidence=1.0, review_status="auto")
-                db.session.add(ai)
-                message.status = "answered"
-                db.session.commit()
-                return ProcessResult(reply="抱歉，您已被加入黑名单，无法获得自动回复服务。", source="blacklist", auto_send=True, confidence=1.0)
-            
-            # 检查白名单（如果设置了白名单，只有白名单用户才能获得服务）
-            whitelist = cfg.get("whitelist", [])
-            if whitelist and customer_id not in whitelist:
-                # 非白名单用户，直接拒绝
-                ai = AIReply(message_id=message.id, model="whitelist", reply="抱歉，您不在服务白名单中，无法获得自动回复服务。", confidence=1.0, review_status="auto")
-                db.session.add(ai)
-                message.status = "answered"
-                db.session.commit()
-                return ProcessResult(reply="抱歉，您不在服务白名单中，无法获得自动回复服务。", source="whitelist", auto_send=True, confidence=1.0)
-                
-        except Exception:
-            pass  # 配置解析失败，继续正常流程
-    
+def _load_shop_config(shop: Optional[Shop]) -> Optional[dict]:
+    """解析店铺配置，未配置或解析失败返回 None"""
+    if not shop or not shop.config_json:
+        return None
+    try:
+        return json.loads(shop.config_json)
+    except Exception:
+        return None
+
+
+def _answer_directly(message: Message, model: str, reply: str, result: ProcessResult) -> ProcessResult:
+    """规则命中：记录自动回复并标记消息已回答"""
+    ai = AIReply(message_id=message.id, model=model, reply=reply, confidence=1.0, review_status="auto")
+    db.session.add(ai)
+    message.status = "answered"
+    with span(STAGE_DB_COMMIT):
+        db.session.commit()
+    return result
+
+
+def _apply_shop_rules(message: Message, cfg: Optional[dict]) -> Optional[ProcessResult]:
+    """黑白名单与营业时间检查，命中时直接返回处理结果"""
+    if not cfg:
+        return None
+
+    try:
+        customer_id = message.customer_id
+
+        # 检查黑名单
+        blacklist = cfg.get("blacklist", [])
+        if blacklist and customer_id in blacklist:
+            # 黑名单用户，直接拒绝
+            reply = "抱歉，您已被加入黑名单，无法获得自动回复服务。"
+            return _answer_directly(message, "blacklist", reply,
+                                    ProcessResult(reply=reply, source="blacklist", auto_send=True, confidence=1.0))
+
+        # 检查白名单（如果设置了白名单，只有白名单用户才能获得服务）
+        whitelist = cfg.get("whitelist", [])
+        if whitelist and customer_id not in whitelist:
+            # 非白名单用户，直接拒绝
+            reply = "抱歉，您不在服务白名单中，无法获得自动回复服务。"
+            return _answer_directly(message, "whitelist", reply,
+                                    ProcessResult(reply=reply, source="whitelist", auto_send=True, confidence=1.0))
+    except Exception:
+        pass  # 配置解析失败，继续正常流程
+
     # 检查营业时间
-    if shop and shop.config_json:
-        try:
-            cfg = _json.loads(shop.config_json)
-            business_hours = cfg.get("business_hours")
-            if business_hours:
-                from datetime import datetime
-                now = datetime.now().time()
-                start_time = datetime.strptime(business_hours.get("start", "09:00"), "%H:%M").time()
-                end_time = datetime.strptime(business_hours.get("end", "22:00"), "%H:%M").time()
-                
-                if not (start_time <= now <= end_time):
-                    # 非营业时间
-                    ai = AIReply(message_id=message.id, model="business_hours", reply="您好，当前为非营业时间，我们会在营业时间内尽快回复您。营业时间：{} - {}".format(business_hours.get("start", "09:00"), business_hours.get("end", "22:00")), confidence=1.0, review_status="auto")
-                    db.session.add(ai)
-                    message.status = "answered"
-                    db.session.commit()
-                    return ProcessResult(reply="您好，当前为非营业时间，我们会在营业时间内尽快回复您。", source="business_hours", auto_send=True, confidence=1.0)
-        except Exception:
-            pass  # 营业时间解析失败，继续正常流程
-    
+    try:
+        business_hours = cfg.get("business_hours")
+        if business_hours:
+            now = datetime.now().time()
+            start_time = datetime.strptime(business_hours.get("start", "09:00"), "%H:%M").time()
+            end_time = datetime.strptime(business_hours.get("end", "22:00"), "%H:%M").time()
+
+            if not (start_time <= now <= end_time):
+                # 非营业时间
+                reply = "您好，当前为非营业时间，我们会在营业时间内尽快回复您。营业时间：{} - {}".format(
+                    business_hours.get("start", "09:00"), business_hours.get("end", "22:00"))
+                return _answer_directly(message, "business_hours", reply,
+                                        ProcessResult(reply="您好，当前为非营业时间，我们会在营业时间内尽快回复您。",
+                                                      source="business_hours", auto_send=True, confidence=1.0))
+    except Exception:
+        pass  # 营业时间解析失败，继续正常流程
+
+    return None
+
+
+def _prepare_message(message: Message) -> Tuple[Optional[ProcessResult], Optional[KBMatchResult], str]:
+    """规则检查与知识库匹配。
+
+    返回 (已完成的结果或 None, 知识库匹配, 店铺AI模型)。结果为 None 表示需要 AI 生成。
+    """
+    with span(STAGE_CONFIG_LOAD):
+        shop = db.session.get(Shop, message.shop_id)
+        cfg = _load_shop_config(shop)
+
+    with span(STAGE_RULE_CHECK):
+        ruled = _apply_shop_rules(message, cfg)
+    if ruled:
+        return ruled, None, "stub"
+
     # 正常的知识库和AI处理流程
-    kb = match_from_knowledge_base(message.shop_id, message.content)
+    with span(STAGE_KB_MATCH):
+        kb = match_from_knowledge_base(message.shop_id, message.content)
     if kb and kb.confidence >= 0.9:
         # 直接使用知识库答案
         ai = AIReply(message_id=message.id, model="kb", reply=kb.answer, confidence=kb.confidence, review_status="auto")
         db.session.add(ai)
         message.status = "answered"
-        db.session.commit()
-        return ProcessResult(reply=kb.answer, source="kb", auto_send=True, confidence=kb.confidence)
+        with span(STAGE_DB_COMMIT, model="kb"):
+            db.session.commit()
+        return ProcessResult(reply=kb.answer, source="kb", auto_send=True, confidence=kb.confidence), kb, "kb"
 
-    # 需要 AI 辅助
-    context = kb.answer if kb else None
     # 读取店铺AI模型配置
-    model = "stub"
-    if shop and shop.config_json:
-        try:
-            cfg = _json.loads(shop.config_json)
-            model = cfg.get("ai_model", "stub")
-        except Exception:
-            pass
-    
-    ai_text = generate_reply(prompt=message.content, context=context, model=model)
-    ai = AIReply(message_id=message.id, model=model, reply=ai_text, confidence=(kb.confidence if kb else 0.6), review_status="pending")
+    model = (cfg or {}).get("ai_model", "stub")
+    return None, kb, model
+
+
+def _queue_ai_reply(message: Message, model: str, ai_text: str, kb: Optional[KBMatchResult]) -> ProcessResult:
+    """记录AI建议回复并进入审核队列（不提交）"""
+    confidence = kb.confidence if kb else 0.6
+    ai = AIReply(message_id=message.id, model=model, reply=ai_text, confidence=confidence, review_status="pending")
     db.session.add(ai)
     db.session.add(AuditQueueItem(message_id=message.id, status="pending"))
     message.status = "review"
-    db.session.commit()
-    
-    # 更新统计数据
-    update_daily_statistics(message.shop_id, "ai", False)
-    
-    return ProcessResult(reply=ai_text, source="ai", auto_send=False, confidence=kb.confidence if kb else 0.6)
+    return ProcessResult(reply=ai_text, source="ai", auto_send=False, confidence=confidence)
+
+
+def process_message(message: Message) -> ProcessResult:
+    with tracer.trace(shop_id=message.shop_id):
+        started = time.perf_counter()
+        with span(STAGE_PIPELINE):
+            done, kb, model = _prepare_message(message)
+            if done:
+                tracer.set_attrs(model=done.source)
+            else:
+                # 需要 AI 辅助
+                tracer.set_attrs(model=model)
+                context = kb.answer if kb else None
+                with span(STAGE_LLM_CALL):
+                    ai_text = generate_reply(prompt=message.content, context=context, model=model)
+                done = _queue_ai_reply(message, model, ai_text, kb)
+                with span(STAGE_DB_COMMIT):
+                    db.session.commit()
+
+        # 更新统计数据
+        update_daily_statistics(message.shop_id, done.source, done.auto_send,
+                                latency=time.perf_counter() - started,
+                                model=model if done.source == "ai" else done.source,
+                                confidence=done.confidence)
+    return done
+
+
+def process_messages_batch(messages: List[Message]) -> List[ProcessResult]:
+    """批量处理消息（审核队列积压时使用）。
+
+    规则与知识库命中的消息逐条处理；需要 AI 的消息按 (店铺, 模型) 分组，
+    每组通过 generate_replies_batch 合并请求，回复拆分写回各自的 AIReply。
+    返回与输入顺序一致的处理结果。
+    """
+    results: List[Optional[ProcessResult]] = [None] * len(messages)
+    pending: Dict[Tuple[int, str], List[Tuple[int, Message, Optional[KBMatchResult]]]] = {}
+
+    for idx, message in enumerate(messages):
+        started = time.perf_counter()
+        with tracer.trace(shop_id=message.shop_id):
+            done, kb, model = _prepare_message(message)
+        if done:
+            results[idx] = done
+            update_daily_statistics(message.shop_id, done.source, done.auto_send,
+                                    latency=time.perf_counter() - started, model=done.source,
+                                    confidence=done.confidence)
+            continue
+        pending.setdefault((message.shop_id, model), []).append((idx, message, kb))
+
+    for (shop_id, model), group in pending.items():
+        started = time.perf_counter()
+        # 批量请求按整组记一次耗时
+        with span(STAGE_LLM_CALL, shop_id=shop_id, model=model):
+            replies = generate_replies_batch(
+                [(message.content, kb.answer if kb else None) for _, message, kb in group],
+                model=model,
+            )
+        for (idx, message, kb), ai_text in zip(group, replies):
+            results[idx] = _queue_ai_reply(message, model, ai_text, kb)
+        with span(STAGE_DB_COMMIT, shop_id=shop_id, model=model):
+            db.session.commit()
 
+        # 整组共用一次请求，延迟只记一个样本（本组请求与提交的耗时），其余消息只计数
+        latency = time.perf_counter() - started
+        for n, (idx, _, _) in enumerate(group):
+            update_daily_statistics(shop_id, "ai", False, latency=latency if n == 0 else None,
+                                    model=model, confidence=results[idx].confidence)
 
+    # 每个位置都已由逐条处理或分组 AI 填入，原样返回以保持与输入一一对应
+    return results
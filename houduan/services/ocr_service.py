@@ -0,0 +1,358 @@
+"""
+OCR 服务：常驻进程池 + 任务队列
+
+- 每个工作进程在启动时加载一份 PaddleOCR 模型并常驻，异常时先原地重试，
+  连续失败才在该进程内重建模型，不再因一次异常重载整个客户端
+- 调用方通过任务队列提交图像，分发线程在短时间窗口内合并多个任务为一批，
+  多个店铺同时变化时一次进程往返完成整批识别
+- 图像像素通过 multiprocessing.shared_memory 传给工作进程，避免序列化大数组
+- 记录提交/完成/失败计数、批大小与延迟分位数，供 /health 展示；
+  调用方等待超时单独计入 timeouts（任务仍在执行，结束时照常计入完成或失败）
+
+环境变量：
+- OCR_WORKERS: 工作进程数，默认 2；为 0 时退化为进程内调用（模型常驻本进程，串行识别）
+- OCR_BATCH_SIZE: 单批最大任务数，默认 8
+- OCR_BATCH_WINDOW_MS: 合批等待窗口（毫秒），默认 20
+- OCR_TIMEOUT: 单个任务等待结果的超时（秒），默认 30
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+MIN_CONFIDENCE = 0.5
+
+# ---------------------------------------------------------------------------
+# 工作进程侧
+# ---------------------------------------------------------------------------
+
+def _default_engine_factory():
+    """默认 OCR 引擎：中文 PaddleOCR，关闭日志"""
+    from paddleocr import PaddleOCR  # type: ignore
+
+    return PaddleOCR(use_angle_cls=True, lang='ch', show_log=False)
+
+
+def parse_ocr_result(result) -> str:
+    """提取 PaddleOCR 结果中置信度足够的文本行"""
+    lines: List[str] = []
+    for page in result or []:
+        for _, (text, conf) in page or []:
+            if text and conf > MIN_CONFIDENCE:
+                lines.append(text)
+    return "\n".join(lines)
+
+
+class _EngineSlot:
+    """常驻模型：按需加载，失败时原地重试一次，再失败才重建模型"""
+
+    def __init__(self, factory: Optional[Callable[[], Any]] = None):
+        self.factory = factory or _default_engine_factory
+        self.engine = None
+
+    def load(self) -> None:
+        try:
+            self.engine = self.factory()
+        except Exception as e:  # 首次加载失败时在第一个任务中重试
+            self.engine = None
+            logger.warning(f"OCR engine load failed: {e}")
+
+    def run(self, pixels: np.ndarray) -> str:
+        last_error: Optional[Exception] = None
+        for attempt in range(3):
+            try:
+                if self.engine is None:
+                    self.engine = self.factory()
+                return parse_ocr_result(self.engine.ocr(pixels, cls=True))
+            except Exception as e:
+                last_error = e
+                if attempt == 1:
+                    self.engine = None
+        raise RuntimeError(f"ocr failed: {last_error}")
+
+
+_worker_slot: Optional[_EngineSlot] = None
+
+
+def _worker_init(factory: Optional[Callable[[], Any]] = None) -> None:
+    """工作进程初始化：加载模型并常驻"""
+    global _worker_slot
+    _worker_slot = _EngineSlot(factory)
+    _worker_slot.load()
+
+
+def _worker_ocr_batch(descriptors: List[Tuple[str, Tuple[int, ...], str]]) -> List[Tuple[str, Optional[str]]]:
+    """工作进程入口：按共享内存描述符依次识别，返回 [(text, error)]"""
+    results: List[Tuple[str, Optional[str]]] = []
+    for name, shape, dtype in descriptors:
+        shm = None
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            pixels = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            try:
+                if _worker_slot is None:
+                    _worker_init()
+                results.append((_worker_slot.run(pixels), None))
+            finally:
+                del pixels
+        except Exception as e:
+            results.append(("", str(e)))
+        finally:
+            if shm is not None:
+                shm.close()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 调用方侧
+# ---------------------------------------------------------------------------
+
+
+class _OCRJob:
+    __slots__ = ("pixels", "future", "submitted_at")
+
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels
+        self.future: Future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class OCRService:
+    """OCR 进程池服务"""
+
+    def __init__(self, workers: Optional[int] = None, batch_size: Optional[int] = None,
+                 batch_window_ms: Optional[float] = None,
+                 engine_factory: Optional[Callable[[], Any]] = None,
+                 mp_context: Optional[str] = None):
+        self.workers = int(workers if workers is not None else os.environ.get("OCR_WORKERS", 2))
+        self.batch_size = int(batch_size or os.environ.get("OCR_BATCH_SIZE", 8))
+        self.batch_window = float(batch_window_ms if batch_window_ms is not None
+                                  else os.environ.get("OCR_BATCH_WINDOW_MS", 20)) / 1000.0
+        self.timeout = float(os.environ.get("OCR_TIMEOUT", 30))
+        self._engine_factory = engine_factory
+        self._mp_context = mp_context
+
+        self._queue: "queue.Queue[_OCRJob]" = queue.Queue()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        # 未启用进程池时的进程内模型；PaddleOCR 实例非线程安全，调用串行化
+        self._local_slot = _EngineSlot(engine_factory)
+        self._local_lock = threading.Lock()
+
+        # 计数在调用线程、分发线程与结果回调中并发更新
+        self._stats_lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=500)
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "timeouts": 0,
+            "batches": 0, "batched_jobs": 0, "pool_restarts": 0,
+            "last_error": None,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        """进程池可用：配置了工作进程且 OCR 引擎可用"""
+        if self.workers <= 0:
+            return False
+        return self._engine_available()
+
+    def _engine_available(self) -> bool:
+        return self._engine_factory is not None or importlib.util.find_spec("paddleocr") is not None
+
+    def _count(self, key: str, n: int = 1, error: Optional[str] = None) -> None:
+        with self._stats_lock:
+            self._stats[key] += n
+            if error is not None:
+                self._stats["last_error"] = error
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._pool is None:
+                ctx = multiprocessing.get_context(self._mp_context) if self._mp_context else None
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=ctx,
+                    initializer=_worker_init, initargs=(self._engine_factory,),
+                )
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._stopped = False
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="ocr-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def submit(self, image) -> Future:
+        """提交识别任务，返回 Future[str]"""
+        pixels = np.ascontiguousarray(
+            np.asarray(image.convert('RGB')) if isinstance(image, Image.Image) else np.asarray(image)
+        )
+        job = _OCRJob(pixels)
+        self._count("submitted")
+        if not self.enabled:
+            job.future.set_result(self._recognize_in_process(pixels))
+            return job.future
+        self._ensure_started()
+        self._queue.put(job)
+        return job.future
+
+    def _recognize_in_process(self, pixels: np.ndarray) -> str:
+        """进程内识别（未配置工作进程或未安装 PaddleOCR 时），未安装时返回空字符串"""
+        if not self._engine_available():
+            return ""
+        try:
+            with self._local_lock:
+                text = self._local_slot.run(pixels)
+        except Exception as e:
+            self._count("failed", error=str(e))
+            return ""
+        self._count("completed")
+        return text
+
+    def wait(self, future: Future, timeout: Optional[float] = None) -> str:
+        """等待识别结果，超时返回空字符串并计入 timeouts"""
+        timeout = timeout or self.timeout
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeout:
+            # 任务仍在队列或工作进程中，由分发线程计入完成 / 失败
+            self._count("timeouts", error=f"timed out after {timeout}s")
+            return ""
+
+    def recognize(self, image, timeout: Optional[float] = None) -> str:
+        """同步识别，超时或失败返回空字符串"""
+        return self.wait(self.submit(image), timeout)
+
+    def _dispatch_loop(self) -> None:
+        while not self._stopped:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_OCRJob]) -> None:
+        segments: List[shared_memory.SharedMemory] = []
+        descriptors = []
+        try:
+            for job in batch:
+                shm = shared_memory.SharedMemory(create=True, size=max(job.pixels.nbytes, 1))
+                np.ndarray(job.pixels.shape, dtype=job.pixels.dtype, buffer=shm.buf)[...] = job.pixels
+                segments.append(shm)
+                descriptors.append((shm.name, job.pixels.shape, job.pixels.dtype.str))
+            future = self._pool.submit(_worker_ocr_batch, descriptors)
+        except Exception as e:
+            self._release(segments)
+            self._fail_batch(batch, e)
+            return
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["batched_jobs"] += len(batch)
+        future.add_done_callback(lambda f: self._on_batch_done(f, batch, segments))
+
+    def _on_batch_done(self, future: Future, batch: List[_OCRJob], segments) -> None:
+        self._release(segments)
+        try:
+            results = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart_pool()
+            self._fail_batch(batch, e)
+            return
+        now = time.perf_counter()
+        for job, (text, error) in zip(batch, results):
+            if error:
+                self._count("failed", error=error)
+            else:
+                self._count("completed")
+            self._latencies.append(now - job.submitted_at)
+            job.future.set_result(text)
+
+    def _fail_batch(self, batch: List[_OCRJob], error: Exception) -> None:
+        logger.warning(f"OCR batch failed: {error}")
+        self._count("failed", len(batch), error=str(error))
+        for job in batch:
+            if not job.future.done():
+                job.future.set_result("")
+
+    @staticmethod
+    def _release(segments) -> None:
+        for shm in segments:
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+
+    def _restart_pool(self) -> None:
+        with self._lock:
+            old, self._pool = self._pool, None
+        self._count("pool_restarts")
+        if old is not None:
+            old.shutdown(wait=False)
+        self._ensure_started()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """健康与延迟指标"""
+        latencies = sorted(self._latencies)
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        def _pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        batches = stats["batches"]
+        return {
+            **stats,
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "running": self._pool is not None,
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": round(stats["batched_jobs"] / batches, 2) if batches else 0,
+            "latency_ms": {"p50": _pct(0.5), "p95": _pct(0.95), "p99": _pct(0.99)},
+        }
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+# 全局OCR服务
+ocr_service = OCRService()
+
+
+def recognize_text(image) -> str:
+    """识别图像文本（进程池可用时走进程池，否则进程内执行）"""
+    return ocr_service.recognize(image)
+
+
+def get_ocr_stats() -> Dict[str, Any]:
+    """OCR服务指标"""
+    return ocr_service.get_stats()
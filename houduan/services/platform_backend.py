@@ -0,0 +1,190 @@
+"""
+千牛 UI 自动化平台后端
+
+把窗口枚举、激活、键盘输入与区域截图抽象为可插拔后端，
+使监控链路在非 Windows 环境（Linux 构建机、测试、回放压测）也能导入和运行。
+
+- win32:  pywin32 + pyautogui（生产环境，依赖在首次使用时才导入）
+- null:   无窗口、无截图的空实现（非 Windows 默认）
+- replay: 以录制的截图帧作为"屏幕"，记录发送的文本（见 services/replay.py）
+
+环境变量 QIANNIU_PLATFORM 可显式指定后端，默认 Windows 上为 win32，其余为 null。
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+Region = Tuple[int, int, int, int]
+
+
+class PlatformBackend:
+    """平台后端接口"""
+
+    name = "base"
+
+    def list_windows(self, keyword: str) -> List[str]:
+        raise NotImplementedError
+
+    def activate_window(self, title_keyword: str) -> bool:
+        raise NotImplementedError
+
+    def send_text(self, text: str) -> None:
+        raise NotImplementedError
+
+    def screenshot(self, region: Region) -> Image.Image:
+        raise NotImplementedError
+
+
+class Win32Backend(PlatformBackend):
+    """Windows 实现：pywin32 枚举/激活窗口，pyautogui 输入与截图"""
+
+    name = "win32"
+
+    def __init__(self):
+        import pyautogui
+        import win32con
+        import win32gui
+
+        self._pyautogui = pyautogui
+        self._win32con = win32con
+        self._win32gui = win32gui
+
+    def _find_windows(self, keyword: str):
+        found = []
+        win32gui = self._win32gui
+
+        def _enum_handler(hwnd, _):
+            if win32gui.IsWindowVisible(hwnd):
+                title = win32gui.GetWindowText(hwnd)
+                if title and keyword.lower() in title.lower():
+                    found.append((hwnd, title))
+
+        win32gui.EnumWindows(_enum_handler, None)
+        return found
+
+    def list_windows(self, keyword: str) -> List[str]:
+        return sorted({title for _, title in self._find_windows(keyword)})
+
+    def activate_window(self, title_keyword: str) -> bool:
+        found = self._find_windows(title_keyword)
+        if not found:
+            return False
+        target_hwnd = found[-1][0]
+
+        # 置顶并激活
+        self._win32gui.ShowWindow(target_hwnd, self._win32con.SW_RESTORE)
+        self._win32gui.SetForegroundWindow(target_hwnd)
+        time.sleep(0.3)
+        return True
+
+    def send_text(self, text: str) -> None:
+        # 将焦点窗口作为输入目标，输入并回车
+        self._pyautogui.typewrite(text, interval=0.02)
+        self._pyautogui.press('enter')
+
+    def screenshot(self, region: Region) -> Image.Image:
+        x, y, w, h = region
+        return self._pyautogui.screenshot(region=(x, y, w, h))
+
+
+class NullBackend(PlatformBackend):
+    """空实现：没有窗口，截图为白色画布"""
+
+    name = "null"
+
+    def list_windows(self, keyword: str) -> List[str]:
+        return []
+
+    def activate_window(self, title_keyword: str) -> bool:
+        return False
+
+    def send_text(self, text: str) -> None:
+        logger.warning("当前平台不支持UI自动化发送，已忽略")
+
+    def screenshot(self, region: Region) -> Image.Image:
+        _, _, w, h = region
+        return Image.new("RGB", (max(w, 1), max(h, 1)), (255, 255, 255))
+
+
+class ReplayBackend(PlatformBackend):
+    """回放实现：当前帧即屏幕，所有窗口视为存在，发送的文本记录在 sent 中"""
+
+    name = "replay"
+
+    def __init__(self, window_titles: Optional[List[str]] = None):
+        self.window_titles = window_titles
+        self.sent: List[str] = []
+        self._frame: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def set_frame(self, frame) -> None:
+        array = np.asarray(frame.convert("RGB")) if isinstance(frame, Image.Image) else np.asarray(frame, dtype=np.uint8)
+        with self._lock:
+            self._frame = array
+
+    @property
+    def frame(self) -> Optional[np.ndarray]:
+        return self._frame
+
+    def list_windows(self, keyword: str) -> List[str]:
+        if self.window_titles is None:
+            return [keyword]
+        return sorted(t for t in self.window_titles if keyword.lower() in t.lower())
+
+    def activate_window(self, title_keyword: str) -> bool:
+        return bool(self.list_windows(title_keyword))
+
+    def send_text(self, text: str) -> None:
+        self.sent.append(text)
+
+    def screenshot(self, region: Region) -> Image.Image:
+        x, y, w, h = region
+        with self._lock:
+            frame = self._frame
+        if frame is None:
+            return Image.new("RGB", (max(w, 1), max(h, 1)), (255, 255, 255))
+        return Image.fromarray(frame[max(y, 0):y + h, max(x, 0):x + w])
+
+
+_backend: Optional[PlatformBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _create_default_backend() -> PlatformBackend:
+    spec = os.environ.get("QIANNIU_PLATFORM") or ("win32" if sys.platform == "win32" else "null")
+    if spec == "replay":
+        return ReplayBackend()
+    if spec == "null":
+        return NullBackend()
+    try:
+        return Win32Backend()
+    except Exception as e:
+        logger.warning(f"Win32 UI 自动化不可用，使用空实现: {e}")
+        return NullBackend()
+
+
+def get_platform() -> PlatformBackend:
+    """获取当前平台后端（首次调用时按环境创建）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_default_backend()
+    return _backend
+
+
+def set_platform(backend: PlatformBackend) -> PlatformBackend:
+    """替换平台后端，返回原后端"""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
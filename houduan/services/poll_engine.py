@@ -0,0 +1,371 @@
+"""
+多店铺并行轮询引擎
+
+将轮询拆成两类工作：
+- 与窗口焦点无关的工作（红点检测、区域哈希、OCR）：提交到线程池并行执行
+- 依赖窗口焦点的 UI 自动化（枚举窗口、整帧截图、激活窗口并发送）：
+  统一走单线程的 UI 通道串行执行，避免多个线程同时抢焦点
+
+每个店铺维护独立的自适应轮询间隔：捕获到新消息后回落到最小间隔，
+空闲时按退避系数逐步放大到最大间隔。调度器以较短的节拍调用 run_tick，
+只处理到期的店铺，单机可支撑数十个店铺且延迟有上界。
+
+事件触发：调度器以约 250ms 的节拍先调用 run_probe，只截取各店铺的红点区域
+并做降采样红点评分与粗粒度签名（开销极小）。签名变化且出现未读红点时
+立即把店铺标记为到期，由 run_tick 升级到哈希/OCR；探测无变化时探测间隔
+指数退避。完整轮询退化为兜底的低频校验。
+
+节拍等待超时的轮询仍在线程池中运行：店铺在结束前不会被重复提交，
+结束后的结果（其消息已被去重 / 差分标记为已见）由下一个节拍返回，不会丢失。
+
+环境变量：
+- POLL_WORKERS: 检测线程数，默认 min(8, CPU 核数)
+- POLL_MIN_INTERVAL / POLL_MAX_INTERVAL: 单店铺轮询间隔上下限（秒），默认 2 / 30
+- POLL_BACKOFF: 空闲退避系数，默认 1.5
+- POLL_TICK_TIMEOUT: 单个节拍等待检测结果的超时（秒），默认 20
+- POLL_PROBE: 是否启用红点探测触发，默认 1
+- POLL_PROBE_MIN_MS / POLL_PROBE_MAX_MS: 单店铺探测间隔上下限（毫秒），默认 250 / 2000
+- POLL_PROBE_DOWNSAMPLE: 探测时红点评分的采样步长，默认 4
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from . import qianniu_monitor
+from .screen_capture import grab_frame
+from ..utils.tracing import STAGE_UI_SEND, span
+
+DEFAULT_REGION = [0, 700, 300, 300]
+
+# (shop_id, qianniu_title, config)
+ShopSpec = Tuple[int, Optional[str], Dict[str, Any]]
+
+
+@dataclass
+class ShopPollState:
+    """单个店铺的轮询状态"""
+
+    shop_id: int
+    interval: float
+    next_due: float = 0.0
+    last_score: float = 0.0
+    last_polled: float = 0.0
+    captured: int = 0
+    window_ok: bool = False
+    in_flight: bool = False  # 已提交到线程池、尚未结束的轮询
+    probe_interval: float = 0.0
+    next_probe: float = 0.0
+    probe_signature: Optional[Tuple] = None
+
+
+class UILane:
+    """UI 自动化串行通道：所有依赖窗口焦点的操作在同一个线程中依次执行"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ui-lane")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _done(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def pending(self) -> int:
+        """排队中与执行中的任务数"""
+        return self._pending
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """提交并等待结果"""
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class PollEngine:
+    """多店铺轮询引擎"""
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None,
+                 backoff: Optional[float] = None,
+                 poll_fn: Optional[Callable] = None,
+                 window_check_fn: Optional[Callable[[str], bool]] = None,
+                 grab_fn: Optional[Callable] = None):
+        self.max_workers = max_workers or int(os.environ.get("POLL_WORKERS", min(8, os.cpu_count() or 1)))
+        self.min_interval = float(min_interval if min_interval is not None else os.environ.get("POLL_MIN_INTERVAL", 2))
+        self.max_interval = float(max_interval if max_interval is not None else os.environ.get("POLL_MAX_INTERVAL", 30))
+        self.backoff = float(backoff if backoff is not None else os.environ.get("POLL_BACKOFF", 1.5))
+        self.tick_timeout = float(os.environ.get("POLL_TICK_TIMEOUT", 20))
+        self.probe_enabled = os.environ.get("POLL_PROBE", "1") not in ("0", "false", "False")
+        self.probe_min_interval = float(os.environ.get("POLL_PROBE_MIN_MS", 250)) / 1000.0
+        self.probe_max_interval = float(os.environ.get("POLL_PROBE_MAX_MS", 2000)) / 1000.0
+        self.probe_downsample = int(os.environ.get("POLL_PROBE_DOWNSAMPLE", 4))
+
+        # 可替换的执行函数，便于在无窗口环境下测试
+        self._poll_fn = poll_fn or qianniu_monitor.poll_and_capture_messages
+        self._window_check_fn = window_check_fn or (lambda title: bool(qianniu_monitor.list_windows_by_title(title)))
+        self._grab_fn = grab_fn or grab_frame
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.ui_lane = UILane()
+        self._states: Dict[int, ShopPollState] = {}
+        self._late: List[Tuple[int, Dict[str, Any], Any]] = []  # 超时后才完成的轮询
+        self._lock = threading.Lock()
+        self._stats = {"ticks": 0, "polled": 0, "errors": 0, "timeouts": 0, "late_results": 0,
+                       "last_tick_seconds": 0.0, "probes": 0, "escalations": 0, "last_probe_seconds": 0.0}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="poll-worker")
+        return self._pool
+
+    def _state(self, shop_id: int) -> ShopPollState:
+        state = self._states.get(shop_id)
+        if state is None:
+            state = ShopPollState(shop_id=shop_id, interval=self.min_interval,
+                                  probe_interval=self.probe_min_interval)
+            self._states[shop_id] = state
+        return state
+
+    def due_shops(self, shops: List[ShopSpec], now: float) -> List[ShopSpec]:
+        """筛选到期且开启自动模式的店铺（上一次轮询仍在执行的店铺跳过）"""
+        due = []
+        with self._lock:
+            for shop_id, title, cfg in shops:
+                if not cfg.get("auto_mode", False):
+                    continue
+                state = self._state(shop_id)
+                if state.next_due <= now and not state.in_flight:
+                    due.append((shop_id, title, cfg))
+        return due
+
+    def record_result(self, shop_id: int, score: float, texts: List[str], threshold: float, now: float) -> None:
+        """根据本次结果调整店铺的轮询间隔"""
+        with self._lock:
+            state = self._state(shop_id)
+            state.last_score = score
+            state.last_polled = now
+            if texts:
+                state.interval = self.min_interval
+                state.captured += len(texts)
+            elif score < threshold:
+                state.interval = min(self.max_interval, state.interval * self.backoff)
+            # 有红点但内容未变化：保持当前间隔
+            state.next_due = now + state.interval
+
+    def _defer(self, shop_id: int, now: float) -> None:
+        """窗口不存在时按最大间隔推迟，并暂停探测"""
+        with self._lock:
+            state = self._state(shop_id)
+            state.interval = self.max_interval
+            state.next_due = now + state.interval
+            state.window_ok = False
+
+    @staticmethod
+    def probe_signature(pixels, threshold: float, downsample: int) -> Tuple:
+        """红点区域的廉价签名：(是否有未读, 量化红点占比, 4x4 粗粒度灰度)"""
+        score = qianniu_monitor.unread_score(pixels, downsample=downsample)
+        height, width = pixels.shape[:2]
+        coarse = pixels[::max(height // 4, 1), ::max(width // 4, 1)]
+        gray = (coarse[..., :3].astype("uint16").sum(axis=-1) // 3) >> 5 if coarse.size else coarse
+        return score >= threshold, round(score, 3), bytes(gray.astype("uint8").ravel())
+
+    def run_probe(self, shops: List[ShopSpec], now: Optional[float] = None) -> List[int]:
+        """高频探测：只截红点区域做降采样检测，签名变化且有未读时立即升级为完整轮询
+
+        返回本次被升级的店铺ID列表。
+        """
+        if not self.probe_enabled:
+            return []
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        targets = []
+        with self._lock:
+            for shop_id, _, cfg in shops:
+                if not cfg.get("auto_mode", False):
+                    continue
+                state = self._state(shop_id)
+                # 窗口未确认的店铺不探测；已到期的店铺本节拍会完整轮询，无需探测
+                if state.window_ok and state.next_probe <= now and state.next_due > now:
+                    targets.append((shop_id, cfg))
+        if not targets:
+            return []
+
+        regions = [cfg.get("ocr_region", DEFAULT_REGION) for _, cfg in targets]
+        try:
+            frame = self.ui_lane.run(self._grab_fn, regions, timeout=self.tick_timeout)
+        except Exception as e:
+            logger.warning(f"probe grab failed: {e}")
+            return []
+
+        escalated = []
+        with self._lock:
+            for shop_id, cfg in targets:
+                state = self._state(shop_id)
+                threshold = float(cfg.get("unread_threshold", 0.02))
+                signature = self.probe_signature(frame.view(tuple(cfg.get("ocr_region", DEFAULT_REGION))),
+                                                 threshold, self.probe_downsample)
+                changed = signature != state.probe_signature
+                state.probe_signature = signature
+                if changed and signature[0]:
+                    # 有未读且画面变化：立即升级为完整轮询
+                    state.next_due = now
+                    state.probe_interval = self.probe_min_interval
+                    escalated.append(shop_id)
+                elif changed:
+                    state.probe_interval = self.probe_min_interval
+                else:
+                    state.probe_interval = min(self.probe_max_interval, state.probe_interval * 2)
+                state.next_probe = now + state.probe_interval
+        self._stats["probes"] += 1
+        self._stats["escalations"] += len(escalated)
+        self._stats["last_probe_seconds"] = time.perf_counter() - start
+        return escalated
+
+    def _prepare_on_ui_lane(self, due: List[ShopSpec]):
+        """UI 通道内：检查窗口并抓取本节拍共享的一帧"""
+        alive = []
+        for shop_id, title, cfg in due:
+            if title and not self._window_check_fn(title):
+                logger.info(f"No windows found for shop {shop_id} with title '{title}'")
+                continue
+            alive.append((shop_id, title, cfg))
+
+        frame = None
+        regions = []
+        for _, _, cfg in alive:
+            regions.append(cfg.get("ocr_region", DEFAULT_REGION))
+            if cfg.get("chat_region"):
+                regions.append(cfg["chat_region"])
+        if regions:
+            try:
+                frame = self._grab_fn(regions)
+            except Exception as e:
+                logger.warning(f"shared frame grab failed, fallback to per-region capture: {e}")
+        return alive, frame
+
+    def _collect(self, shop_id: int, cfg: Dict[str, Any], future, now: float) -> Tuple[int, float, List[str]]:
+        """取出一次轮询的结果并调整间隔"""
+        try:
+            score, texts = future.result()
+        except Exception as e:
+            logger.warning(f"poll failed for shop={shop_id}: {e}")
+            self._stats["errors"] += 1
+            score, texts = 0.0, []
+        if isinstance(texts, str):
+            texts = [texts] if texts else []
+        self.record_result(shop_id, score, texts, float(cfg.get("unread_threshold", 0.02)), now)
+        return shop_id, score, texts
+
+    def _on_late_done(self, future, shop_id: int, cfg: Dict[str, Any]) -> None:
+        # 节拍超时后才结束的轮询：结果已通过去重 / 差分标记为已见，必须交给下个节拍返回，否则消息永久丢失
+        with self._lock:
+            self._late.append((shop_id, cfg, future))
+            self._state(shop_id).in_flight = False
+
+    def _drain_late(self, now: float) -> List[Tuple[int, float, List[str]]]:
+        with self._lock:
+            late, self._late = self._late, []
+        if late:
+            self._stats["late_results"] += len(late)
+        return [self._collect(shop_id, cfg, future, now) for shop_id, cfg, future in late]
+
+    def run_tick(self, shops: List[ShopSpec], now: Optional[float] = None) -> List[Tuple[int, float, List[str]]]:
+        """执行一个节拍，返回 [(shop_id, score, texts)]
+
+        包含本节拍轮询完成的店铺，以及上个节拍超时后才完成的轮询结果。
+        """
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        results = self._drain_late(now)
+        due = self.due_shops(shops, now)
+        if not due:
+            return results
+
+        alive, frame = self.ui_lane.run(self._prepare_on_ui_lane, due, timeout=self.tick_timeout)
+        alive_ids = {shop_id for shop_id, _, _ in alive}
+        for shop_id, _, _ in due:
+            if shop_id not in alive_ids:
+                self._defer(shop_id, now)
+        with self._lock:
+            for shop_id in alive_ids:
+                self._state(shop_id).window_ok = True
+
+        futures = {}
+        for shop_id, _, cfg in alive:
+            # 轮询结束（本节拍取回或超时后由回调转交）前不再重复提交
+            with self._lock:
+                self._state(shop_id).in_flight = True
+            futures[self.pool.submit(self._poll_fn, cfg, shop_id, frame=frame)] = (shop_id, cfg)
+        polled = 0
+        try:
+            for future in as_completed(futures, timeout=self.tick_timeout):
+                shop_id, cfg = futures.pop(future)
+                results.append(self._collect(shop_id, cfg, future, now))
+                polled += 1
+                with self._lock:
+                    self._state(shop_id).in_flight = False
+        except FuturesTimeout:
+            self._stats["timeouts"] += 1
+            logger.warning(f"poll tick timed out after {self.tick_timeout}s, {len(futures)} shops pending")
+            for future, (shop_id, cfg) in futures.items():
+                # 已结束的 future 会立即在当前线程执行回调
+                future.add_done_callback(lambda f, _sid=shop_id, _cfg=cfg: self._on_late_done(f, _sid, _cfg))
+
+        self._stats["ticks"] += 1
+        self._stats["polled"] += polled
+        self._stats["last_tick_seconds"] = time.perf_counter() - start
+        return results
+
+    def activate_and_send(self, title_kw: str, text: str, timeout: Optional[float] = None) -> bool:
+        """在 UI 通道内激活窗口并发送文本，保证两步之间焦点不被其他任务抢走"""
+        def _send():
+            if not qianniu_monitor.activate_window_by_title(title_kw):
+                return False
+            qianniu_monitor.send_text_in_active_window(text)
+            return True
+        # 含排队等待 UI 通道的时间
+        with span(STAGE_UI_SEND):
+            return self.ui_lane.run(_send, timeout=timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            shops = {
+                sid: {"interval": round(st.interval, 2), "next_due": st.next_due,
+                      "probe_interval": round(st.probe_interval, 3),
+                      "last_score": st.last_score, "captured": st.captured}
+                for sid, st in self._states.items()
+            }
+        return {**self._stats, "workers": self.max_workers, "shops": shops}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self.ui_lane.shutdown()
+
+
+# 全局轮询引擎
+poll_engine = PollEngine()
+
+
+def activate_and_send(title_kw: str, text: str) -> bool:
+    """通过 UI 通道串行发送消息"""
+    return poll_engine.activate_and_send(title_kw, text)
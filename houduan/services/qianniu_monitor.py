@@ -6,78 +6,51 @@
 - 激活窗口并发送测试文本（用于验证自动化可行性）
 
 注意：
-- 需在 Windows 上运行，且已安装 pywin32、pyautogui
+- 窗口与截图操作由平台后端提供（见 platform_backend），生产环境需在 Windows 上运行，
+  且已安装 pywin32、pyautogui；其他平台可使用 null/replay 后端运行与回放
 - 运行前请确保千牛客户端已登录并可见
 """
 
 from __future__ import annotations
 
 import time
-import hashlib
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple, Set, Dict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 
-import pyautogui
-import win32gui
-import win32con
+import numpy as np
 from PIL import Image
-import imagehash
 
-# 可选OCR依赖（PaddleOCR），未安装时降级为空实现
-try:
-    from paddleocr import PaddleOCR  # type: ignore
-    _ocr_client: Optional[PaddleOCR] = None
-except Exception:  # pragma: no cover - 环境未装OCR
-    PaddleOCR = None  # type: ignore
-    _ocr_client = None
+from .platform_backend import get_platform
+from .screen_capture import CapturedFrame
+from .ocr_service import ocr_service, recognize_text
+from .change_detect import dhash_int, hamming, hash_hex, to_gray
+from .chat_diff import chat_differ
+from .dedupe_store import dedupe_store, message_fingerprint
+from ..utils.cache_manager import cache_manager
 
-# 消息去重缓存（内存中，重启后清空）
-_message_cache: Set[str] = set()
-_cache_cleanup_time = datetime.now()
+# 可选连通域标记（scipy），未安装时使用纯 Python 回退
+try:
+    from scipy import ndimage as _ndimage  # type: ignore
+except Exception:  # pragma: no cover - 环境未装scipy
+    _ndimage = None
 
-# 图像哈希缓存：存储区域的最近哈希值
-_region_hash_cache: Dict[str, str] = {}
-_ocr_result_cache: Dict[str, Tuple[str, datetime]] = {}  # 哈希 -> (文本, 时间)
+# 图像哈希缓存：存储区域的最近哈希值；OCR结果缓存：图像哈希 -> 文本
+# 均为线程安全的 LRU+TTL 缓存，注册到缓存管理器后命中率可在 /health 查看
+_region_hash_cache = cache_manager.create_memory_cache("qianniu_region_hash", max_size=500, default_ttl=3600)
+_ocr_result_cache = cache_manager.create_memory_cache("qianniu_ocr_result", max_size=500, default_ttl=300)
 
 
 def list_windows_by_title(keyword: str) -> List[str]:
-    titles: List[str] = []
-
-    def _enum_handler(hwnd, _):
-        if win32gui.IsWindowVisible(hwnd):
-            title = win32gui.GetWindowText(hwnd)
-            if title and keyword.lower() in title.lower():
-                titles.append(title)
-
-    win32gui.EnumWindows(_enum_handler, None)
-    return sorted(set(titles))
+    return get_platform().list_windows(keyword)
 
 
 def activate_window_by_title(title_keyword: str) -> bool:
-    target_hwnd = None
-
-    def _enum_handler(hwnd, _):
-        nonlocal target_hwnd
-        if win32gui.IsWindowVisible(hwnd):
-            title = win32gui.GetWindowText(hwnd)
-            if title and title_keyword.lower() in title.lower():
-                target_hwnd = hwnd
-
-    win32gui.EnumWindows(_enum_handler, None)
-    if not target_hwnd:
-        return False
-
-    # 置顶并激活
-    win32gui.ShowWindow(target_hwnd, win32con.SW_RESTORE)
-    win32gui.SetForegroundWindow(target_hwnd)
-    time.sleep(0.3)
-    return True
+    return get_platform().activate_window(title_keyword)
 
 
 def send_text_in_active_window(text: str) -> None:
     # 将焦点窗口作为输入目标，输入并回车
-    pyautogui.typewrite(text, interval=0.02)
-    pyautogui.press('enter')
+    get_platform().send_text(text)
 
 
 def screenshot_region(region: Tuple[int, int, int, int]) -> Image.Image:
@@ -85,152 +58,212 @@ def screenshot_region(region: Tuple[int, int, int, int]) -> Image.Image:
 
     region: (x, y, width, height)
     """
-    x, y, w, h = region
-    shot = pyautogui.screenshot(region=(x, y, w, h))
-    return shot
-
-
-def ocr_text_with_retry(image: Image.Image, max_retries: int = 3) -> str:
-    """对截图进行OCR，带重试机制。
-
-    若未安装 PaddleOCR，将返回空字符串并提示调用方按需安装。
-    """
-    global _ocr_client
-    if PaddleOCR is None:
-        return ""
-    
-    for attempt in range(max_retries):
-        try:
-            if _ocr_client is None:
-                # 初始化中文模型，关闭日志
-                _ocr_client = PaddleOCR(use_angle_cls=True, lang='ch', show_log=False)
-            
-            result = _ocr_client.ocr(image, cls=True)
-            lines: List[str] = []
-            for page in result or []:
-                for _, (text, conf) in page:
-                    if text and conf > 0.5:  # 置信度过滤
-                        lines.append(text)
-            
-            if lines:  # 成功识别到文本
-                return "\n".join(lines)
-            elif attempt < max_retries - 1:  # 还有重试机会
-                time.sleep(0.5)  # 短暂等待后重试
-                continue
-            else:
-                return ""  # 所有重试都失败
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(1)  # 异常后等待更长时间
-                _ocr_client = None  # 重置客户端
-                continue
-            else:
-                # 最后一次尝试失败，记录错误但不抛出异常
-                return ""
+    return get_platform().screenshot(tuple(region))
 
 
 def ocr_text(image: Image.Image) -> str:
     """对截图进行OCR，尽可能返回文本（保持向后兼容）"""
-    return ocr_text_with_retry(image)
-
-
-def unread_score(image: Image.Image) -> float:
+    return recognize_text(image)
+
+
+def _red_mask(pixels: np.ndarray) -> np.ndarray:
+    """红点像素掩码（简化阈值：R>180, G<80, B<80）"""
+    r = pixels[..., 0]
+    g = pixels[..., 1]
+    b = pixels[..., 2]
+    return (r > 180) & (g < 80) & (b < 80)
+
+
+def _filter_small_blobs(mask: np.ndarray, min_blob_pixels: int) -> np.ndarray:
+    """连通域过滤：去掉面积小于 min_blob_pixels 的红色斑块（孤立噪点）"""
+    if _ndimage is not None:
+        labels, count = _ndimage.label(mask)
+        if count == 0:
+            return mask
+        sizes = np.bincount(labels.ravel())
+        keep = sizes >= min_blob_pixels
+        keep[0] = False
+        return keep[labels]
+
+    # 无 scipy 时的纯 Python 四连通洪泛，只遍历红色像素
+    height, width = mask.shape
+    visited = np.zeros_like(mask)
+    result = np.zeros_like(mask)
+    for y0, x0 in zip(*np.nonzero(mask)):
+        if visited[y0, x0]:
+            continue
+        stack = [(y0, x0)]
+        visited[y0, x0] = True
+        blob = []
+        while stack:
+            y, x = stack.pop()
+            blob.append((y, x))
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < height and 0 <= nx < width and mask[ny, nx] and not visited[ny, nx]:
+                    visited[ny, nx] = True
+                    stack.append((ny, nx))
+        if len(blob) >= min_blob_pixels:
+            ys, xs = zip(*blob)
+            result[list(ys), list(xs)] = True
+    return result
+
+
+def unread_score(image, downsample: int = 1, min_blob_pixels: int = 0) -> float:
     """简单未读提示评分：统计红色像素占比。
 
     该评分用于辅助判断未读红点是否出现，范围[0,1]。
+
+    Args:
+        image: PIL 图像或 (H, W, 3) 数组（如共享帧的区域视图）
+        downsample: 采样步长，>1 时隔行隔列取样以减少计算量
+        min_blob_pixels: 连通域最小像素数（按采样后计），>1 时忽略零散红色噪点
     """
-    img = image.convert('RGB')
-    width, height = img.size
-    total = width * height
-    red_like = 0
-    for px in img.getdata():
-        r, g, b = px
-        if r > 180 and g < 80 and b < 80:  # 简化红点阈值
-            red_like += 1
-    return red_like / max(total, 1)
+    if isinstance(image, Image.Image):
+        pixels = np.asarray(image.convert('RGB'))
+    else:
+        pixels = np.asarray(image)
+    step = max(int(downsample), 1)
+    if step > 1:
+        pixels = pixels[::step, ::step]
+    total = pixels.shape[0] * pixels.shape[1] if pixels.ndim >= 2 else 0
+    if total == 0:
+        return 0.0
+
+    mask = _red_mask(pixels)
+    if min_blob_pixels > 1 and mask.any():
+        mask = _filter_small_blobs(mask, int(min_blob_pixels))
+    return float(np.count_nonzero(mask)) / total
 
 
 def generate_message_hash(text: str, shop_id: int) -> str:
-    """生成消息内容的哈希值用于去重"""
-    # 清理文本：去除多余空白、标点符号
-    cleaned_text = "".join(c for c in text if c.isalnum() or c.isspace()).strip()
-    # 生成哈希：内容 + 店铺ID + 时间窗口（5分钟）
-    time_window = datetime.now().replace(minute=(datetime.now().minute // 5) * 5, second=0, microsecond=0)
-    hash_input = f"{cleaned_text}:{shop_id}:{time_window.isoformat()}"
-    return hashlib.md5(hash_input.encode('utf-8')).hexdigest()
+    """生成消息内容的哈希值用于去重（店铺ID + 清洗后文本，不含时间窗口）"""
+    return f"{message_fingerprint(text, shop_id):016x}"
 
 
 def is_duplicate_message(text: str, shop_id: int) -> bool:
-    """检查消息是否重复"""
-    global _message_cache, _cache_cleanup_time
-    
-    # 定期清理缓存（每10分钟清理一次）
-    now = datetime.now()
-    if now - _cache_cleanup_time > timedelta(minutes=10):
-        _message_cache.clear()
-        _cache_cleanup_time = now
-    
+    """检查消息是否重复（按分钟分桶的滚动窗口，见 dedupe_store）"""
     if not text or not text.strip():
         return True
-    
-    message_hash = generate_message_hash(text, shop_id)
-    
-    if message_hash in _message_cache:
-        return True
-    
-    # 添加到缓存
-    _message_cache.add(message_hash)
-    return False
+    return dedupe_store.seen(text, shop_id)
+
+
+def _region_pixels(region: Tuple[int, int, int, int],
+                   frame: Optional[CapturedFrame] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """取区域的 (RGB, 灰度) 数组：共享帧覆盖时均为零拷贝切片（灰度平面每帧只算一次），
+    否则回退为单独截图"""
+    if frame is not None and frame.contains(region):
+        return frame.view(region), frame.gray_view(region)
+    pixels = np.asarray(screenshot_region(region).convert('RGB'))
+    return pixels, to_gray(pixels)
+
+
+@contextmanager
+def _stage(timings: Optional[Dict[str, float]], name: str):
+    """阶段计时：timings 为空时不计时"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
 
 
-def poll_and_capture(shop_config: dict, shop_id: int = 1) -> Tuple[float, str]:
-    """三层混合检测：红点检测 → 区域哈希对比 → OCR识别
+def poll_and_capture_messages(shop_config: dict, shop_id: int = 1,
+                              frame: Optional[CapturedFrame] = None,
+                              timings: Optional[Dict[str, float]] = None) -> Tuple[float, List[str]]:
+    """三层混合检测：红点检测 → 区域哈希对比 → 增量OCR识别
     
     shop_config keys:
       - ocr_region: [x,y,w,h] OCR检测区域
       - unread_threshold: float 0~1 未读阈值
       - hash_threshold: int (可选) 图像变化敏感度，默认5
+      - unread_downsample: int (可选) 红点检测采样步长，默认1
+      - unread_min_blob: int (可选) 红点最小连通像素数，默认0（不过滤）
+      - incremental_ocr: bool (可选) 只识别新滚入的气泡，默认True
+      - bubble_min_gap / bubble_min_height: int (可选) 气泡切分参数，默认2 / 6
     
-    返回: (score, text)
+    frame: 本周期共享的整帧截图（见 screen_capture），为空时按区域单独截图
+    timings: 可选，传入字典时累加各阶段耗时（秒）：capture/unread/hash/diff/ocr/dedupe
+    
+    返回: (score, texts) —— 每个新气泡一条文本
     """
     region = tuple(shop_config.get("ocr_region", [0, 700, 300, 300]))
     threshold = float(shop_config.get("unread_threshold", 0.02))
     hash_threshold = int(shop_config.get("hash_threshold", 5))
     
-    # 第一层：红点检测（最快）
-    img = screenshot_region(region)
-    score = unread_score(img)
+    # 第一层：红点检测（最快），直接在共享帧的 RGB 切片上计算
+    with _stage(timings, "capture"):
+        pixels, gray = _region_pixels(region, frame)
+    with _stage(timings, "unread"):
+        score = unread_score(pixels,
+                             downsample=int(shop_config.get("unread_downsample", 1)),
+                             min_blob_pixels=int(shop_config.get("unread_min_blob", 0)))
     
     if score < threshold:
         # 没有未读标识，直接返回
-        return score, ""
+        return score, []
     
-    # 第二层：区域哈希对比（判断内容是否变化）
+    # 第二层：区域哈希对比（判断内容是否变化），使用共享灰度平面上的整数 dHash
     cache_key = get_region_cache_key(shop_id, region)
     
-    if not has_region_changed(img, cache_key, hash_threshold):
+    with _stage(timings, "hash"):
+        changed = has_region_changed(gray, cache_key, hash_threshold)
+    if not changed:
         # 图像无变化，无需OCR
-        return score, ""
+        return score, []
     
     # 第三层：OCR识别（仅在内容变化时执行）
     chat_region = tuple(shop_config.get("chat_region", region))
-    chat_img = screenshot_region(chat_region)
-    
-    # 使用带缓存的OCR
-    text = ocr_text_cached(chat_img)
-    
-    # 去重检查
-    if is_duplicate_message(text, shop_id):
-        return score, ""  # 重复消息，返回空文本
-    
-    return score, text or ""
+    with _stage(timings, "capture"):
+        chat_pixels, chat_gray = _region_pixels(chat_region, frame)
+    
+    if shop_config.get("incremental_ocr", True):
+        # 与上一帧逐气泡比对，只识别新滚入的气泡；气泡内容签名直接作为 OCR 缓存键
+        with _stage(timings, "diff"):
+            bubbles = chat_differ.diff(
+                get_region_cache_key(shop_id, chat_region), chat_gray,
+                min_gap=int(shop_config.get("bubble_min_gap", 2)),
+                min_height=int(shop_config.get("bubble_min_height", 6)),
+            )
+            images = [chat_pixels[b.top:b.bottom] for b in bubbles]
+            keys = [f"bubble:{b.signature}" for b in bubbles]
+    else:
+        images = [chat_pixels]
+        keys = [hash_hex(dhash_int(chat_gray))]
+    
+    with _stage(timings, "ocr"):
+        recognized = ocr_texts_cached(images, keys)
+    
+    texts = []
+    with _stage(timings, "dedupe"):
+        for text in recognized:
+            # 去重检查
+            if not is_duplicate_message(text, shop_id):
+                texts.append(text)
+    return score, texts
+
+
+def poll_and_capture(shop_config: dict, shop_id: int = 1,
+                     frame: Optional[CapturedFrame] = None) -> Tuple[float, str]:
+    """单条文本版本（保持向后兼容），多条新消息以换行拼接
 
+    返回: (score, text)
+    """
+    score, texts = poll_and_capture_messages(shop_config, shop_id, frame)
+    return score, "\n".join(texts)
 
-def calculate_image_hash(image: Image.Image) -> str:
-    """计算图像的感知哈希值用于快速对比"""
+
+def calculate_image_hash(image) -> str:
+    """计算图像的感知哈希值用于快速对比（十六进制，接受 PIL 图像或数组）"""
     # 使用差异哈希（dHash），对图像变化敏感
-    return str(imagehash.dhash(image, hash_size=8))
+    return hash_hex(_image_hash_int(image))
+
+
+def _image_hash_int(image) -> int:
+    pixels = np.asarray(image.convert('L')) if isinstance(image, Image.Image) else image
+    return dhash_int(pixels)
 
 
 def get_region_cache_key(shop_id: int, region: Tuple[int, int, int, int]) -> str:
@@ -238,34 +271,32 @@ def get_region_cache_key(shop_id: int, region: Tuple[int, int, int, int]) -> str
     return f"shop_{shop_id}_region_{region[0]}_{region[1]}_{region[2]}_{region[3]}"
 
 
-def has_region_changed(image: Image.Image, cache_key: str, 
+def has_region_changed(image, cache_key: str, 
                        hash_threshold: int = 5) -> bool:
     """检测区域图像是否发生变化
     
     Args:
-        image: 当前截图
+        image: 当前截图（PIL 图像，或 RGB/灰度数组，推荐传入共享帧的灰度切片）
         cache_key: 缓存键
         hash_threshold: 哈希差异阈值（默认5，值越小越敏感）
     
     Returns:
         True if 图像有变化，False otherwise
     """
-    global _region_hash_cache
+    current_hash = _image_hash_int(image)
+    last_hash = _region_hash_cache.get(cache_key)
     
-    current_hash = calculate_image_hash(image)
-    
-    if cache_key not in _region_hash_cache:
+    if last_hash is None:
         # 首次检测，记录并返回True
-        _region_hash_cache[cache_key] = current_hash
+        _region_hash_cache.set(cache_key, current_hash)
         return True
     
-    # 计算哈希差异
-    last_hash = _region_hash_cache[cache_key]
-    hash_diff = imagehash.hex_to_hash(current_hash) - imagehash.hex_to_hash(last_hash)
+    # 计算哈希差异（64 位整数异或后 popcount）
+    hash_diff = hamming(current_hash, last_hash)
     
     if hash_diff > hash_threshold:
         # 图像有显著变化，更新缓存
-        _region_hash_cache[cache_key] = current_hash
+        _region_hash_cache.set(cache_key, current_hash)
         return True
     
     return False
@@ -273,33 +304,12 @@ def has_region_changed(image: Image.Image, cache_key: str,
 
 def get_cached_ocr_result(image_hash: str, max_age_seconds: int = 60) -> Optional[str]:
     """从缓存获取OCR结果"""
-    global _ocr_result_cache
-    
-    if image_hash in _ocr_result_cache:
-        text, timestamp = _ocr_result_cache[image_hash]
-        # 检查缓存是否过期
-        if (datetime.now() - timestamp).total_seconds() < max_age_seconds:
-            return text
-        else:
-            # 过期，删除缓存
-            del _ocr_result_cache[image_hash]
-    
-    return None
+    return _ocr_result_cache.get(image_hash, max_age=max_age_seconds)
 
 
 def cache_ocr_result(image_hash: str, text: str):
-    """缓存OCR结果"""
-    global _ocr_result_cache
-    
-    # 限制缓存大小，超过100条时清理最旧的
-    if len(_ocr_result_cache) > 100:
-        # 按时间排序，删除最旧的20条
-        sorted_cache = sorted(_ocr_result_cache.items(), 
-                            key=lambda x: x[1][1])
-        for key, _ in sorted_cache[:20]:
-            del _ocr_result_cache[key]
-    
-    _ocr_result_cache[image_hash] = (text, datetime.now())
+    """缓存OCR结果（超出容量时淘汰最久未使用的条目）"""
+    _ocr_result_cache.set(image_hash, text)
 
 
 def ocr_text_cached(image: Image.Image) -> str:
@@ -312,8 +322,8 @@ def ocr_text_cached(image: Image.Image) -> str:
     if cached_result is not None:
         return cached_result
     
-    # 缓存未命中，执行OCR
-    text = ocr_text_with_retry(image)
+    # 缓存未命中，提交到OCR服务（进程池常驻模型，多店铺同时变化时合批识别）
+    text = recognize_text(image)
     
     # 缓存结果
     if text:
@@ -322,29 +332,29 @@ def ocr_text_cached(image: Image.Image) -> str:
     return text
 
 
+def ocr_texts_cached(images: List, hashes: Optional[List[str]] = None) -> List[str]:
+    """批量带缓存OCR：未命中的图像一次性提交到OCR服务，便于合批识别
+
+    images 可为 PIL 图像或数组；hashes 为调用方已算好的缓存键，缺省时按 dHash 计算。
+    """
+    if hashes is None:
+        hashes = [calculate_image_hash(image) for image in images]
+    texts: List[Optional[str]] = [get_cached_ocr_result(h) for h in hashes]
+    pending = {i: ocr_service.submit(images[i]) for i, text in enumerate(texts) if text is None}
+    for i, future in pending.items():
+        # 经由服务等待，超时计入 OCR 指标
+        texts[i] = ocr_service.wait(future)
+        if texts[i]:
+            cache_ocr_result(hashes[i], texts[i])
+    return [t for t in texts if t]
+
+
 def cleanup_caches():
-    """清理所有缓存"""
-    global _message_cache, _region_hash_cache, _ocr_result_cache
-    global _cache_cleanup_time
-    
-    now = datetime.now()
-    
-    # 清理消息缓存（每10分钟）
-    if now - _cache_cleanup_time > timedelta(minutes=10):
-        _message_cache.clear()
-        _cache_cleanup_time = now
-    
-    # 清理过期的OCR结果缓存（每5分钟）
-    expired_keys = []
-    for img_hash, (_, timestamp) in _ocr_result_cache.items():
-        if (now - timestamp).total_seconds() > 300:  # 5分钟过期
-            expired_keys.append(img_hash)
-    
-    for key in expired_keys:
-        del _ocr_result_cache[key]
-    
-    # 清理区域哈希缓存（如果超过50个店铺区域）
-    if len(_region_hash_cache) > 50:
-        _region_hash_cache.clear()
+    """清理所有缓存
+
+    OCR结果与区域哈希缓存按容量 LRU 淘汰、访问时惰性过期，无需定期全量扫描；
+    消息去重存储自行按分钟滚动过期，这里只负责落盘。
+    """
+    dedupe_store.maybe_flush()
 
 
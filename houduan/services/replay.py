@@ -0,0 +1,147 @@
+"""
+千牛监控回放驱动
+
+把一组录制的截图帧（带时间戳）按真实或加速的节奏喂给监控链路
+（截图切片 → 红点 → 区域哈希 → 增量 OCR → 去重），
+统计各阶段耗时分布与产出的消息数，用于在 Linux 构建机上度量轮询热路径的改动。
+
+帧目录约定：
+- 若存在 manifest.json：[{"file": "0001.png", "ts": 1700000000.25}, ...]
+- 否则按文件名排序，文件名开头的数字视为时间戳（秒，可带小数），
+  无法解析时按 default_interval 等间隔排列
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .platform_backend import ReplayBackend, set_platform
+from .screen_capture import CapturedFrame
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+@dataclass
+class ReplayFrame:
+    """一帧录制截图"""
+
+    timestamp: float
+    path: str
+
+
+def load_frames(directory: str, default_interval: float = 1.0) -> List[ReplayFrame]:
+    """读取帧目录，返回按时间排序的帧列表"""
+    manifest = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest):
+        with open(manifest, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        frames = [ReplayFrame(float(e["ts"]), os.path.join(directory, e["file"])) for e in entries]
+        return sorted(frames, key=lambda fr: fr.timestamp)
+
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    frames = []
+    for index, name in enumerate(names):
+        match = re.match(r"^(\d+(?:\.\d+)?)", name)
+        ts = float(match.group(1)) if match else index * default_interval
+        frames.append(ReplayFrame(ts, os.path.join(directory, name)))
+    return sorted(frames, key=lambda fr: fr.timestamp)
+
+
+@dataclass
+class ReplayReport:
+    """回放结果"""
+
+    frames: int = 0
+    messages: int = 0
+    wall_seconds: float = 0.0
+    stage_samples: Dict[str, List[float]] = field(default_factory=dict)
+    texts: List[str] = field(default_factory=list)
+
+    def stage_summary(self) -> Dict[str, Dict[str, float]]:
+        """各阶段耗时统计（毫秒）"""
+        summary = {}
+        for stage, samples in self.stage_samples.items():
+            values = np.asarray(samples) * 1000
+            summary[stage] = {
+                "count": int(values.size),
+                "mean_ms": round(float(values.mean()), 3),
+                "p50_ms": round(float(np.percentile(values, 50)), 3),
+                "p95_ms": round(float(np.percentile(values, 95)), 3),
+                "max_ms": round(float(values.max()), 3),
+            }
+        return summary
+
+    def to_dict(self) -> Dict:
+        return {
+            "frames": self.frames,
+            "messages": self.messages,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "fps": round(self.frames / self.wall_seconds, 2) if self.wall_seconds else 0,
+            "stages": self.stage_summary(),
+        }
+
+
+class ReplayDriver:
+    """回放驱动
+
+    speed: 0 表示不等待、尽快回放；1 为真实速度；N 为 N 倍速
+    sink: 可选，每帧产出的消息列表回调（例如写入 Message 表）
+    """
+
+    def __init__(self, frames: List[ReplayFrame], shop_config: dict, shop_id: int = 1,
+                 speed: float = 0.0, sink: Optional[Callable[[int, List[str]], None]] = None,
+                 poll_fn: Optional[Callable] = None):
+        self.frames = frames
+        self.shop_config = shop_config
+        self.shop_id = shop_id
+        self.speed = speed
+        self.sink = sink
+        self.backend = ReplayBackend()
+        if poll_fn is None:
+            from .qianniu_monitor import poll_and_capture_messages
+            poll_fn = poll_and_capture_messages
+        self._poll_fn = poll_fn
+
+    def run(self) -> ReplayReport:
+        report = ReplayReport()
+        previous_platform = set_platform(self.backend)
+        start = time.perf_counter()
+        try:
+            first_ts = self.frames[0].timestamp if self.frames else 0.0
+            for replay_frame in self.frames:
+                if self.speed > 0:
+                    due = (replay_frame.timestamp - first_ts) / self.speed
+                    delay = due - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                decode_start = time.perf_counter()
+                with Image.open(replay_frame.path) as img:
+                    pixels = np.asarray(img.convert("RGB"))
+                self.backend.set_frame(pixels)
+                frame = CapturedFrame(array=pixels, timestamp=replay_frame.timestamp)
+                timings: Dict[str, float] = {"decode": time.perf_counter() - decode_start}
+
+                poll_start = time.perf_counter()
+                _, texts = self._poll_fn(self.shop_config, self.shop_id, frame=frame, timings=timings)
+                timings["total"] = time.perf_counter() - poll_start
+
+                for stage, seconds in timings.items():
+                    report.stage_samples.setdefault(stage, []).append(seconds)
+                report.frames += 1
+                report.messages += len(texts)
+                report.texts.extend(texts)
+                if texts and self.sink is not None:
+                    self.sink(self.shop_id, texts)
+        finally:
+            set_platform(previous_platform)
+            report.wall_seconds = time.perf_counter() - start
+        return report
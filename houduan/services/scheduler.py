@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+import json
+import os
+import time
+
 from apscheduler.schedulers.background import BackgroundScheduler
 from loguru import logger
 
 # 延迟导入，避免SQLAlchemy连接问题
 # from ..app import db
 # from ..models import Shop, Message
-from .qianniu_monitor import poll_and_capture, cleanup_caches
+from .qianniu_monitor import cleanup_caches
+from .poll_engine import poll_engine
 from .alert import check_system_health
+from .stats_aggregator import flush_statistics
 from ..utils.context_manager import context_manager, safe_db_query, safe_db_commit
 
 
@@ -20,7 +26,14 @@ def start_scheduler(app):
         return _scheduler
     sched = BackgroundScheduler()
 
-    @sched.scheduled_job('interval', seconds=10, id='qianniu_poll')
+    # 轮询节拍：每个节拍先做廉价的红点探测，再只处理到期（或被探测升级）的店铺，
+    # 店铺自身的间隔由轮询引擎自适应调整；店铺列表按较低频率从数据库刷新
+    tick_seconds = float(os.environ.get("POLL_TICK_SECONDS", 0.25))
+    shop_refresh_seconds = float(os.environ.get("POLL_SHOP_REFRESH_SECONDS", 5))
+    shop_cache = {"specs": [], "loaded_at": 0.0}
+
+    @sched.scheduled_job('interval', seconds=tick_seconds, id='qianniu_poll',
+                         max_instances=1, coalesce=True)
     def job_poll():
         # 定期清理缓存
         cleanup_caches()
@@ -36,47 +49,51 @@ def start_scheduler(app):
                     logger.warning(f"Failed to import database models: {e}")
                     return
                 
-                # 使用安全的数据库查询
-                shops = safe_db_query(lambda: Shop.query.all())
-                if not shops:
+                now = time.time()
+                if now - shop_cache["loaded_at"] >= shop_refresh_seconds:
+                    # 使用安全的数据库查询
+                    shops = safe_db_query(lambda: Shop.query.all()) or []
+                    specs = []
+                    for s in shops:
+                        try:
+                            cfg = json.loads(s.config_json) if s.config_json else {}
+                        except Exception:
+                            cfg = {}
+                        specs.append((s.id, s.qianniu_title, cfg))
+                    shop_cache.update(specs=specs, loaded_at=now)
+                specs = shop_cache["specs"]
+                if not specs:
                     return
                 
-                for i, s in enumerate(shops):
-                    try:
-                        import json as _json
-                        cfg = _json.loads(s.config_json) if s.config_json else {}
-                    except Exception:
-                        cfg = {}
-                    
-                    # 多店铺轮询：每个店铺间隔2秒，避免窗口切换过快
-                    if i > 0:
-                        import time
-                        time.sleep(2)
-                    
-                    # 检查店铺是否启用自动模式
-                    if not cfg.get("auto_mode", False):
-                        logger.info(f"Shop {s.id} auto mode disabled, skipping")
-                        continue
-                    
-                    # 检查千牛窗口是否存在
-                    if s.qianniu_title:
-                        from .qianniu_monitor import list_windows_by_title
-                        windows = list_windows_by_title(s.qianniu_title)
-                        if not windows:
-                            logger.info(f"No windows found for shop {s.id} with title '{s.qianniu_title}'")
-                            continue
-                    
-                    score, text = poll_and_capture(cfg, s.id)
-                    if text:
-                        msg = Message(shop_id=s.id, customer_id='unknown', content=text, source='qianniu', status='new')
-                        db.session.add(msg)
+                # 高频红点探测：画面变化且有未读时立即升级为完整轮询
+                poll_engine.run_probe(specs)
+                
+                # 检测/哈希/OCR 在线程池并行，窗口操作与截图走单线程 UI 通道
+                results = poll_engine.run_tick(specs)
+                thresholds = {sid: cfg.get("unread_threshold", 0.02) for sid, _, cfg in specs}
+                for shop_id, score, texts in results:
+                    if texts:
+                        # 每个新气泡一条消息
+                        for text in texts:
+                            db.session.add(Message(shop_id=shop_id, customer_id='unknown', content=text, source='qianniu', status='new'))
                         safe_db_commit(lambda: db.session.commit())
-                        logger.info(f"Captured message for shop={s.id}, score={score:.3f}, len={len(text)}")
-                    elif score >= cfg.get("unread_threshold", 0.02):
-                        logger.info(f"Duplicate message detected for shop={s.id}, score={score:.3f}")
+                        logger.info(f"Captured {len(texts)} message(s) for shop={shop_id}, score={score:.3f}")
+                    elif score >= thresholds.get(shop_id, 0.02):
+                        logger.info(f"Duplicate message detected for shop={shop_id}, score={score:.3f}")
         except Exception as e:  # 避免 500 污染接口
             logger.warning(f"scheduler skipped due to init error: {e}")
 
+    @sched.scheduled_job('interval', seconds=float(os.environ.get("STATS_FLUSH_SECONDS", 10)),
+                         id='stats_flush', max_instances=1, coalesce=True)
+    def job_stats_flush():
+        """统计计数批量落库"""
+        try:
+            with context_manager.app_context(app):
+                from ..app import db
+                flush_statistics(db.engine)
+        except Exception as e:
+            logger.warning(f"stats flush failed: {e}")
+
     @sched.scheduled_job('interval', minutes=5, id='health_check')
     def job_health_check():
         """系统健康检查任务"""
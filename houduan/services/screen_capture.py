@@ -0,0 +1,255 @@
+"""
+屏幕采集层
+
+每个轮询周期只截一次图（整屏、窗口或所有店铺区域的外接矩形），
+各店铺的检测区域从共享帧缓冲中按坐标切片，得到零拷贝的 NumPy 视图。
+
+采集后端可插拔：
+- screen: pyautogui 截屏（Windows 生产环境）
+- platform: 经由平台后端截图（见 platform_backend，回放时直接读取当前帧）
+- file:   从图片文件读取（Linux 调试/回放）
+- fake:   内存帧缓冲（测试）
+
+环境变量 CAPTURE_BACKEND 选择默认后端，例如 "screen"、"platform"、"file:/path/to/frame.png"、"fake"，
+未设置时 Windows 上为 screen，其余平台为 platform。
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from .change_detect import to_gray
+
+Region = Tuple[int, int, int, int]  # (x, y, width, height)
+
+
+class CaptureBackend:
+    """采集后端接口：返回 RGB uint8 数组 (H, W, 3)"""
+
+    name = "base"
+
+    def grab(self, bbox: Optional[Region] = None) -> np.ndarray:
+        """采集整屏或指定矩形区域"""
+        raise NotImplementedError
+
+
+class PyAutoGUICaptureBackend(CaptureBackend):
+    """基于 pyautogui 的屏幕截图（延迟导入，非 Windows 环境不在导入期失败）"""
+
+    name = "screen"
+
+    def grab(self, bbox: Optional[Region] = None) -> np.ndarray:
+        import pyautogui  # 延迟导入
+
+        shot = pyautogui.screenshot(region=tuple(bbox)) if bbox else pyautogui.screenshot()
+        return np.asarray(shot.convert("RGB"))
+
+
+class PlatformCaptureBackend(CaptureBackend):
+    """经由平台后端采集：回放后端直接返回当前帧，其余后端按区域截图"""
+
+    name = "platform"
+
+    def grab(self, bbox: Optional[Region] = None) -> np.ndarray:
+        from .platform_backend import ReplayBackend, get_platform
+
+        platform = get_platform()
+        if isinstance(platform, ReplayBackend) and platform.frame is not None:
+            return _crop(platform.frame, bbox)
+        if not bbox:
+            raise ValueError("平台后端采集需要指定区域")
+        return np.asarray(platform.screenshot(bbox).convert("RGB"))
+
+
+class FileCaptureBackend(CaptureBackend):
+    """从图片文件读取帧，文件修改时间变化时重新加载"""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime: Optional[float] = None
+        self._array: Optional[np.ndarray] = None
+
+    def grab(self, bbox: Optional[Region] = None) -> np.ndarray:
+        mtime = os.path.getmtime(self.path)
+        if self._array is None or mtime != self._mtime:
+            with Image.open(self.path) as img:
+                self._array = np.asarray(img.convert("RGB"))
+            self._mtime = mtime
+        return _crop(self._array, bbox)
+
+
+class FakeFramebufferBackend(CaptureBackend):
+    """内存帧缓冲：测试时直接写入像素"""
+
+    name = "fake"
+
+    def __init__(self, width: int = 1920, height: int = 1080):
+        self._array = np.full((height, width, 3), 255, dtype=np.uint8)
+        self._lock = threading.Lock()
+
+    def set_frame(self, frame) -> None:
+        """写入新帧，接受 PIL 图像或 (H, W, 3) 数组"""
+        array = np.asarray(frame.convert("RGB")) if isinstance(frame, Image.Image) else np.asarray(frame, dtype=np.uint8)
+        with self._lock:
+            self._array = array
+
+    def grab(self, bbox: Optional[Region] = None) -> np.ndarray:
+        with self._lock:
+            return _crop(self._array, bbox)
+
+
+def _crop(array: np.ndarray, bbox: Optional[Region]) -> np.ndarray:
+    if not bbox:
+        return array
+    x, y, w, h = bbox
+    return array[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)]
+
+
+@dataclass
+class CapturedFrame:
+    """一次采集得到的共享帧缓冲
+
+    origin 为帧左上角在屏幕坐标系中的位置，region 均使用屏幕坐标。
+    """
+
+    array: np.ndarray
+    origin: Tuple[int, int] = (0, 0)
+    timestamp: float = field(default_factory=time.time)
+    _gray: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+
+    def _slices(self, region: Region) -> Tuple[slice, slice]:
+        x, y, w, h = region
+        ox, oy = self.origin
+        left, top = max(x - ox, 0), max(y - oy, 0)
+        right = min(x - ox + w, self.array.shape[1])
+        bottom = min(y - oy + h, self.array.shape[0])
+        return slice(top, max(bottom, top)), slice(left, max(right, left))
+
+    def view(self, region: Region) -> np.ndarray:
+        """返回区域的零拷贝视图（越界部分自动裁剪）"""
+        rows, cols = self._slices(region)
+        return self.array[rows, cols]
+
+    @property
+    def gray(self) -> np.ndarray:
+        """整帧灰度平面（每帧只计算一次，供各店铺、各阶段共享）"""
+        if self._gray is None:
+            self._gray = to_gray(self.array)
+        return self._gray
+
+    def gray_view(self, region: Region) -> np.ndarray:
+        """区域灰度的零拷贝视图"""
+        rows, cols = self._slices(region)
+        return self.gray[rows, cols]
+
+    def image(self, region: Region) -> Image.Image:
+        """区域的 PIL 图像（供 OCR/哈希等需要 PIL 的环节使用）"""
+        return Image.fromarray(self.view(region))
+
+    def contains(self, region: Region) -> bool:
+        x, y, w, h = region
+        ox, oy = self.origin
+        return x >= ox and y >= oy and x + w <= ox + self.array.shape[1] and y + h <= oy + self.array.shape[0]
+
+
+def union_bbox(regions: Iterable[Region]) -> Optional[Region]:
+    """多个区域的外接矩形"""
+    boxes = [tuple(int(v) for v in r) for r in regions if r and len(r) == 4]
+    if not boxes:
+        return None
+    left = min(b[0] for b in boxes)
+    top = min(b[1] for b in boxes)
+    right = max(b[0] + b[2] for b in boxes)
+    bottom = max(b[1] + b[3] for b in boxes)
+    return (left, top, right - left, bottom - top)
+
+
+class ScreenCapture:
+    """采集管理器：每个周期抓取一帧并缓存，供所有店铺共享切片"""
+
+    def __init__(self, backend: Optional[CaptureBackend] = None):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._frame: Optional[CapturedFrame] = None
+        self._grab_count = 0
+        self._last_grab_seconds = 0.0
+
+    @property
+    def backend(self) -> CaptureBackend:
+        if self._backend is None:
+            self._backend = create_backend_from_env()
+        return self._backend
+
+    def set_backend(self, backend: CaptureBackend) -> None:
+        with self._lock:
+            self._backend = backend
+            self._frame = None
+
+    def grab_frame(self, regions: Optional[Iterable[Region]] = None) -> CapturedFrame:
+        """抓取一帧；给定 regions 时只抓取其外接矩形以减少拷贝量"""
+        bbox = union_bbox(regions) if regions is not None else None
+        start = time.perf_counter()
+        array = self.backend.grab(bbox)
+        elapsed = time.perf_counter() - start
+        origin = (max(bbox[0], 0), max(bbox[1], 0)) if bbox else (0, 0)
+        frame = CapturedFrame(array=array, origin=origin)
+        with self._lock:
+            self._frame = frame
+            self._grab_count += 1
+            self._last_grab_seconds = elapsed
+        return frame
+
+    def latest_frame(self, max_age: float = 1.0) -> Optional[CapturedFrame]:
+        """最近一帧（超过 max_age 秒视为过期）"""
+        with self._lock:
+            frame = self._frame
+        if frame is None or time.time() - frame.timestamp > max_age:
+            return None
+        return frame
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "grab_count": self._grab_count,
+                "last_grab_seconds": self._last_grab_seconds,
+            }
+
+
+def create_backend_from_env() -> CaptureBackend:
+    """根据 CAPTURE_BACKEND 环境变量创建采集后端"""
+    spec = os.environ.get("CAPTURE_BACKEND") or ("screen" if sys.platform == "win32" else "platform")
+    if spec == "platform":
+        return PlatformCaptureBackend()
+    if spec.startswith("file:"):
+        return FileCaptureBackend(spec[len("file:"):])
+    if spec == "fake":
+        return FakeFramebufferBackend()
+    if spec != "screen":
+        logger.warning(f"未知的采集后端 {spec}，使用 screen")
+    return PyAutoGUICaptureBackend()
+
+
+# 全局采集管理器
+screen_capture = ScreenCapture()
+
+
+def grab_frame(regions: Optional[Iterable[Region]] = None) -> CapturedFrame:
+    """抓取共享帧"""
+    return screen_capture.grab_frame(regions)
+
+
+def set_capture_backend(backend: CaptureBackend) -> None:
+    """替换全局采集后端"""
+    screen_capture.set_backend(backend)
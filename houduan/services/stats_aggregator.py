@@ -0,0 +1,314 @@
+"""
+统计聚合：按 日期 / 小时 / 店铺 / 指标 维护计数器
+
+- 业务代码只调用 incr / record_result，在内存中累加，不访问数据库；
+  消息数在插入时暂存到会话上，事务提交后才计入，回滚的插入不计数
+- 调度器定期 flush() 把增量批量写入 statistics_counters 长表：SQLite / PostgreSQL 用
+  INSERT ... ON CONFLICT DO UPDATE，MySQL 用 ON DUPLICATE KEY UPDATE，数据库端原子累加，
+  多个工作进程各自落库互不覆盖；其他数据库退化为 UPDATE 后按需 INSERT
+- 进程退出时 atexit 把剩余增量落库；绑定的引擎被 dispose 时先落库再解绑，
+  不会在退出时写入已废弃的数据库；fork 出的子进程清空继承来的增量，避免重复计数
+- 统计接口按日期范围读取预聚合行（O(天数)），并合并尚未落库的内存增量
+- 处理耗时按固定桶计数（latency_le_<ms> / latency_le_inf），另记 latency_sum_ms 与 latency_count
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import Session, object_session
+
+from ..models import Message, StatisticsCounter
+
+# 处理耗时直方图桶上界（毫秒）
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# 不计入“消息数”的消息来源（系统发出的回复等）
+NON_CUSTOMER_SOURCES = {"system_reply"}
+
+CounterKey = Tuple[date, int, int, str]  # (日期, 小时, 店铺, 指标)
+
+# 会话上暂存的未提交消息计数
+_SESSION_PENDING = "stats_pending_messages"
+
+
+def latency_bucket(ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if ms <= bound:
+            return f"latency_le_{bound}"
+    return "latency_le_inf"
+
+
+def histogram_percentile(metrics: Dict[str, int], q: float) -> Optional[int]:
+    """由桶计数估算分位数（返回所在桶的上界，毫秒；落在最后一桶时返回 None）"""
+    total = metrics.get("latency_count", 0)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += metrics.get(f"latency_le_{bound}", 0)
+        if seen >= target:
+            return bound
+    return None
+
+
+class StatisticsAggregator:
+    """内存计数 + 批量落库"""
+
+    def __init__(self):
+        self._pending: Dict[CounterKey, int] = {}
+        self._lock = threading.Lock()
+        self._hooks_installed = False
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._flush_errors = 0
+        self._last_flush: Optional[str] = None
+        self._engine = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # 父进程的增量由父进程落库，子进程从零开始
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def bind(self, engine) -> None:
+        """绑定默认落库引擎（退出时 flush 使用）"""
+        self._engine = engine
+        if not event.contains(engine, "engine_disposed", self._on_engine_disposed):
+            event.listen(engine, "engine_disposed", self._on_engine_disposed)
+
+    def _on_engine_disposed(self, engine) -> None:
+        # 应用关闭（或测试清理）时释放引擎：先写入剩余增量，再解绑
+        if engine is not self._engine:
+            return
+        self.flush(engine)
+        self._engine = None
+
+    # ---- 写入（热路径，仅内存） ----
+
+    def incr(self, metric: str, shop_id: Optional[int] = 0, value: int = 1,
+             at: Optional[datetime] = None) -> None:
+        at = at or datetime.now()
+        key = (at.date(), at.hour, int(shop_id or 0), metric)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + value
+
+    def record_latency(self, shop_id: Optional[int], seconds: float, at: Optional[datetime] = None) -> None:
+        ms = seconds * 1000
+        self.incr(latency_bucket(ms), shop_id, at=at)
+        self.incr("latency_count", shop_id, at=at)
+        self.incr("latency_sum_ms", shop_id, int(round(ms)), at=at)
+
+    def record_result(self, shop_id: Optional[int], source: str, auto_send: bool,
+                      latency: Optional[float] = None, model: Optional[str] = None,
+                      confidence: Optional[float] = None) -> None:
+        """记录一条消息的处理结果"""
+        if source == "kb":
+            self.incr("kb_hits", shop_id)
+        elif source == "ai":
+            self.incr("ai_suggestions", shop_id)
+        else:
+            self.incr("rule_replies", shop_id)
+        if auto_send:
+            self.incr("auto_sent", shop_id)
+        if model:
+            self.incr(f"model_count:{model}", shop_id)
+            if confidence is not None:
+                self.incr(f"model_confidence_milli:{model}", shop_id, int(round(confidence * 1000)))
+        if latency is not None:
+            self.record_latency(shop_id, latency)
+
+    def install_hooks(self) -> None:
+        """消息入库提交后计数（覆盖轮询、接口创建、导入等所有 ORM 写入路径）"""
+        with self._lock:
+            if self._hooks_installed:
+                return
+            self._hooks_installed = True
+
+        @event.listens_for(Message, "after_insert")
+        def _count_message(mapper, connection, target):
+            if target.source in NON_CUSTOMER_SOURCES:
+                return
+            session = object_session(target)
+            if session is None:
+                self.incr("messages", target.shop_id)
+                return
+            session.info.setdefault(_SESSION_PENDING, []).append((datetime.now(), target.shop_id))
+
+        @event.listens_for(Session, "after_commit")
+        def _apply_pending(session):
+            for at, shop_id in session.info.pop(_SESSION_PENDING, ()):
+                self.incr("messages", shop_id, at=at)
+
+        @event.listens_for(Session, "after_soft_rollback")
+        def _discard_pending(session, previous_transaction):
+            if not previous_transaction.nested:
+                session.info.pop(_SESSION_PENDING, None)
+
+    # ---- 落库 ----
+
+    def drain(self) -> Dict[CounterKey, int]:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def restore(self, batch: Dict[CounterKey, int]) -> None:
+        """落库失败时把增量放回，下次再写"""
+        with self._lock:
+            for key, value in batch.items():
+                self._pending[key] = self._pending.get(key, 0) + value
+
+    def _upsert(self, conn, table, rows) -> bool:
+        """数据库端原子累加；当前方言不支持时返回 False"""
+        dialect = conn.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.bucket_date, table.c.bucket_hour, table.c.shop_id, table.c.metric],
+                set_={"value": table.c.value + stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+            )
+        elif dialect in ("mysql", "mariadb"):
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table)
+            stmt = stmt.on_duplicate_key_update(
+                value=table.c.value + stmt.inserted.value, updated_at=stmt.inserted.updated_at,
+            )
+        else:
+            return False
+        conn.execute(stmt, rows)
+        return True
+
+    def _write(self, engine, batch: Dict[CounterKey, int]) -> None:
+        table = StatisticsCounter.__table__
+        now = datetime.utcnow()
+        # 固定顺序写入，多进程并发落库时加锁顺序一致，避免死锁
+        rows = [
+            {"bucket_date": day, "bucket_hour": hour, "shop_id": shop_id,
+             "metric": metric, "value": delta, "updated_at": now}
+            for (day, hour, shop_id, metric), delta in sorted(batch.items())
+        ]
+        with engine.begin() as conn:
+            if not self._upsert(conn, table, rows):
+                for row in rows:
+                    match = and_(table.c.bucket_date == row["bucket_date"],
+                                 table.c.bucket_hour == row["bucket_hour"],
+                                 table.c.shop_id == row["shop_id"], table.c.metric == row["metric"])
+                    updated = conn.execute(
+                        table.update().where(match).values(value=table.c.value + row["value"], updated_at=now)
+                    ).rowcount
+                    if not updated:
+                        conn.execute(table.insert().values(**row))
+
+    def _flushed(self, count: int) -> None:
+        with self._lock:
+            self._flushes += 1
+            self._flushed_rows += count
+            self._last_flush = datetime.now().isoformat()
+
+    def flush(self, engine=None) -> int:
+        """把内存增量写入 statistics_counters，返回写入的计数器行数"""
+        engine = engine or self._engine
+        if engine is None:
+            return 0
+        batch = self.drain()
+        if not batch:
+            return 0
+        try:
+            self._write(engine, batch)
+        except Exception as e:
+            self.restore(batch)
+            with self._lock:
+                self._flush_errors += 1
+            logger.warning(f"统计计数落库失败，{len(batch)} 项增量保留到下次: {e}")
+            return 0
+        self._flushed(len(batch))
+        return len(batch)
+
+    def flush_on_exit(self) -> None:
+        """进程退出前最后一次落库；失败时不再放回（进程即将退出），记录丢失的增量数"""
+        if self._engine is None:
+            return
+        batch = self.drain()
+        if not batch:
+            return
+        try:
+            self._write(self._engine, batch)
+        except Exception as e:
+            logger.error(f"进程退出时统计计数落库失败，丢失 {len(batch)} 项增量: {e}")
+            return
+        self._flushed(len(batch))
+
+    # ---- 读取 ----
+
+    def _pending_items(self) -> Iterable[Tuple[CounterKey, int]]:
+        with self._lock:
+            return list(self._pending.items())
+
+    def daily_totals(self, conn, start: date, end: date,
+                     shop_id: Optional[int] = None) -> Dict[date, Dict[str, int]]:
+        """[start, end] 内每天的指标合计（含未落库增量）"""
+        table = StatisticsCounter.__table__
+        stmt = (select(table.c.bucket_date, table.c.metric, func.sum(table.c.value))
+                .where(table.c.bucket_date.between(start, end))
+                .group_by(table.c.bucket_date, table.c.metric))
+        if shop_id:
+            stmt = stmt.where(table.c.shop_id == shop_id)
+        totals: Dict[date, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for day, metric, value in conn.execute(stmt):
+            totals[day][metric] += int(value or 0)
+        for (day, _hour, shop, metric), value in self._pending_items():
+            if start <= day <= end and (not shop_id or shop == shop_id):
+                totals[day][metric] += value
+        return totals
+
+    def hourly_totals(self, conn, day: date, shop_id: Optional[int] = None) -> Dict[int, Dict[str, int]]:
+        """某天每小时的指标合计（含未落库增量）"""
+        table = StatisticsCounter.__table__
+        stmt = (select(table.c.bucket_hour, table.c.metric, func.sum(table.c.value))
+                .where(table.c.bucket_date == day)
+                .group_by(table.c.bucket_hour, table.c.metric))
+        if shop_id:
+            stmt = stmt.where(table.c.shop_id == shop_id)
+        totals: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for hour, metric, value in conn.execute(stmt):
+            totals[hour][metric] += int(value or 0)
+        for (d, hour, shop, metric), value in self._pending_items():
+            if d == day and (not shop_id or shop == shop_id):
+                totals[hour][metric] += value
+        return totals
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushes": self._flushes,
+                "flushed_rows": self._flushed_rows,
+                "flush_errors": self._flush_errors,
+                "last_flush": self._last_flush,
+            }
+
+
+# 全局统计聚合器
+stats_aggregator = StatisticsAggregator()
+atexit.register(stats_aggregator.flush_on_exit)
+
+
+def record_result(shop_id: Optional[int], source: str, auto_send: bool, **kwargs) -> None:
+    stats_aggregator.record_result(shop_id, source, auto_send, **kwargs)
+
+
+def flush_statistics(engine) -> int:
+    return stats_aggregator.flush(engine)
@@ -11,6 +11,8 @@ from typing import List, Optional, Tuple
 
 import math
 
+from ..utils.tracing import STAGE_EMBEDDING, span
+
 try:  # 可选依赖
     from sentence_transformers import SentenceTransformer  # type: ignore
     _encoder: Optional[SentenceTransformer] = None
@@ -61,7 +63,8 @@ def embed(texts: List[str]) -> Optional[List[List[float]]]:
     encoder = _ensure_encoder()
     if encoder is None:
         return None
-    vecs = encoder.encode(texts, normalize_embeddings=True)
+    with span(STAGE_EMBEDDING):
+        vecs = encoder.encode(texts, normalize_embeddings=True)
     return [v.tolist() for v in vecs]
 
 
@@ -9,6 +9,7 @@ import json
 import pickle
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable, Union
 from functools import wraps
@@ -24,49 +25,66 @@ except ImportError:
 
 
 class MemoryCache:
-    """内存缓存实现"""
+    """内存缓存实现：OrderedDict 维护 LRU 顺序，读写与淘汰均为 O(1)，过期在访问时惰性清理"""
     
     def __init__(self, max_size: int = 1000, default_ttl: int = 3600):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self._max_size = max_size
         self._default_ttl = default_ttl
         self._lock = threading.RLock()
-        self._access_times: Dict[str, float] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
         
-    def get(self, key: str) -> Optional[Any]:
-        """获取缓存值"""
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """获取缓存值
+
+        max_age: 可选，额外限制缓存项自写入起的最大存活秒数
+        """
         with self._lock:
-            if key not in self._cache:
+            cache_item = self._cache.get(key)
+            if cache_item is None:
+                self._misses += 1
                 return None
             
-            cache_item = self._cache[key]
-            
             # 检查是否过期
-            if self._is_expired(cache_item):
+            now = time.time()
+            if self._is_expired(cache_item, now) or (max_age is not None and now - cache_item['created_at'] > max_age):
                 self._remove(key)
+                self._expirations += 1
+                self._misses += 1
                 return None
             
-            # 更新访问时间
-            self._access_times[key] = time.time()
-            
+            # 标记为最近使用
+            self._cache.move_to_end(key)
+            self._hits += 1
             return cache_item['value']
     
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            cache_item = self._cache.get(key)
+            return cache_item is not None and not self._is_expired(cache_item)
+    
+    def __len__(self) -> int:
+        return len(self._cache)
+    
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """设置缓存值"""
         with self._lock:
-            # 检查缓存大小限制
-            if len(self._cache) >= self._max_size and key not in self._cache:
+            now = time.time()
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            elif len(self._cache) >= self._max_size:
+                # 检查缓存大小限制
                 self._evict_oldest()
             
             ttl = ttl or self._default_ttl
-            expire_time = time.time() + ttl
-            
             self._cache[key] = {
                 'value': value,
-                'expire_time': expire_time,
-                'created_at': time.time()
+                'expire_time': now + ttl,
+                'created_at': now
             }
-            self._access_times[key] = time.time()
             
             return True
     
@@ -82,39 +100,51 @@ class MemoryCache:
         """清空缓存"""
         with self._lock:
             self._cache.clear()
-            self._access_times.clear()
     
-    def _is_expired(self, cache_item: Dict[str, Any]) -> bool:
+    def _is_expired(self, cache_item: Dict[str, Any], now: Optional[float] = None) -> bool:
         """检查缓存项是否过期"""
-        return time.time() > cache_item['expire_time']
+        return (now or time.time()) > cache_item['expire_time']
     
     def _remove(self, key: str):
         """移除缓存项"""
-        if key in self._cache:
-            del self._cache[key]
-        if key in self._access_times:
-            del self._access_times[key]
+        self._cache.pop(key, None)
     
     def _evict_oldest(self):
-        """驱逐最旧的缓存项"""
-        if not self._access_times:
-            return
-        
-        oldest_key = min(self._access_times.keys(), key=lambda k: self._access_times[k])
-        self._remove(oldest_key)
+        """驱逐最久未使用的缓存项"""
+        if self._cache:
+            self._cache.popitem(last=False)
+            self._evictions += 1
     
     def get_stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
         with self._lock:
             current_time = time.time()
-            expired_count = sum(1 for item in self._cache.values() if self._is_expired(item))
+            expired_count = sum(1 for item in self._cache.values() if self._is_expired(item, current_time))
+            lookups = self._hits + self._misses
             
             return {
                 'total_items': len(self._cache),
                 'expired_items': expired_count,
                 'active_items': len(self._cache) - expired_count,
                 'max_size': self._max_size,
-                'usage_rate': len(self._cache) / self._max_size if self._max_size > 0 else 0
+                'usage_rate': len(self._cache) / self._max_size if self._max_size > 0 else 0,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0,
+                'evictions': self._evictions,
+                'expirations': self._expirations
+            }
+
+    def get_counters(self) -> Dict[str, int]:
+        """命中 / 淘汰计数与容量（O(1)，不扫描过期项，供指标导出）"""
+        with self._lock:
+            return {
+                'items': len(self._cache),
+                'max_size': self._max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
             }
 
 
@@ -300,6 +330,12 @@ class CacheManager:
                     stats[name] = {'error': str(e)}
             return stats
     
+    def get_cache_counters(self) -> Dict[str, Dict[str, int]]:
+        """所有内存缓存的计数器（Redis 缓存需要网络往返，不在此列）"""
+        with self._lock:
+            caches = list(self._caches.items())
+        return {name: cache.get_counters() for name, cache in caches if isinstance(cache, MemoryCache)}
+
     def optimize_caches(self) -> Dict[str, Any]:
         """优化缓存配置"""
         optimization_results = {}
@@ -119,47 +119,64 @@ class ConnectionPoolMonitor:
             }
 
 
+def pool_options(database_url: str) -> Dict[str, Any]:
+    """按数据库类型给出 create_engine 的连接池参数（也用作 SQLALCHEMY_ENGINE_OPTIONS）"""
+    is_sqlite = database_url.startswith('sqlite')
+    is_memory = ':memory:' in database_url or database_url in ('sqlite://', 'sqlite:///')
+    if is_sqlite and is_memory:
+        # 内存库只能共享同一个连接，使用静态连接池
+        return {
+            'poolclass': StaticPool,
+            'connect_args': {'check_same_thread': False},
+            'echo': False,
+        }
+    if is_sqlite:
+        # 文件库每个线程各自检出连接，避免多个请求线程共用一个连接
+        return {
+            'poolclass': QueuePool,
+            'pool_size': 5,
+            'max_overflow': 10,
+            'pool_timeout': 30,
+            'connect_args': {'check_same_thread': False},
+            'echo': False,
+        }
+    # 其他数据库使用队列连接池
+    return {
+        'poolclass': QueuePool,
+        'pool_size': 10,          # 基础连接数
+        'max_overflow': 20,       # 最大溢出连接数
+        'pool_pre_ping': True,    # 连接前检查
+        'pool_recycle': 3600,     # 1小时回收连接
+        'pool_timeout': 30,       # 获取连接超时
+        'echo': False,
+    }
+
+
 class ConnectionPoolManager:
     """连接池管理器"""
     
     def __init__(self):
         self._engines: Dict[str, Engine] = {}
+        self._urls: Dict[str, str] = {}
         self._monitors: Dict[str, ConnectionPoolMonitor] = {}
         self._lock = threading.Lock()
         
     def create_optimized_pool(self, database_url: str, pool_name: str = "default") -> Engine:
-        """创建优化的连接池"""
+        """创建优化的连接池（同名同URL复用；同名但URL不同时按URL另建，避免返回旧库的引擎）"""
         with self._lock:
+            if pool_name in self._engines and self._urls.get(pool_name) != database_url:
+                pool_name = f"{pool_name}@{database_url}"
             if pool_name in self._engines:
                 return self._engines[pool_name]
             
             try:
-                # 根据数据库类型选择连接池配置
-                if database_url.startswith('sqlite'):
-                    # SQLite使用静态连接池
-                    engine = create_engine(
-                        database_url,
-                        poolclass=StaticPool,
-                        connect_args={'check_same_thread': False},
-                        echo=False
-                    )
-                else:
-                    # 其他数据库使用队列连接池
-                    engine = create_engine(
-                        database_url,
-                        poolclass=QueuePool,
-                        pool_size=10,          # 基础连接数
-                        max_overflow=20,       # 最大溢出连接数
-                        pool_pre_ping=True,    # 连接前检查
-                        pool_recycle=3600,     # 1小时回收连接
-                        pool_timeout=30,       # 获取连接超时
-                        echo=False
-                    )
+                engine = create_engine(database_url, **pool_options(database_url))
                 
                 # 添加连接池事件监听器
                 self._add_pool_listeners(engine, pool_name)
                 
                 self._engines[pool_name] = engine
+                self._urls[pool_name] = database_url
                 
                 # 启动连接池监控
                 monitor = ConnectionPoolMonitor()
@@ -210,6 +227,7 @@ class ConnectionPoolManager:
                     # 关闭引擎
                     self._engines[pool_name].dispose()
                     del self._engines[pool_name]
+                    self._urls.pop(pool_name, None)
                     
                     logger.info(f"连接池已关闭: {pool_name}")
                 except Exception as e:
@@ -15,21 +15,11 @@ from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import create_engine, text, event
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 from sqlalchemy.exc import SQLAlchemyError, DisconnectionError
 from loguru import logger
 
-# 导入优化模块
-try:
-    from .connection_pool import pool_manager, get_optimized_engine
-    from .cache_manager import cache_manager, cached
-    from .query_optimizer import query_optimizer, optimize_query
-    OPTIMIZATION_AVAILABLE = True
-except ImportError:
-    OPTIMIZATION_AVAILABLE = False
-    logger.warning("优化模块不可用，将使用基础功能")
-
-
 class DatabaseManager:
     """数据库连接管理器"""
     
@@ -45,9 +35,15 @@ class DatabaseManager:
         """获取数据库引擎，支持连接池"""
         with self._lock:
             if database_url not in self._engines:
+                # connection_pool 反向依赖本模块，在此处延迟导入以避免循环导入
+                try:
+                    from .connection_pool import get_optimized_engine
+                except ImportError:
+                    get_optimized_engine = None
+                    logger.warning("优化模块不可用，将使用基础功能")
                 try:
                     # 如果优化模块可用，使用优化的连接池
-                    if OPTIMIZATION_AVAILABLE:
+                    if get_optimized_engine is not None:
                         engine = get_optimized_engine(database_url, "main")
                         self._engines[database_url] = engine
                         logger.info(f"优化数据库引擎创建成功: {database_url}")
@@ -92,6 +88,11 @@ class DatabaseManager:
                     
             return self._engines[database_url]
     
+    def register_engine(self, database_url: str, engine: Engine) -> None:
+        """登记外部创建的引擎（如 Flask-SQLAlchemy 的 db.engine），之后同一 URL 复用该引擎"""
+        with self._lock:
+            self._engines[database_url] = engine
+
     def get_connection(self, database_url: str):
         """获取数据库连接"""
         engine = self.get_engine(database_url)
@@ -118,6 +119,21 @@ class DatabaseManager:
             if connection:
                 connection.close()
     
+    def get_pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """各引擎连接池当前计数（直接读取池对象，不建立连接），键为隐藏密码后的 URL"""
+        with self._lock:
+            engines = list(self._engines.values())
+        stats = {}
+        for engine in engines:
+            pool = engine.pool
+            stats[engine.url.render_as_string(hide_password=True)] = {
+                'size': getattr(pool, 'size', lambda: 0)(),
+                'checked_in': getattr(pool, 'checkedin', lambda: 0)(),
+                'checked_out': getattr(pool, 'checkedout', lambda: 0)(),
+                'overflow': max(0, getattr(pool, 'overflow', lambda: 0)()),
+            }
+        return stats
+
     def health_check(self, database_url: str) -> Dict[str, Any]:
         """数据库健康检查"""
         cache_key = database_url
@@ -246,6 +262,28 @@ def get_db_session():
     return db_manager.get_session(database_url)
 
 
+def get_app_engine() -> Engine:
+    """当前应用配置的数据库对应的共享引擎（整个进程只建一个连接池）"""
+    return db_manager.get_engine(current_app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+def get_request_session() -> Session:
+    """请求级数据库会话
+
+    即 Flask-SQLAlchemy 的 db.session：同一应用上下文内为同一个会话，
+    与 message_handler、调度器共用 db.engine 连接池，上下文结束时由扩展统一关闭。
+    """
+    from ..app import db
+    return db.session
+
+
+def init_shared_engine(app) -> None:
+    """把 Flask-SQLAlchemy 的引擎登记为该 URL 的共享引擎，避免 db_manager 另建一个连接池"""
+    from ..app import db
+    with app.app_context():
+        db_manager.register_engine(app.config['SQLALCHEMY_DATABASE_URI'], db.engine)
+
+
 def safe_db_operation(operation, *args, **kwargs):
     """安全的数据库操作，带重试机制"""
     return db_manager.retry_operation(operation, *args, **kwargs)
@@ -0,0 +1,297 @@
+"""
+指标导出：OpenMetrics 文本格式（/metrics）
+
+- MetricsRegistry 持有少量直接埋点的计数器 / 仪表，以及若干采集函数（collector）
+- 采集函数在抓取时读取各组件已有的内存统计（连接池、缓存、查询、OCR 队列、
+  轮询引擎、统计聚合、阶段耗时直方图），不访问数据库、不导入重量级依赖
+- 单个采集函数失败只跳过该组指标，并计入 app_metrics_collector_errors_total
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from loguru import logger
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 阶段耗时导出的固定桶（秒）；各序列桶一致，便于跨店铺 / 实例聚合
+LATENCY_BUCKETS_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass
+class MetricFamily:
+    """一个指标族：name 不含 _total 等后缀，samples 为 (后缀, 标签, 值)"""
+
+    name: str
+    type: str  # counter / gauge / histogram
+    help: str
+    samples: List[Tuple[str, Dict[str, str], float]] = field(default_factory=list)
+
+    def add(self, value: float, suffix: str = "", **labels) -> "MetricFamily":
+        self.samples.append((suffix, {k: str(v) for k, v in labels.items()}, value))
+        return self
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def render(families: Iterable[MetricFamily]) -> str:
+    lines: List[str] = []
+    for family in families:
+        lines.append(f"# TYPE {family.name} {family.type}")
+        lines.append(f"# HELP {family.name} {_escape(family.help)}")
+        for suffix, labels, value in family.samples:
+            label_text = ""
+            if labels:
+                label_text = "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+            lines.append(f"{family.name}{suffix}{label_text} {_format_value(value)}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class _Metric:
+    """直接埋点的计数器 / 仪表（按标签值存储）"""
+
+    def __init__(self, name: str, type_: str, help_: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.type = type_
+        self.help = help_
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value: float, **labels) -> None:
+        if self.type == "counter":
+            raise ValueError("counter 只能递增")
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.type, self.help)
+        suffix = "_total" if self.type == "counter" else ""
+        with self._lock:
+            for key, value in self._values.items():
+                family.add(value, suffix, **dict(zip(self.labelnames, key)))
+        return family
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[MetricFamily]]] = {}
+        self._lock = threading.Lock()
+        self._collector_errors: Dict[str, int] = {}
+
+    def _metric(self, name: str, type_: str, help_: str, labelnames: Iterable[str]) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = _Metric(name, type_, help_, tuple(labelnames))
+            return metric
+
+    def counter(self, name: str, help_: str, labelnames: Iterable[str] = ()) -> _Metric:
+        return self._metric(name, "counter", help_, labelnames)
+
+    def gauge(self, name: str, help_: str, labelnames: Iterable[str] = ()) -> _Metric:
+        return self._metric(name, "gauge", help_, labelnames)
+
+    def register_collector(self, name: str, collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        with self._lock:
+            self._collectors[name] = collector
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        families = [metric.collect() for metric in metrics]
+        for name, collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                self._collector_errors[name] = self._collector_errors.get(name, 0) + 1
+                logger.debug(f"指标采集失败 {name}: {e}")
+        errors = MetricFamily("app_metrics_collector_errors", "counter", "Failed metric collector runs")
+        for name, count in self._collector_errors.items():
+            errors.add(count, "_total", collector=name)
+        families.append(errors)
+        return families
+
+    def render(self) -> str:
+        return render(self.collect())
+
+
+# ---- 采集函数：读取各组件内存统计 ----
+
+def _collect_pools() -> Iterable[MetricFamily]:
+    from .db_manager import db_manager
+    size = MetricFamily("app_db_pool_size", "gauge", "Configured pool size")
+    checked_out = MetricFamily("app_db_pool_checked_out", "gauge", "Connections currently checked out")
+    checked_in = MetricFamily("app_db_pool_checked_in", "gauge", "Idle connections in the pool")
+    overflow = MetricFamily("app_db_pool_overflow", "gauge", "Overflow connections in use")
+    for name, stats in db_manager.get_pool_stats().items():
+        size.add(stats["size"], pool=name)
+        checked_out.add(stats["checked_out"], pool=name)
+        checked_in.add(stats["checked_in"], pool=name)
+        overflow.add(stats["overflow"], pool=name)
+    return [size, checked_out, checked_in, overflow]
+
+
+def _collect_caches() -> Iterable[MetricFamily]:
+    from .cache_manager import cache_manager
+    families = {
+        "hits": MetricFamily("app_cache_hits", "counter", "Cache hits"),
+        "misses": MetricFamily("app_cache_misses", "counter", "Cache misses"),
+        "evictions": MetricFamily("app_cache_evictions", "counter", "Entries evicted by LRU"),
+        "expirations": MetricFamily("app_cache_expirations", "counter", "Entries dropped on expiry"),
+    }
+    items = MetricFamily("app_cache_items", "gauge", "Entries currently held")
+    max_size = MetricFamily("app_cache_max_items", "gauge", "Configured cache capacity")
+    for name, counters in cache_manager.get_cache_counters().items():
+        for key, family in families.items():
+            family.add(counters[key], "_total", cache=name)
+        items.add(counters["items"], cache=name)
+        max_size.add(counters["max_size"], cache=name)
+    return [*families.values(), items, max_size]
+
+
+def _collect_queries() -> Iterable[MetricFamily]:
+    from .query_optimizer import query_optimizer
+    stats = query_optimizer.profiler.get_query_stats()
+    return [
+        MetricFamily("app_db_queries", "counter", "SQL statements executed").add(stats["total_queries"], "_total"),
+        MetricFamily("app_db_slow_queries", "counter", "SQL statements over the slow threshold")
+        .add(stats["slow_queries"], "_total"),
+        MetricFamily("app_db_query_seconds", "counter", "Total time spent in SQL statements")
+        .add(float(stats["total_duration"]), "_total"),
+        MetricFamily("app_db_query_fingerprints", "gauge", "Distinct statement fingerprints tracked")
+        .add(stats["fingerprints"]),
+    ]
+
+
+def _collect_db_health() -> Iterable[MetricFamily]:
+    from ..services.db_health import db_health_monitor
+    status = db_health_monitor.get_health_status()
+    if "current_status" not in status:
+        return []
+    return [
+        MetricFamily("app_db_healthy", "gauge", "Result of the last background database check")
+        .add(1 if status["current_status"] == "healthy" else 0),
+        MetricFamily("app_db_health_check_seconds", "gauge", "Response time of the last database check")
+        .add(float(status.get("current_response_time") or 0)),
+        MetricFamily("app_db_health_checks", "counter", "Background database checks run")
+        .add(status.get("total_checks", 0), "_total"),
+    ]
+
+
+def _collect_ocr() -> Iterable[MetricFamily]:
+    from ..services.ocr_service import ocr_service
+    stats = ocr_service.get_stats()
+    jobs = MetricFamily("app_ocr_jobs", "counter", "OCR jobs by outcome")
+    for outcome in ("submitted", "completed", "failed"):
+        jobs.add(stats.get(outcome, 0), "_total", outcome=outcome)
+    return [
+        jobs,
+        MetricFamily("app_ocr_wait_timeouts", "counter", "OCR callers that gave up waiting for a result")
+        .add(stats.get("timeouts", 0), "_total"),
+        MetricFamily("app_ocr_queue_depth", "gauge", "OCR jobs waiting for a worker").add(stats.get("queue_depth", 0)),
+        MetricFamily("app_ocr_workers", "gauge", "OCR worker processes").add(stats.get("workers", 0)),
+        MetricFamily("app_ocr_pool_restarts", "counter", "OCR pool restarts").add(stats.get("pool_restarts", 0), "_total"),
+    ]
+
+
+def _collect_poll() -> Iterable[MetricFamily]:
+    from ..services.poll_engine import poll_engine
+    stats = poll_engine.get_stats()
+    families = [
+        MetricFamily("app_poll_ticks", "counter", "Poll scheduler ticks").add(stats.get("ticks", 0), "_total"),
+        MetricFamily("app_poll_shops_polled", "counter", "Shop polls executed").add(stats.get("polled", 0), "_total"),
+        MetricFamily("app_poll_errors", "counter", "Shop polls that raised").add(stats.get("errors", 0), "_total"),
+        MetricFamily("app_poll_timeouts", "counter", "Ticks that hit the tick timeout").add(stats.get("timeouts", 0), "_total"),
+        MetricFamily("app_poll_probes", "counter", "Cheap change-detection probes").add(stats.get("probes", 0), "_total"),
+        MetricFamily("app_ui_lane_queue_depth", "gauge", "UI automation jobs waiting or running")
+        .add(poll_engine.ui_lane.pending()),
+    ]
+    interval = MetricFamily("app_poll_interval_seconds", "gauge", "Current adaptive poll interval")
+    for shop_id, shop in stats.get("shops", {}).items():
+        interval.add(shop["interval"], shop=shop_id)
+    families.append(interval)
+    return families
+
+
+def _collect_statistics() -> Iterable[MetricFamily]:
+    from ..services.stats_aggregator import stats_aggregator
+    stats = stats_aggregator.get_stats()
+    return [
+        MetricFamily("app_stats_pending_counters", "gauge", "Statistics deltas not yet flushed").add(stats["pending"]),
+        MetricFamily("app_stats_flushes", "counter", "Statistics flushes").add(stats["flushes"], "_total"),
+        MetricFamily("app_stats_flush_errors", "counter", "Failed statistics flushes").add(stats["flush_errors"], "_total"),
+    ]
+
+
+def _collect_pipeline() -> Iterable[MetricFamily]:
+    from .tracing import tracer
+    family = MetricFamily("app_pipeline_stage_seconds", "histogram", "Message pipeline stage latency")
+    bounds_us = [int(b * 1_000_000) for b in LATENCY_BUCKETS_SECONDS]
+    for (stage, dimension), hist in sorted(tracer.histograms().items()):
+        labels = {"stage": stage}
+        if dimension.startswith("shop:"):
+            labels["shop"] = dimension[5:]
+        elif dimension.startswith("model:"):
+            labels["model"] = dimension[6:]
+        buckets = hist.buckets()
+        cumulative, i = 0, 0
+        for bound, bound_us in zip(LATENCY_BUCKETS_SECONDS, bounds_us):
+            while i < len(buckets) and buckets[i][0] <= bound_us:
+                cumulative += buckets[i][1]
+                i += 1
+            family.add(cumulative, "_bucket", **labels, le=bound)
+        family.add(hist.count, "_bucket", **labels, le="+Inf")
+        family.add(hist.count, "_count", **labels)
+        family.add(hist.total / 1_000_000, "_sum", **labels)
+    return [family]
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
+for _name, _collector in (("pools", _collect_pools), ("caches", _collect_caches), ("queries", _collect_queries),
+                          ("db_health", _collect_db_health), ("ocr", _collect_ocr), ("poll", _collect_poll),
+                          ("statistics", _collect_statistics), ("pipeline", _collect_pipeline)):
+    metrics_registry.register_collector(_name, _collector)
+
+_started_at = time.time()
+metrics_registry.register_collector("process", lambda: [
+    MetricFamily("app_process_start_time_seconds", "gauge", "Process start time (unix)").add(_started_at),
+])
+
+
+def render_metrics() -> str:
+    return metrics_registry.render()
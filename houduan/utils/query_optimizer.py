@@ -5,8 +5,11 @@
 
 from __future__ import annotations
 
+import os
+import re
 import time
 import threading
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable
 from functools import wraps
@@ -16,65 +19,236 @@ from sqlalchemy.engine import Engine
 from loguru import logger
 
 from .db_manager import db_manager, get_database_url
+from .tracing import LatencyHistogram
+
+
+# 指纹归一化：字面量、绑定参数与 IN 列表折叠为占位符
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\?")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_VALUES_RE = re.compile(r"\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+# 按执行计划判断全表扫描（SQLite: SCAN 表 且未用索引；MySQL: type=ALL）
+_FULL_SCAN_RE = re.compile(r"^SCAN (?!.*\bUSING (?:COVERING )?INDEX\b)|'type': 'ALL'", re.M)
+
+
+def fingerprint_sql(sql: str) -> str:
+    """SQL 指纹：去注释、字面量与参数替换为 ?、IN 列表和多行 VALUES 折叠、空白归一"""
+    sql = _COMMENT_RE.sub(" ", sql)
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _PARAM_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+    sql = _VALUES_RE.sub(r"VALUES \1, ...", sql)
+    return _SPACE_RE.sub(" ", sql).strip()
+
+
+class _FingerprintStats:
+    __slots__ = ("histogram", "errors", "first_seen", "last_seen")
+
+    def __init__(self, now: float):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.first_seen = now
+        self.last_seen = now
 
 
 class QueryProfiler:
-    """查询性能分析器"""
+    """查询性能分析器
+
+    按 SQL 指纹聚合（次数、总耗时、p50/p95/p99、最大值），指纹数有上限，超出时淘汰最久未出现的；
+    慢查询保留最近若干条样本（截断的 SQL 与执行计划），不保存参数值。
+    """
     
-    def __init__(self):
-        self._queries: List[Dict[str, Any]] = []
+    def __init__(self, max_fingerprints: int = None, slow_threshold: float = None, max_slow_samples: int = None):
+        self._fingerprints: "OrderedDict[str, _FingerprintStats]" = OrderedDict()
+        self._fingerprint_cache: "OrderedDict[str, str]" = OrderedDict()  # 原始语句 -> 指纹
+        self._slow_samples: deque = deque(maxlen=max_slow_samples or int(os.environ.get("SLOW_QUERY_SAMPLES", "50")))
+        self._last_explain: Dict[str, float] = {}
         self._lock = threading.Lock()
-        self._max_queries = 1000
-        self._slow_query_threshold = 1.0  # 1秒
-        
-    def record_query(self, sql: str, duration: float, params: Dict = None):
-        """记录查询性能"""
+        self._max_fingerprints = max_fingerprints or int(os.environ.get("QUERY_PROFILER_MAX_FINGERPRINTS", "500"))
+        self._slow_query_threshold = (slow_threshold if slow_threshold is not None
+                                      else float(os.environ.get("SLOW_QUERY_MS", "1000")) / 1000)
+        self._explain_interval = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+        self._total_queries = 0
+        self._total_duration = 0.0
+        self._slow_queries = 0
+        self._evicted = 0
+        self._engines: set = set()
+
+    def _fingerprint(self, sql: str) -> str:
+        # ORM 编译缓存让同一语句字符串反复出现，先查缓存
+        fingerprint = self._fingerprint_cache.get(sql)
+        if fingerprint is None:
+            fingerprint = fingerprint_sql(sql)
+            self._fingerprint_cache[sql] = fingerprint
+            if len(self._fingerprint_cache) > self._max_fingerprints * 4:
+                self._fingerprint_cache.popitem(last=False)
+        else:
+            # LRU：命中的热点语句移到末尾，淘汰时从最久未用的开始
+            self._fingerprint_cache.move_to_end(sql)
+        return fingerprint
+
+    def record_query(self, sql: str, duration: float, params: Dict = None, error: bool = False) -> bool:
+        """记录一次执行，返回是否为慢查询（params 仅为兼容旧调用，不保存）"""
+        now = time.time()
+        is_slow = duration > self._slow_query_threshold
         with self._lock:
-            query_info = {
-                'timestamp': datetime.now().isoformat(),
-                'sql': sql,
-                'duration': duration,
-                'params': params or {},
-                'is_slow': duration > self._slow_query_threshold
-            }
-            
-            self._queries.append(query_info)
-            
-            # 保持查询记录在限制范围内
-            if len(self._queries) > self._max_queries:
-                self._queries = self._queries[-self._max_queries:]
-            
-            # 记录慢查询
-            if query_info['is_slow']:
-                logger.warning(f"慢查询检测: {duration:.3f}s - {sql[:100]}...")
-    
+            fingerprint = self._fingerprint(sql)
+            stats = self._fingerprints.get(fingerprint)
+            if stats is None:
+                stats = self._fingerprints[fingerprint] = _FingerprintStats(now)
+                if len(self._fingerprints) > self._max_fingerprints:
+                    self._fingerprints.popitem(last=False)
+                    self._evicted += 1
+            else:
+                self._fingerprints.move_to_end(fingerprint)
+            stats.histogram.record(int(duration * 1_000_000))
+            stats.last_seen = now
+            if error:
+                stats.errors += 1
+            self._total_queries += 1
+            self._total_duration += duration
+            if is_slow:
+                self._slow_queries += 1
+        return is_slow
+
+    def _should_explain(self, sql: str) -> bool:
+        """同一指纹在间隔内只取一次执行计划"""
+        now = time.time()
+        with self._lock:
+            fingerprint = self._fingerprint(sql)
+            if now - self._last_explain.get(fingerprint, 0) < self._explain_interval:
+                return False
+            self._last_explain[fingerprint] = now
+            if len(self._last_explain) > self._max_fingerprints:
+                self._last_explain.pop(next(iter(self._last_explain)))
+            return True
+
+    def record_slow_sample(self, sql: str, duration: float, plan: Optional[List[str]] = None):
+        with self._lock:
+            fingerprint = self._fingerprint(sql)
+        self._slow_samples.append({
+            'timestamp': datetime.now().isoformat(),
+            'fingerprint': fingerprint,
+            'sql': sql[:500],
+            'duration': duration,
+            'explain': plan,
+            'full_scan': bool(plan) and bool(_FULL_SCAN_RE.search("\n".join(plan))),
+        })
+        logger.warning(f"慢查询检测: {duration:.3f}s - {fingerprint[:100]}...")
+
+    # ---- 引擎事件 ----
+
+    def install(self, engine: Engine) -> None:
+        """在引擎上注册 before/after_cursor_execute 与 handle_error 监听（同一引擎只注册一次）"""
+        with self._lock:
+            if id(engine) in self._engines:
+                return
+            self._engines.add(id(engine))
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start_time")
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        if self.record_query(statement, duration) and not executemany:
+            plan = None
+            if self._should_explain(statement):
+                plan = self._explain(conn, statement, parameters)
+            self.record_slow_sample(statement, duration, plan)
+
+    def _handle_error(self, exception_context):
+        conn = exception_context.connection
+        starts = conn.info.get("query_start_time") if conn is not None else None
+        if starts and exception_context.statement:
+            self.record_query(exception_context.statement, time.perf_counter() - starts.pop(), error=True)
+
+    def _explain(self, conn, statement: str, parameters) -> Optional[List[str]]:
+        """对慢 SELECT 取执行计划（用底层 DBAPI 游标执行，避免再次触发监听）"""
+        head = statement.lstrip()[:6].upper()
+        if not head.startswith(("SELECT", "WITH")):
+            return None
+        dialect = conn.dialect.name
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+                columns = [c[0] for c in cursor.description or []]
+            finally:
+                cursor.close()
+        except Exception as e:
+            return [f"EXPLAIN failed: {e}"]
+        if dialect == "sqlite":
+            # (id, parent, notused, detail)
+            return [row[-1] for row in rows]
+        return [str(dict(zip(columns, row))) for row in rows]
+
+    # ---- 读取 ----
+
     def get_slow_queries(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """获取慢查询列表"""
+        """获取慢查询样本（按耗时降序）"""
+        samples = list(self._slow_samples)
+        return sorted(samples, key=lambda x: x['duration'], reverse=True)[:limit]
+
+    def get_fingerprint_stats(self, limit: int = 20, order_by: str = "total") -> List[Dict[str, Any]]:
+        """按指纹的聚合统计，order_by: total / count / p99 / max"""
+        rows = []
         with self._lock:
-            slow_queries = [q for q in self._queries if q['is_slow']]
-            return sorted(slow_queries, key=lambda x: x['duration'], reverse=True)[:limit]
-    
+            for fingerprint, stats in self._fingerprints.items():
+                hist = stats.histogram
+                rows.append({
+                    'fingerprint': fingerprint,
+                    'count': hist.count,
+                    'total_ms': round(hist.total / 1000, 3),
+                    'avg_ms': round(hist.total / hist.count / 1000, 3) if hist.count else 0.0,
+                    'p50_ms': round(hist.percentile(0.5) / 1000, 3),
+                    'p95_ms': round(hist.percentile(0.95) / 1000, 3),
+                    'p99_ms': round(hist.percentile(0.99) / 1000, 3),
+                    'max_ms': round(hist.max / 1000, 3),
+                    'errors': stats.errors,
+                    'last_seen': datetime.fromtimestamp(stats.last_seen).isoformat(),
+                })
+        key = {"count": "count", "p99": "p99_ms", "max": "max_ms"}.get(order_by, "total_ms")
+        return sorted(rows, key=lambda r: r[key], reverse=True)[:limit]
+
     def get_query_stats(self) -> Dict[str, Any]:
-        """获取查询统计信息"""
+        """获取查询统计信息（进程启动以来累计）"""
         with self._lock:
-            if not self._queries:
-                return {'total_queries': 0, 'avg_duration': 0, 'slow_queries': 0}
-            
-            total_queries = len(self._queries)
-            avg_duration = sum(q['duration'] for q in self._queries) / total_queries
-            slow_queries = sum(1 for q in self._queries if q['is_slow'])
-            
+            total_queries = self._total_queries
             return {
                 'total_queries': total_queries,
-                'avg_duration': avg_duration,
-                'slow_queries': slow_queries,
-                'slow_query_rate': slow_queries / total_queries if total_queries > 0 else 0
+                'total_duration': self._total_duration,
+                'avg_duration': self._total_duration / total_queries if total_queries else 0,
+                'slow_queries': self._slow_queries,
+                'slow_query_rate': self._slow_queries / total_queries if total_queries else 0,
+                'fingerprints': len(self._fingerprints),
+                'evicted_fingerprints': self._evicted,
+                'slow_threshold_ms': int(self._slow_query_threshold * 1000),
             }
     
     def clear_queries(self):
         """清空查询记录"""
         with self._lock:
-            self._queries.clear()
+            self._fingerprints.clear()
+            self._fingerprint_cache.clear()
+            self._last_explain.clear()
+            self._slow_samples.clear()
+            self._total_queries = 0
+            self._total_duration = 0.0
+            self._slow_queries = 0
+            self._evicted = 0
 
 
 class QueryOptimizer:
@@ -84,60 +258,56 @@ class QueryOptimizer:
         self._profiler = QueryProfiler()
         self._index_suggestions: List[Dict[str, Any]] = []
         self._query_patterns: Dict[str, int] = {}
+
+    @property
+    def profiler(self) -> QueryProfiler:
+        return self._profiler
+
+    def install(self, engine: Engine) -> None:
+        """为引擎开启自动 SQL 计时"""
+        self._profiler.install(engine)
         
     def profile_query(self, sql: str, params: Dict = None):
         """查询性能分析装饰器"""
         def decorator(func):
             @wraps(func)
             def wrapper(*args, **kwargs):
-                start_time = time.time()
+                start_time = time.perf_counter()
                 try:
                     result = func(*args, **kwargs)
-                    duration = time.time() - start_time
-                    self._profiler.record_query(sql, duration, params)
+                    self._profiler.record_query(sql, time.perf_counter() - start_time)
                     return result
-                except Exception as e:
-                    duration = time.time() - start_time
-                    self._profiler.record_query(f"{sql} (ERROR: {e})", duration, params)
+                except Exception:
+                    self._profiler.record_query(sql, time.perf_counter() - start_time, error=True)
                     raise
             return wrapper
         return decorator
     
     def analyze_query_patterns(self):
-        """分析查询模式"""
-        with self._profiler._lock:
-            for query in self._profiler._queries:
-                # 提取查询模式（去除参数值）
-                pattern = self._extract_query_pattern(query['sql'])
-                self._query_patterns[pattern] = self._query_patterns.get(pattern, 0) + 1
+        """分析查询模式（按指纹的执行次数）"""
+        self._query_patterns = {row['fingerprint']: row['count']
+                                for row in self._profiler.get_fingerprint_stats(limit=100, order_by="count")}
+        return self._query_patterns
     
     def _extract_query_pattern(self, sql: str) -> str:
         """提取查询模式"""
-        # 简单的模式提取，去除参数值
-        import re
-        # 替换数字参数
-        pattern = re.sub(r'\b\d+\b', '?', sql)
-        # 替换字符串参数
-        pattern = re.sub(r"'[^']*'", '?', pattern)
-        return pattern.strip()
+        return fingerprint_sql(sql)
     
     def suggest_indexes(self) -> List[Dict[str, Any]]:
-        """建议索引优化"""
+        """建议索引优化：执行计划为全表扫描的慢查询"""
         suggestions = []
-        
-        # 分析WHERE子句中的列
-        with self._profiler._lock:
-            for query in self._profiler._queries:
-                if query['is_slow'] and 'WHERE' in query['sql'].upper():
-                    # 简单的索引建议逻辑
-                    suggestion = {
-                        'query': query['sql'][:100] + '...',
-                        'duration': query['duration'],
-                        'suggestion': '考虑在WHERE子句的列上添加索引',
-                        'priority': 'high' if query['duration'] > 2.0 else 'medium'
-                    }
-                    suggestions.append(suggestion)
-        
+        seen = set()
+        for sample in self._profiler.get_slow_queries(limit=50):
+            if not sample['full_scan'] or sample['fingerprint'] in seen:
+                continue
+            seen.add(sample['fingerprint'])
+            suggestions.append({
+                'query': sample['fingerprint'][:100] + '...',
+                'duration': sample['duration'],
+                'explain': sample['explain'],
+                'suggestion': '执行计划为全表扫描，考虑在 WHERE / ORDER BY 的列上添加索引',
+                'priority': 'high' if sample['duration'] > 2.0 else 'medium'
+            })
         return suggestions
     
     def get_optimization_report(self) -> Dict[str, Any]:
@@ -148,6 +318,7 @@ class QueryOptimizer:
         
         return {
             'query_stats': stats,
+            'top_queries': self._profiler.get_fingerprint_stats(10),
             'slow_queries': slow_queries,
             'index_suggestions': suggestions,
             'optimization_score': self._calculate_optimization_score(stats)
@@ -234,6 +405,54 @@ class DatabaseIndexManager:
             logger.error(f"创建索引失败: {e}")
             return False
 
+    def required_indexes(self) -> List[Dict[str, Any]]:
+        """模型声明的索引（__table_args__），即热点查询依赖的访问路径"""
+        from ..app import db
+        from .. import models  # noqa: F401  确保模型已注册到元数据
+
+        required = []
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                required.append({
+                    'table': table.name,
+                    'index_name': index.name,
+                    'columns': [column.name for column in index.columns],
+                })
+        return required
+
+    def verify_required_indexes(self, engine: Engine = None) -> Dict[str, Any]:
+        """核对热点索引是否已建立，返回缺失列表（启动时调用，只告警不阻断）"""
+        from sqlalchemy import inspect
+
+        if engine is None:
+            engine = db_manager.get_engine(get_database_url())
+        inspector = inspect(engine)
+        required = self.required_indexes()
+        existing: Dict[str, set] = {}
+        missing = []
+        for index in required:
+            table = index['table']
+            if table not in existing:
+                try:
+                    existing[table] = {ix['name'] for ix in inspector.get_indexes(table)}
+                except Exception:
+                    # 表尚未创建（未执行迁移）
+                    existing[table] = set()
+            if index['index_name'] not in existing[table]:
+                missing.append(index)
+
+        for index in missing:
+            logger.warning(
+                f"缺少索引 {index['index_name']} ON {index['table']}({', '.join(index['columns'])})，"
+                f"请执行 flask db upgrade"
+            )
+        self._recommended_indexes = missing
+        return {
+            'status': 'ok' if not missing else 'missing',
+            'checked': len(required),
+            'missing': missing,
+        }
+
 
 # 全局查询优化器实例
 query_optimizer = QueryOptimizer()
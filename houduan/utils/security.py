@@ -1,18 +1,22 @@
 """
 安全与鉴权相关工具
 
-提供: 密码哈希/校验, 角色检查装饰器
+提供: 密码哈希/校验, 角色检查装饰器, 登录身份缓存
 """
 
 from __future__ import annotations
 
 import functools
-from typing import Callable
+import os
+from dataclasses import dataclass
+from typing import Callable, Optional
 
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask import abort
 from flask_login import current_user
 
+from .cache_manager import cache_manager
+
 
 def hash_password(plain: str) -> str:
     return generate_password_hash(plain)
@@ -39,3 +43,32 @@ def require_roles(*roles: str) -> Callable:
     return decorator
 
 
+@dataclass(frozen=True)
+class UserIdentity:
+    """登录身份快照：鉴权只需要这几个字段"""
+
+    id: int
+    username: str
+    role: str
+    shop_id: Optional[int] = None
+
+
+# 登录身份缓存：user_loader 命中时不访问数据库；角色/店铺变更时显式失效
+_identity_cache = cache_manager.create_memory_cache(
+    "user_identity",
+    max_size=int(os.environ.get("USER_IDENTITY_CACHE_SIZE", "10000")),
+    default_ttl=int(os.environ.get("USER_IDENTITY_TTL", "60")),
+)
+
+
+def get_cached_identity(user_id) -> Optional[UserIdentity]:
+    return _identity_cache.get(str(user_id))
+
+
+def cache_identity(identity: UserIdentity) -> None:
+    _identity_cache.set(str(identity.id), identity)
+
+
+def invalidate_user_identity(user_id) -> None:
+    """用户角色、店铺变更或被删除后调用，下次请求重新从数据库加载"""
+    _identity_cache.delete(str(user_id))
@@ -0,0 +1,208 @@
+"""
+轻量链路追踪：消息处理各阶段耗时
+
+- span(stage) 上下文管理器记录一个阶段的耗时（perf_counter_ns，开销约 1 微秒）
+- trace(shop_id=..., model=...) 设置当前调用链的店铺 / 模型属性，内部 span 自动继承
+  （基于 contextvars，线程、协程之间互不干扰）
+- 耗时写入 HDR 风格的对数-线性直方图：每个 2 的幂区间再等分 16 个子桶，
+  相对误差不超过 1/16，内存只与量级数相关；按 阶段 × {全部, 店铺, 模型} 聚合
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 标准阶段
+STAGE_CONFIG_LOAD = "config_load"
+STAGE_RULE_CHECK = "rule_check"
+STAGE_KB_MATCH = "kb_match"
+STAGE_EMBEDDING = "embedding"
+STAGE_LLM_CALL = "llm_call"
+STAGE_DB_COMMIT = "db_commit"
+STAGE_UI_SEND = "ui_send"
+STAGE_PIPELINE = "pipeline"  # 单条消息端到端
+
+STAGES = (STAGE_CONFIG_LOAD, STAGE_RULE_CHECK, STAGE_KB_MATCH, STAGE_EMBEDDING,
+          STAGE_LLM_CALL, STAGE_DB_COMMIT, STAGE_UI_SEND, STAGE_PIPELINE)
+
+_SUB_BITS = 5
+_SUB_COUNT = 1 << _SUB_BITS      # 32
+_SUB_HALF = _SUB_COUNT >> 1      # 16
+
+_trace_attrs: ContextVar[Dict[str, Any]] = ContextVar("trace_attrs", default={})
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_COUNT:
+        return value
+    shift = value.bit_length() - _SUB_BITS
+    return _SUB_COUNT + (shift - 1) * _SUB_HALF + ((value >> shift) - _SUB_HALF)
+
+
+def _bucket_upper(index: int) -> int:
+    """桶内最大值（含）"""
+    if index < _SUB_COUNT:
+        return index
+    shift = (index - _SUB_COUNT) // _SUB_HALF + 1
+    top = (index - _SUB_COUNT) % _SUB_HALF + _SUB_HALF
+    return ((top + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """对数-线性桶直方图（单位：微秒），非线程安全，由 Tracer 加锁"""
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    def record(self, value_us: int) -> None:
+        value_us = max(0, int(value_us))
+        index = _bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_us
+        if self.min is None or value_us < self.min:
+            self.min = value_us
+        if value_us > self.max:
+            self.max = value_us
+
+    def percentile(self, q: float) -> int:
+        """q 分位数（微秒），返回所在桶的上界，不超过实际最大值"""
+        if not self.count:
+            return 0
+        target = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+    def buckets(self) -> List[Tuple[int, int]]:
+        """[(桶上界微秒, 计数)]，按上界升序"""
+        return [(_bucket_upper(i), self.counts[i]) for i in sorted(self.counts)]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count / 1000, 3) if self.count else 0.0,
+            "min_ms": round((self.min or 0) / 1000, 3),
+            "p50_ms": round(self.percentile(0.5) / 1000, 3),
+            "p90_ms": round(self.percentile(0.9) / 1000, 3),
+            "p99_ms": round(self.percentile(0.99) / 1000, 3),
+            "max_ms": round(self.max / 1000, 3),
+        }
+
+
+class Tracer:
+    """阶段耗时聚合：(阶段, 维度) -> 直方图，维度为 all / shop:<id> / model:<name>"""
+
+    def __init__(self, enabled: bool = True, max_series: int = 2000):
+        self.enabled = enabled
+        self.max_series = max_series
+        self._series: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._dropped = 0
+
+    def record(self, stage: str, duration_us: int, shop_id: Optional[int] = None,
+               model: Optional[str] = None) -> None:
+        keys = [(stage, "all")]
+        if shop_id is not None:
+            keys.append((stage, f"shop:{shop_id}"))
+        if model:
+            keys.append((stage, f"model:{model}"))
+        with self._lock:
+            for key in keys:
+                hist = self._series.get(key)
+                if hist is None:
+                    if len(self._series) >= self.max_series:
+                        # 维度过多时只保留已有序列，避免店铺 / 模型名无限增长
+                        self._dropped += 1
+                        continue
+                    hist = self._series[key] = LatencyHistogram()
+                hist.record(duration_us)
+
+    @contextmanager
+    def trace(self, **attrs) -> Iterator[None]:
+        """设置当前调用链属性（shop_id / model），嵌套时合并"""
+        token = _trace_attrs.set({**_trace_attrs.get(), **{k: v for k, v in attrs.items() if v is not None}})
+        try:
+            yield
+        finally:
+            _trace_attrs.reset(token)
+
+    def set_attrs(self, **attrs) -> None:
+        """在当前 trace 内补充属性（如读取店铺配置后才知道模型）"""
+        _trace_attrs.set({**_trace_attrs.get(), **{k: v for k, v in attrs.items() if v is not None}})
+
+    @contextmanager
+    def span(self, stage: str, shop_id: Optional[int] = None, model: Optional[str] = None) -> Iterator[None]:
+        """记录一个阶段耗时；未显式给出的店铺 / 模型取自当前 trace"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed_us = (time.perf_counter_ns() - started) // 1000
+            attrs = _trace_attrs.get()
+            self.record(stage, elapsed_us,
+                        shop_id if shop_id is not None else attrs.get("shop_id"),
+                        model or attrs.get("model"))
+
+    def histograms(self) -> Dict[Tuple[str, str], LatencyHistogram]:
+        """各序列直方图的快照副本"""
+        with self._lock:
+            copies = {}
+            for key, hist in self._series.items():
+                copy = LatencyHistogram()
+                copy.counts = dict(hist.counts)
+                copy.count, copy.total, copy.min, copy.max = hist.count, hist.total, hist.min, hist.max
+                copies[key] = copy
+        return copies
+
+    def snapshot(self) -> Dict[str, Any]:
+        """按阶段汇总：{stage: {all, by_shop, by_model}}"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for (stage, dimension), hist in sorted(self.histograms().items()):
+            entry = stages.setdefault(stage, {"all": None, "by_shop": {}, "by_model": {}})
+            if dimension == "all":
+                entry["all"] = hist.summary()
+            elif dimension.startswith("shop:"):
+                entry["by_shop"][dimension[5:]] = hist.summary()
+            else:
+                entry["by_model"][dimension[6:]] = hist.summary()
+        return {"enabled": self.enabled, "series": len(self._series),
+                "dropped": self._dropped, "stages": stages}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._dropped = 0
+
+
+# 全局追踪器
+tracer = Tracer(
+    enabled=os.environ.get("TRACING_ENABLED", "1").lower() not in ("0", "false", "no"),
+    max_series=int(os.environ.get("TRACING_MAX_SERIES", "2000")),
+)
+
+
+def span(stage: str, **attrs):
+    """记录阶段耗时的便捷函数：with span("kb_match"): ..."""
+    return tracer.span(stage, **attrs)
+
+
+def get_tracing_stats() -> Dict[str, Any]:
+    return tracer.snapshot()
@@ -51,6 +51,16 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """全文检索对象（FTS5 虚表及其影子表、ngram 全文索引）不在模型元数据中，自动迁移时忽略"""
+    if reflected and compare_to is None:
+        if type_ == "table" and "_fts" in name:
+            return False
+        if type_ == "index" and name.startswith("ft_"):
+            return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -93,6 +103,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,37 @@
+"""add_fulltext_search
+
+Revision ID: add_fulltext_search
+Revises: add_hot_path_indexes
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_fulltext_search'
+down_revision = 'add_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        # ngram 解析器（默认 ngram_token_size=2）切分中文
+        op.execute("CREATE FULLTEXT INDEX ft_messages_content ON messages (content) WITH PARSER ngram")
+        op.execute("CREATE FULLTEXT INDEX ft_knowledge_base_qa ON knowledge_base (question, answer) WITH PARSER ngram")
+    elif bind.dialect.name == 'sqlite':
+        # FTS5 虚表 + 全量回填；之后由 ORM 写入钩子同步
+        from houduan.services.fulltext import fulltext_search
+        fulltext_search.ensure_schema(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        op.drop_index('ft_knowledge_base_qa', table_name='knowledge_base')
+        op.drop_index('ft_messages_content', table_name='messages')
+    elif bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS knowledge_base_fts")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
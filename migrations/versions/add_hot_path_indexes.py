@@ -0,0 +1,43 @@
+"""add_hot_path_indexes
+
+Revision ID: add_hot_path_indexes
+Revises: add_import_tasks
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_hot_path_indexes'
+down_revision = 'add_import_tasks'
+branch_labels = None
+depends_on = None
+
+
+# (索引名, 表名, 列) —— 与 models 中 __table_args__ 保持一致
+HOT_PATH_INDEXES = [
+    # 审核上下文：同店铺同客户的最近消息
+    ('ix_messages_shop_customer_id', 'messages', ['shop_id', 'customer_id', 'id']),
+    # 告警：按状态统计当日消息
+    ('ix_messages_status_created_at', 'messages', ['status', 'created_at']),
+    # 审核列表：每条消息最新一条 AI 回复
+    ('ix_ai_replies_message_id_id', 'ai_replies', ['message_id', 'id']),
+    # 告警：当日非知识库回复
+    ('ix_ai_replies_created_at_model', 'ai_replies', ['created_at', 'model']),
+    ('ix_audit_queue_message_id', 'audit_queue', ['message_id']),
+    # 审核列表：按状态过滤并按 id 分页
+    ('ix_audit_queue_status_id', 'audit_queue', ['status', 'id']),
+    # 知识库：按店铺/分类筛选
+    ('ix_knowledge_base_shop_category', 'knowledge_base', ['shop_id', 'category']),
+]
+
+
+def upgrade():
+    for name, table, columns in HOT_PATH_INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, _ in reversed(HOT_PATH_INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,34 @@
+"""add_statistics_counters
+
+Revision ID: add_statistics_counters
+Revises: add_fulltext_search
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_statistics_counters'
+down_revision = 'add_fulltext_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('statistics_counters',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('bucket_date', sa.Date(), nullable=False),
+    sa.Column('bucket_hour', sa.SmallInteger(), nullable=False),
+    sa.Column('shop_id', sa.Integer(), nullable=False),
+    sa.Column('metric', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('bucket_date', 'bucket_hour', 'shop_id', 'metric', name='uq_statistics_counters_bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('statistics_counters')
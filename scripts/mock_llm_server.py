@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+本地离线大模型模拟服务（压测用）
+
+功能：
+- 模拟 OpenAI / 通义千问(DashScope) / 文心一言(ERNIE) 三种接口的请求与响应格式
+- 可配置延迟分布、错误率、流式输出与 token 吞吐速率
+- 真实适配器通过 base URL 覆盖指向本服务，即可在无网络环境下压测 process_message 全流程
+
+使用方法：
+python scripts/mock_llm_server.py --port 8900 --latency-dist lognormal --latency-ms 800 --error-rate 0.02
+
+然后设置环境变量（示例）：
+  OPENAI_API_KEY=mock  OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+  QWEN_API_KEY=mock    QWEN_BASE_URL=http://127.0.0.1:8900/api/v1
+  ERNIE_API_KEY=mock   ERNIE_SECRET_KEY=mock  ERNIE_BASE_URL=http://127.0.0.1:8900
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, jsonify, request
+
+
+# 默认回复语料：按字符切分为 token，模拟中文模型输出
+DEFAULT_REPLY = "您好，感谢您的咨询！我们已经收到您的问题，会尽快为您核实处理，请您耐心等待，祝您购物愉快。"
+
+
+@dataclass
+class MockConfig:
+    """模拟服务配置"""
+    latency_dist: str = "lognormal"   # fixed/uniform/normal/lognormal
+    latency_ms: float = 500.0         # 首 token 延迟的中位数/均值
+    latency_jitter_ms: float = 200.0  # 抖动（uniform 半宽 / normal 标准差 / lognormal 按比例换算 sigma）
+    error_rate: float = 0.0           # 0~1，按比例返回限流/服务端错误
+    tokens_per_sec: float = 40.0      # 输出吞吐，<=0 表示不限速
+    reply_tokens: int = 48            # 每次回复的 token 数
+    seed: Optional[int] = None
+
+
+class MockStats:
+    """请求统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def incr(self, key: str):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class MockBehavior:
+    """根据配置产生延迟、错误与回复 token"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+
+    def first_token_delay(self) -> float:
+        """采样首 token 延迟（秒）"""
+        cfg = self.config
+        with self._lock:
+            if cfg.latency_dist == "fixed":
+                ms = cfg.latency_ms
+            elif cfg.latency_dist == "uniform":
+                ms = self._rng.uniform(cfg.latency_ms - cfg.latency_jitter_ms, cfg.latency_ms + cfg.latency_jitter_ms)
+            elif cfg.latency_dist == "normal":
+                ms = self._rng.gauss(cfg.latency_ms, cfg.latency_jitter_ms)
+            else:
+                # 对数正态：latency_ms 视为中位数，抖动按比例换算为 sigma
+                sigma = math.log1p(cfg.latency_jitter_ms / max(cfg.latency_ms, 1.0))
+                ms = cfg.latency_ms * math.exp(self._rng.gauss(0.0, sigma))
+        return max(ms, 0.0) / 1000.0
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.config.error_rate
+
+    def token_interval(self) -> float:
+        tps = self.config.tokens_per_sec
+        return 1.0 / tps if tps > 0 else 0.0
+
+    def reply_tokens(self, prompt: str) -> List[str]:
+        """生成回复 token 列表（按字符切分）"""
+        n = max(1, int(self.config.reply_tokens))
+        text = (DEFAULT_REPLY * (n // len(DEFAULT_REPLY) + 1))[:n]
+        return list(text)
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text or "")
+
+
+def _stream_tokens(behavior: MockBehavior, tokens: List[str]) -> Iterator[Tuple[int, str]]:
+    """按吞吐速率逐个产出 token"""
+    interval = behavior.token_interval()
+    for i, tok in enumerate(tokens):
+        if interval and i > 0:
+            time.sleep(interval)
+        yield i, tok
+
+
+def _wait_full_generation(behavior: MockBehavior, tokens: List[str]):
+    """非流式：首 token 延迟 + 全部 token 生成时间"""
+    time.sleep(behavior.first_token_delay() + behavior.token_interval() * max(len(tokens) - 1, 0))
+
+
+def _sse(data: str, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id:{event_id}")
+    if event:
+        lines.append(f"event:{event}")
+    lines.append(f"data:{data}")
+    return "\n".join(lines) + "\n\n"
+
+
+def create_mock_app(config: MockConfig) -> Flask:
+    """创建模拟服务 Flask 应用"""
+    app = Flask(__name__)
+    app.config["JSON_AS_ASCII"] = False
+    behavior = MockBehavior(config)
+    stats = MockStats()
+    app.extensions["mock_llm"] = {"config": config, "behavior": behavior, "stats": stats}
+
+    # ---------------- OpenAI ----------------
+    @app.post("/v1/chat/completions")
+    def openai_chat():
+        stats.incr("openai")
+        body = request.get_json(force=True, silent=True) or {}
+        model = body.get("model", "gpt-4o-mini")
+        prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+        if behavior.should_fail():
+            stats.incr("openai_error")
+            time.sleep(behavior.first_token_delay() * 0.2)
+            return jsonify({"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}), 429
+
+        tokens = behavior.reply_tokens(prompt)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": _estimate_tokens(prompt),
+            "completion_tokens": len(tokens),
+            "total_tokens": _estimate_tokens(prompt) + len(tokens),
+        }
+
+        if body.get("stream"):
+            def gen():
+                time.sleep(behavior.first_token_delay())
+                for i, tok in _stream_tokens(behavior, tokens):
+                    delta = {"content": tok} if i else {"role": "assistant", "content": tok}
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                             "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            return Response(gen(), mimetype="text/event-stream")
+
+        _wait_full_generation(behavior, tokens)
+        return jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    # ---------------- 通义千问 DashScope ----------------
+    @app.post("/api/v1/services/aigc/text-generation/generation")
+    def dashscope_generation():
+        stats.incr("qwen")
+        body = request.get_json(force=True, silent=True) or {}
+        inp = body.get("input", {}) or {}
+        prompt = inp.get("prompt") or "".join(m.get("content") or "" for m in inp.get("messages", []))
+        request_id = str(uuid.uuid4())
+        if behavior.should_fail():
+            stats.incr("qwen_error")
+            time.sleep(behavior.first_token_delay() * 0.2)
+            return jsonify({"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded (mock)", "request_id": request_id}), 429
+
+        tokens = behavior.reply_tokens(prompt)
+        incremental = bool((body.get("parameters") or {}).get("incremental_output"))
+        streaming = request.headers.get("X-DashScope-SSE", "").lower() == "enable" or "text/event-stream" in request.headers.get("Accept", "")
+
+        if streaming:
+            def gen():
+                time.sleep(behavior.first_token_delay())
+                text = ""
+                for i, tok in _stream_tokens(behavior, tokens):
+                    text += tok
+                    is_last = i == len(tokens) - 1
+                    payload = {
+                        "output": {"text": tok if incremental else text, "finish_reason": "stop" if is_last else "null"},
+                        "usage": {"input_tokens": _estimate_tokens(prompt), "output_tokens": i + 1},
+                        "request_id": request_id,
+                    }
+                    yield _sse(json.dumps(payload, ensure_ascii=False), event="result", event_id=i + 1)
+            return Response(gen(), mimetype="text/event-stream")
+
+        _wait_full_generation(behavior, tokens)
+        return jsonify({
+            "status_code": 200,
+            "request_id": request_id,
+            "code": "",
+            "message": "",
+            "output": {"text": "".join(tokens), "finish_reason": "stop", "choices": None},
+            "usage": {"input_tokens": _estimate_tokens(prompt), "output_tokens": len(tokens)},
+        })
+
+    # ---------------- 文心一言 ERNIE ----------------
+    @app.post("/oauth/2.0/token")
+    def ernie_token():
+        stats.incr("ernie_token")
+        return jsonify({
+            "access_token": f"mock.{uuid.uuid4().hex}",
+            "expires_in": 2592000,
+            "scope": "ai_custom_yiyan_com",
+        })
+
+    @app.post("/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/<model>")
+    def ernie_chat(model: str):
+        stats.incr("ernie")
+        body = request.get_json(force=True, silent=True) or {}
+        prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+        if not request.args.get("access_token"):
+            return jsonify({"error_code": 110, "error_msg": "Access token invalid or no longer valid"})
+        if behavior.should_fail():
+            stats.incr("ernie_error")
+            time.sleep(behavior.first_token_delay() * 0.2)
+            # 文心一言错误以 HTTP 200 + error_code 返回
+            return jsonify({"error_code": 18, "error_msg": "Open api qps request limit reached (mock)"})
+
+        tokens = behavior.reply_tokens(prompt)
+        ernie_id = f"as-{uuid.uuid4().hex[:10]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            def gen():
+                time.sleep(behavior.first_token_delay())
+                # 文心一言按句子推送，这里每 8 个 token 一段
+                step = 8
+                for sid, start in enumerate(range(0, len(tokens), step)):
+                    if sid:
+                        time.sleep(behavior.token_interval() * step)
+                    piece = "".join(tokens[start:start + step])
+                    is_end = start + step >= len(tokens)
+                    payload = {"id": ernie_id, "object": "chat.completion", "created": created, "sentence_id": sid,
+                               "is_end": is_end, "is_truncated": False, "result": piece, "need_clear_history": False,
+                               "usage": {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": start + len(piece),
+                                         "total_tokens": _estimate_tokens(prompt) + start + len(piece)}}
+                    yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+            return Response(gen(), mimetype="text/event-stream")
+
+        _wait_full_generation(behavior, tokens)
+        return jsonify({
+            "id": ernie_id,
+            "object": "chat.completion",
+            "created": created,
+            "result": "".join(tokens),
+            "is_truncated": False,
+            "need_clear_history": False,
+            "usage": {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": len(tokens),
+                      "total_tokens": _estimate_tokens(prompt) + len(tokens)},
+        })
+
+    # ---------------- 管理接口 ----------------
+    @app.get("/mock/stats")
+    def mock_stats():
+        return jsonify({"config": asdict(config), "requests": stats.snapshot()})
+
+    @app.post("/mock/config")
+    def mock_update_config():
+        """运行时调整配置，便于压测过程中切换场景"""
+        data = request.get_json(force=True, silent=True) or {}
+        for key, value in data.items():
+            if hasattr(config, key):
+                setattr(config, key, type(getattr(config, key))(value) if getattr(config, key) is not None else value)
+        return jsonify({"ok": True, "config": asdict(config)})
+
+    return app
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地离线大模型模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "normal", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="首 token 延迟（中位数/均值）")
+    parser.add_argument("--latency-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--reply-tokens", type=int, default=48)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    config = MockConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_tokens=args.reply_tokens,
+        seed=args.seed,
+    )
+    app = create_mock_app(config)
+    print(f"模拟大模型服务已启动: http://{args.host}:{args.port}")
+    print(f"  OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    print(f"  QWEN_BASE_URL=http://{args.host}:{args.port}/api/v1")
+    print(f"  ERNIE_BASE_URL=http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
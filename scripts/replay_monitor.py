@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+千牛监控回放压测
+
+把录制的截图帧按真实或加速节奏喂给监控链路（切片 → 红点 → 哈希 → 增量OCR → 去重），
+输出各阶段耗时（毫秒）与产出消息数，可在 Linux 上度量轮询热路径的改动。
+
+使用方法：
+python scripts/replay_monitor.py recordings/shop1 --config shop_config.json --speed 0
+python scripts/replay_monitor.py recordings/shop1 --speed 4 --persist --shop-id 1
+
+--config 为店铺配置 JSON（与 Shop.config_json 相同，如 ocr_region / chat_region / unread_threshold）
+--speed 0 表示尽快回放，1 为真实速度，N 为 N 倍速
+--persist 将产出的消息写入数据库的 Message 表（source=qianniu_replay）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QIANNIU_PLATFORM", "replay")
+
+from houduan.services.replay import ReplayDriver, load_frames  # noqa: E402
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="千牛监控回放压测")
+    parser.add_argument("frames_dir", help="录制帧目录")
+    parser.add_argument("--config", help="店铺配置 JSON 文件")
+    parser.add_argument("--shop-id", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=0.0, help="回放速度，0 为尽快")
+    parser.add_argument("--interval", type=float, default=1.0, help="文件名无时间戳时的帧间隔（秒）")
+    parser.add_argument("--persist", action="store_true", help="将消息写入数据库")
+    parser.add_argument("--show-texts", action="store_true", help="输出识别到的消息文本")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    shop_config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            shop_config = json.load(f)
+
+    frames = load_frames(args.frames_dir, default_interval=args.interval)
+    if not frames:
+        print(f"未找到帧: {args.frames_dir}")
+        return
+
+    sink = None
+    app = None
+    if args.persist:
+        from houduan.app import create_app, db
+        from houduan.models import Message
+
+        app = create_app()
+
+        def sink(shop_id, texts):
+            with app.app_context():
+                for text in texts:
+                    db.session.add(Message(shop_id=shop_id, customer_id="unknown", content=text,
+                                           source="qianniu_replay", status="new"))
+                db.session.commit()
+
+    print(f"回放 {len(frames)} 帧，速度 {args.speed or '最快'}")
+    report = ReplayDriver(frames, shop_config, shop_id=args.shop_id, speed=args.speed, sink=sink).run()
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    if args.show_texts:
+        for text in report.texts:
+            print(f"- {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -101,6 +101,35 @@ def test_health_check(app_client):
     assert "services" in data
 
 
+def test_health_ready_cached_probes(app_client, monkeypatch):
+    """存活检查不访问数据库；就绪检查在关键探测失败时返回 503"""
+    from houduan.services.health_probes import health_probes
+    from houduan.utils.query_optimizer import query_optimizer
+
+    before = query_optimizer.profiler.get_query_stats()["total_queries"]
+    for _ in range(5):
+        assert app_client.get("/health").status_code == 200
+    assert query_optimizer.profiler.get_query_stats()["total_queries"] == before
+
+    resp = app_client.get("/health/ready")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["ready"] and data["probes"]["database"]["critical"]
+    assert not data["probes"]["database"]["stale"]
+
+    def broken():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(health_probes._probes["database"], "fn", broken)
+    health_probes.run_all()
+    resp = app_client.get("/health/ready")
+    assert resp.status_code == 503
+    assert resp.get_json()["failing"] == ["database"]
+    assert app_client.get("/health").get_json()["services"]["database"] == "error"
+    monkeypatch.undo()
+    health_probes.run_all()
+
+
 def test_shop_config(app_client):
     """测试店铺配置"""
     # 先登录
@@ -221,10 +250,11 @@ def test_message_processing(app_client):
     )
     db.session.add(message)
     db.session.commit()
+    msg_id = message.id
     
     # 处理消息
     resp = app_client.post("/api/messages/process", json={
-        "message_id": message.id
+        "message_id": msg_id
     })
     assert resp.status_code == 200
     data = resp.get_json()
@@ -232,6 +262,55 @@ def test_message_processing(app_client):
     assert "source" in data
     assert "confidence" in data
 
+    # 消息状态随回复一起提交
+    with app_client.application.app_context():
+        assert db.session.get(Message, msg_id).status != "new"
+
+
+def test_message_batch_processing(app_client):
+    """测试批量消息处理：需要AI的消息进入审核队列"""
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+
+    shop = Shop(name="批量店铺", qianniu_title="千牛批量",
+                config_json=json.dumps({"ai_model": "stub", "blacklist": ["c_black"]}))
+    db.session.add(shop)
+    db.session.commit()
+
+    shop_id = shop.id
+    ids = []
+    for customer, content in [("c1", "这件衣服有现货吗"), ("c_black", "我要退款"), ("c2", "什么时候上新")]:
+        m = Message(shop_id=shop_id, customer_id=customer, content=content, source="qianniu", status="new")
+        db.session.add(m)
+        db.session.commit()
+        ids.append(m.id)
+
+    from houduan.services.stats_aggregator import stats_aggregator
+    stats_aggregator.drain()
+    resp = app_client.post("/api/messages/process_batch", json={"message_ids": ids})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["processed"] == 3
+    # 规则回复逐条计一个延迟样本，合并的 AI 请求整组只计一个
+    pending = stats_aggregator.drain()
+    assert sum(v for (_, _, sid, metric), v in pending.items()
+               if sid == shop_id and metric == "latency_count") == 2
+    assert sum(v for (_, _, sid, metric), v in pending.items()
+               if sid == shop_id and metric == "ai_suggestions") == 2
+    assert [r["message_id"] for r in data["results"]] == ids
+    # 黑名单消息按规则直接回复，其余进入审核
+    sources = {r["message_id"]: r["source"] for r in data["results"]}
+    assert sources[ids[1]] == "blacklist"
+    assert sources[ids[0]] == "ai" and sources[ids[2]] == "ai"
+    assert AuditQueueItem.query.count() == 2
+
+    # 重复提交：已处理的消息被跳过，不会再次生成回复
+    resp = app_client.post("/api/messages/process_batch", json={"message_ids": ids + [999999]})
+    data = resp.get_json()
+    assert data["processed"] == 0
+    assert data["skipped"] == ids + [999999]
+    assert AuditQueueItem.query.count() == 2
+
 
 def test_audit_queue(app_client):
     """测试审核队列"""
@@ -300,16 +379,246 @@ def test_audit_queue(app_client):
     assert resp.status_code == 200
 
 
+def test_audit_list_keyset_pagination(app_client):
+    """审核队列：单查询返回最新 AI 回复，按游标分页并支持状态/店铺过滤"""
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+
+    with app_client.application.app_context():
+        shop = Shop(name="分页店铺", qianniu_title="千牛分页")
+        other = Shop(name="其他店铺", qianniu_title="千牛其他")
+        db.session.add_all([shop, other])
+        db.session.commit()
+        for i in range(5):
+            target = shop if i < 4 else other
+            msg = Message(shop_id=target.id, customer_id=f"c{i}", content=f"问题{i}", status="review")
+            db.session.add(msg)
+            db.session.commit()
+            db.session.add(AIReply(message_id=msg.id, model="stub", reply=f"旧回复{i}"))
+            db.session.add(AIReply(message_id=msg.id, model="stub", reply=f"新回复{i}"))
+            db.session.add(AuditQueueItem(message_id=msg.id, status="rejected" if i == 1 else "pending"))
+        db.session.commit()
+        shop_id = shop.id
+
+    resp = app_client.get(f"/api/audit?shop_id={shop_id}&limit=2")
+    first = resp.get_json()
+    assert [row["message"]["content"] for row in first] == ["问题0", "问题1"]
+    assert first[0]["ai_reply"]["reply"] == "新回复0"
+    cursor = resp.headers["X-Next-Cursor"]
+
+    resp = app_client.get(f"/api/audit?shop_id={shop_id}&limit=2&cursor={cursor}")
+    assert [row["message"]["content"] for row in resp.get_json()] == ["问题2", "问题3"]
+    assert "X-Next-Cursor" not in resp.headers
+
+    resp = app_client.get(f"/api/audit?shop_id={shop_id}&status=pending")
+    assert [row["message"]["content"] for row in resp.get_json()] == ["问题0", "问题2", "问题3"]
+
+
+def test_message_list_filters_and_cursor(app_client):
+    """消息列表：状态/店铺/客户/搜索过滤，id 倒序游标分页与精简字段"""
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+
+    with app_client.application.app_context():
+        shop = Shop(name="消息店铺", qianniu_title="千牛消息")
+        db.session.add(shop)
+        db.session.commit()
+        for i in range(6):
+            db.session.add(Message(shop_id=shop.id, customer_id="vip" if i % 2 else "c",
+                                   content=f"第{i}条 {'退款' if i < 3 else '发货'}100%",
+                                   status="new" if i < 4 else "answered"))
+        db.session.commit()
+        shop_id = shop.id
+
+    resp = app_client.get(f"/api/messages?shop_id={shop_id}&limit=4")
+    page = resp.get_json()
+    assert [m["content"][:3] for m in page] == ["第5条", "第4条", "第3条", "第2条"]
+    resp = app_client.get(f"/api/messages?shop_id={shop_id}&limit=4&cursor={resp.headers['X-Next-Cursor']}")
+    assert len(resp.get_json()) == 2 and "X-Next-Cursor" not in resp.headers
+
+    resp = app_client.get(f"/api/messages?shop_id={shop_id}&status=new&customer_id=vip")
+    assert [m["content"][:3] for m in resp.get_json()] == ["第3条", "第1条"]
+    resp = app_client.get(f"/api/messages?shop_id={shop_id}&q=退款&fields=summary")
+    rows = resp.get_json()
+    assert len(rows) == 3 and "content" not in rows[0] and rows[0]["content_preview"].startswith("第2条")
+    assert app_client.get("/api/messages?since=not-a-date").status_code == 400
+
+
+def test_search_api(app_client):
+    """全文检索接口：消息与知识库按相关度返回"""
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+
+    with app_client.application.app_context():
+        shop = Shop(name="检索店铺", qianniu_title="千牛检索")
+        db.session.add(shop)
+        db.session.commit()
+        db.session.add(Message(shop_id=shop.id, customer_id="c1", content="请问怎么退货"))
+        db.session.add(KnowledgeBaseItem(question="如何退货？", answer="七天无理由退货"))
+        db.session.commit()
+
+    data = app_client.get("/api/search?q=退货").get_json()
+    assert [m["content"] for m in data["messages"]] == ["请问怎么退货"]
+    assert data["kb"][0]["question"] == "如何退货？"
+    assert app_client.get("/api/search?q=退货&scope=kb").get_json().get("messages") is None
+    assert app_client.get("/api/search").status_code == 400
+
+
+def test_kb_import_streaming(app_client, monkeypatch):
+    """知识库导入：xlsx / csv 分块校验、批量写入并同步全文索引"""
+    import io
+    from openpyxl import Workbook
+    from houduan.services import kb_importer
+
+    monkeypatch.setattr(kb_importer, "CHUNK_SIZE", 2)
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+
+    with app_client.application.app_context():
+        shop = Shop(name="导入店铺", qianniu_title="千牛导入")
+        db.session.add(shop)
+        db.session.commit()
+        shop_id = shop.id
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["条目归属", "问题", "答案", "分类", "关键词"])
+    ws.append(["导入店铺", "怎么开发票", "下单后联系客服开具", "售后", "发票"])
+    ws.append(["全局", "多久发货", "付款后48小时内发货", None, None])
+    ws.append([None, None, "缺少问题", None, None])
+    ws.append([None, None, None, None, None])  # 空行跳过
+    ws.append(["不存在的店铺", "有赠品吗", "有", None, None])
+    ws.append([None, 123, "纯数字问题", None, None])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+
+    resp = app_client.post("/api/kb/import", data={"file": (buf, "kb.xlsx")},
+                           content_type="multipart/form-data")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert (data["total_rows"], data["success_count"], data["error_count"]) == (5, 2, 3)
+    assert data["errors"] == [
+        "第4行: 问题字段不能为空",
+        "第6行: 店铺 '不存在的店铺' 不存在，请先在店铺配置中创建该店铺",
+        "第7行: 问题不能为纯数字，请填写实际的问答内容",
+    ]
+
+    csv_bytes = "问题,答案,条目归属\n怎么退货,七天无理由,导入店铺\n".encode("gb18030")
+    resp = app_client.post("/api/kb/import", data={"file": (io.BytesIO(csv_bytes), "kb.csv")},
+                           content_type="multipart/form-data")
+    assert resp.get_json()["success_count"] == 1
+
+    resp = app_client.post("/api/kb/import", data={"file": (io.BytesIO("答案\n有\n".encode()), "kb.csv")},
+                           content_type="multipart/form-data")
+    assert resp.status_code == 400
+    assert resp.get_json()["error"] == "missing_columns"
+
+    with app_client.application.app_context():
+        items = {i.question: i for i in KnowledgeBaseItem.query.all()}
+        assert items["怎么开发票"].shop_id == shop_id
+        assert items["多久发货"].shop_id is None
+        assert items["怎么退货"].shop_id == shop_id
+
+    # 批量插入绕过 ORM 钩子，索引由导入同步写入
+    kb = app_client.get("/api/search?q=发票&scope=kb").get_json()["kb"]
+    assert [i["question"] for i in kb] == ["怎么开发票"]
+
+    # 中途失败：已提交的分块保留，响应中给出已写入的行数
+    real_insert = kb_importer._insert_chunk
+    calls = []
+
+    def failing_insert(conn, records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        real_insert(conn, records)
+
+    monkeypatch.setattr(kb_importer, "_insert_chunk", failing_insert)
+    csv_bytes = ("问题,答案,条目归属\n" + "".join(f"问题{i},答案{i},全局\n" for i in range(4))).encode()
+    resp = app_client.post("/api/kb/import", data={"file": (io.BytesIO(csv_bytes), "kb.csv")},
+                           content_type="multipart/form-data")
+    assert resp.status_code == 500
+    data = resp.get_json()
+    assert data["partial"] is True
+    assert (data["committed_rows"], data["success_count"]) == (2, 2)
+    with app_client.application.app_context():
+        assert KnowledgeBaseItem.query.filter(KnowledgeBaseItem.question.like("问题%")).count() == 2
+
+
+def test_pipeline_metrics_api(app_client):
+    """阶段耗时接口：按阶段 / 店铺过滤，/health 中同样可见"""
+    from houduan.utils.tracing import tracer
+
+    login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
+    assert login.status_code == 200
+    tracer.reset()
+    tracer.record("kb_match", 1500, shop_id=7, model="kb")
+    tracer.record("llm_call", 800000, shop_id=7, model="qwen")
+
+    data = app_client.get("/api/metrics/pipeline").get_json()
+    assert data["stages"]["llm_call"]["all"]["p50_ms"] >= 750
+    assert data["stages"]["kb_match"]["by_model"]["kb"]["count"] == 1
+    data = app_client.get("/api/metrics/pipeline?stage=kb_match&shop_id=7").get_json()
+    assert list(data["stages"]) == ["kb_match"] and data["stages"]["kb_match"]["count"] == 1
+
+    # /health 返回后台探测定期汇总的快照，这里立即刷新一轮
+    from houduan.services.health_probes import health_probes
+    health_probes.run_all()
+    health = app_client.get("/health").get_json()
+    assert "llm_call" in health["performance"]["pipeline_latency"]["stages"]
+
+    # SQL 计时由引擎事件自动采集
+    queries = app_client.get("/api/metrics/queries?order_by=count").get_json()
+    assert queries["stats"]["total_queries"] > 0
+    assert health["performance"]["query_performance"]["top_queries"]
+
+
+def test_openmetrics_endpoint(app_client, monkeypatch):
+    """/metrics：OpenMetrics 文本，直方图桶累积且以 +Inf 结束，不需要登录"""
+    from houduan.utils.tracing import tracer
+
+    tracer.reset()
+    for us in (800, 1200, 40000, 2000000):
+        tracer.record("llm_call", us, shop_id=3, model="qwen")
+
+    resp = app_client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("application/openmetrics-text")
+    text = resp.get_data(as_text=True)
+    assert text.endswith("# EOF\n")
+    assert "# TYPE app_cache_hits counter" in text
+    assert 'app_cache_hits_total{cache="user_identity"}' in text
+
+    series = 'stage="llm_call",model="qwen"'
+    buckets = [line for line in text.splitlines()
+               if line.startswith(f"app_pipeline_stage_seconds_bucket{{{series}")]
+    counts = [float(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and counts[-1] == 4
+    assert buckets[-1].startswith(f'app_pipeline_stage_seconds_bucket{{{series},le="+Inf"}}')
+    assert f'app_pipeline_stage_seconds_bucket{{{series},le="0.001"}} 1' in text
+    assert f'app_pipeline_stage_seconds_count{{{series}}} 4' in text
+
+    monkeypatch.setenv("METRICS_TOKEN", "secret")
+    assert app_client.get("/metrics").status_code == 401
+    assert app_client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+
 def test_statistics_api(app_client):
     """测试统计API"""
     # 先登录
     login = app_client.post("/api/auth/login", json={"username": "admin", "password": "admin"})
     assert login.status_code == 200
     
+    # 丢弃其他用例残留在内存中的统计增量
+    from houduan.services.stats_aggregator import stats_aggregator
+    stats_aggregator.drain()
+
     # 创建测试数据
     shop = Shop(name="测试店铺", qianniu_title="千牛测试")
     db.session.add(shop)
     db.session.commit()
+    shop_id = shop.id
     
     # 创建测试消息
     for i in range(5):
@@ -330,6 +639,14 @@ def test_statistics_api(app_client):
     data = resp.get_json()
     assert "daily_data" in data
     assert "summary" in data
+    assert data["summary"]["total_messages"] >= 5
+
+    resp = app_client.get(f"/api/statistics/daily?shop_id={shop_id}")
+    assert resp.get_json()["summary"]["total_messages"] == 5
+
+    resp = app_client.get(f"/api/statistics/hourly?shop_id={shop_id}")
+    assert resp.status_code == 200
+    assert sum(h["total_messages"] for h in resp.get_json()["hourly_data"]) == 5
     
     # 测试知识库统计
     resp = app_client.get("/api/statistics/knowledge_base")
@@ -0,0 +1,780 @@
+# -*- coding: utf-8 -*-
+"""
+服务层测试：AI 适配器、千牛监控链路等不依赖 HTTP 接口的核心逻辑
+
+运行：
+  .\.venv\Scripts\python -m pytest tests/test_services.py -q
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from mock_llm_server import MockConfig, create_mock_app  # noqa: E402
+from houduan.services import ai_adapter  # noqa: E402
+
+
+def test_mock_llm_wire_formats():
+    """模拟大模型服务返回三家厂商的响应格式"""
+    app = create_mock_app(MockConfig(latency_dist="fixed", latency_ms=0, tokens_per_sec=0, reply_tokens=10))
+    client = app.test_client()
+
+    resp = client.post("/v1/chat/completions", json={"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "你好"}]})
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert len(data["choices"][0]["message"]["content"]) == 10
+    assert data["usage"]["completion_tokens"] == 10
+
+    resp = client.post("/api/v1/services/aigc/text-generation/generation", json={"model": "qwen-turbo", "input": {"prompt": "你好"}})
+    assert resp.get_json()["output"]["finish_reason"] == "stop"
+
+    token = client.post("/oauth/2.0/token").get_json()["access_token"]
+    resp = client.post(f"/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/ernie-bot-turbo?access_token={token}",
+                       json={"messages": [{"role": "user", "content": "你好"}]})
+    assert "result" in resp.get_json()
+
+    # 流式输出以 [DONE] 结束
+    resp = client.post("/v1/chat/completions", json={"stream": True, "messages": [{"role": "user", "content": "你好"}]})
+    body = resp.get_data(as_text=True)
+    assert body.strip().endswith("data: [DONE]")
+
+
+def test_mock_llm_error_rate():
+    """错误率为 1 时按各厂商的错误格式返回"""
+    app = create_mock_app(MockConfig(latency_dist="fixed", latency_ms=0, error_rate=1.0))
+    client = app.test_client()
+
+    resp = client.post("/v1/chat/completions", json={"messages": []})
+    assert resp.status_code == 429
+    assert resp.get_json()["error"]["type"] == "rate_limit_error"
+
+    resp = client.post("/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/ernie-bot-turbo?access_token=x", json={"messages": []})
+    assert resp.status_code == 200
+    assert resp.get_json()["error_code"] == 18
+
+
+def test_parse_batch_replies():
+    """批量回复解析：兼容代码块包裹，忽略越界与空回复"""
+    raw = '```json\n{"replies": [{"id": 1, "reply": "有现货"}, {"id": 2, "reply": ""}, {"id": 9, "reply": "x"}]}\n```'
+    assert ai_adapter.parse_batch_replies(raw, 2) == {1: "有现货"}
+    assert ai_adapter.parse_batch_replies('[{"id": 2, "reply": "好的"}]', 2) == {2: "好的"}
+    assert ai_adapter.parse_batch_replies("【OpenAI】调用失败", 2) == {}
+
+
+def test_generate_replies_batch_fallback(monkeypatch):
+    """批量请求部分解析失败时，缺失条目回退为单条调用"""
+    calls = {"batch": 0, "single": []}
+
+    def fake_batch(prompt, model, max_tokens):
+        calls["batch"] += 1
+        return '{"replies": [{"id": 1, "reply": "回复一"}]}'
+
+    def fake_single(prompt, context=None, model="stub"):
+        calls["single"].append(prompt)
+        return f"单条:{prompt}"
+
+    monkeypatch.setattr(ai_adapter, "_generate_batch_raw", fake_batch)
+    monkeypatch.setattr(ai_adapter, "generate_reply", fake_single)
+
+    replies = ai_adapter.generate_replies_batch([("问题一", None), ("问题二", "参考")], model="openai")
+    assert replies == ["回复一", "单条:问题二"]
+    assert calls["batch"] == 1
+    assert calls["single"] == ["问题二"]
+
+
+def test_screen_capture_shared_frame():
+    """一次采集，多个区域零拷贝切片；越界区域自动裁剪"""
+    import numpy as np
+    from houduan.services.screen_capture import FakeFramebufferBackend, ScreenCapture, union_bbox
+
+    backend = FakeFramebufferBackend(width=400, height=300)
+    pixels = np.zeros((300, 400, 3), dtype=np.uint8)
+    pixels[110:120, 60:70] = (255, 0, 0)
+    backend.set_frame(pixels)
+    capture = ScreenCapture(backend)
+
+    regions = [(50, 100, 40, 40), (200, 150, 100, 100)]
+    assert union_bbox(regions) == (50, 100, 250, 150)
+    frame = capture.grab_frame(regions)
+    assert frame.origin == (50, 100)
+    assert frame.array.shape == (150, 250, 3)
+
+    view = frame.view((50, 100, 40, 40))
+    assert np.shares_memory(view, frame.array)
+    assert tuple(view[15, 15]) == (255, 0, 0)
+    assert frame.contains((200, 150, 100, 100))
+    assert not frame.contains((0, 0, 10, 10))
+    assert frame.image((280, 230, 50, 50)).size == (20, 20)
+    assert capture.get_stats()["grab_count"] == 1
+
+
+def test_unread_score_vectorized(monkeypatch):
+    """向量化红点评分：与逐像素结果一致，连通域过滤掉孤立噪点"""
+    import numpy as np
+    from PIL import Image
+    from houduan.services import qianniu_monitor
+
+    pixels = np.full((100, 100, 3), 255, dtype=np.uint8)
+    pixels[10:20, 10:20] = (230, 20, 20)   # 红点 100 像素
+    pixels[50, 50] = (230, 20, 20)         # 孤立噪点
+    pixels[70, 70] = (150, 20, 20)         # 暗红，不计入
+    img = Image.fromarray(pixels)
+
+    assert qianniu_monitor.unread_score(img) == pytest.approx(101 / 10000)
+    assert qianniu_monitor.unread_score(pixels, min_blob_pixels=4) == pytest.approx(100 / 10000)
+    assert qianniu_monitor.unread_score(pixels, downsample=2) == pytest.approx(26 / 2500)
+
+    # 无 scipy 时的回退实现结果一致
+    monkeypatch.setattr(qianniu_monitor, "_ndimage", None)
+    assert qianniu_monitor.unread_score(pixels, min_blob_pixels=4) == pytest.approx(100 / 10000)
+
+
+def test_poll_engine_parallel_and_adaptive():
+    """轮询引擎：一次截图并行检测多店铺，空闲退避、有消息回落到最小间隔"""
+    import threading
+    import time as _time
+    from houduan.services.poll_engine import PollEngine
+
+    grabs = []
+    ui_threads = set()
+    poll_threads = set()
+
+    def fake_grab(regions):
+        ui_threads.add(threading.current_thread().name)
+        grabs.append(list(regions))
+        return "frame"
+
+    def fake_window_check(title):
+        ui_threads.add(threading.current_thread().name)
+        return title != "missing"
+
+    def fake_poll(cfg, shop_id, frame=None):
+        assert frame == "frame"
+        poll_threads.add(threading.current_thread().name)
+        _time.sleep(0.05)
+        return (0.5, "新消息") if shop_id == 1 else (0.0, "")
+
+    engine = PollEngine(max_workers=4, min_interval=2, max_interval=10, backoff=2,
+                        poll_fn=fake_poll, window_check_fn=fake_window_check, grab_fn=fake_grab)
+    shops = [(i, "千牛", {"auto_mode": True}) for i in range(1, 5)]
+    shops.append((5, "missing", {"auto_mode": True}))
+    shops.append((6, None, {"auto_mode": False}))
+
+    start = _time.perf_counter()
+    results = engine.run_tick(shops, now=1000.0)
+    assert _time.perf_counter() - start < 0.15  # 4 个店铺并行，而非串行 0.2s
+    assert sorted(r[0] for r in results) == [1, 2, 3, 4]
+    assert len(grabs) == 1 and len(grabs[0]) == 4
+    assert len(ui_threads) == 1 and ui_threads.pop().startswith("ui-lane")
+    assert all(name.startswith("poll-worker") for name in poll_threads)
+
+    stats = engine.get_stats()["shops"]
+    assert stats[1]["interval"] == 2 and stats[2]["interval"] == 4 and stats[5]["interval"] == 10
+
+    # 未到期的店铺不会被轮询
+    assert [r[0] for r in engine.run_tick(shops, now=1002.0)] == [1]
+    engine.shutdown()
+
+
+def test_poll_engine_late_results_not_lost():
+    """节拍超时后仍在执行的轮询不会被重复提交，结束后其消息由下个节拍返回"""
+    import threading
+    from houduan.services.poll_engine import PollEngine
+
+    release = threading.Event()
+    calls = []
+
+    def slow_poll(cfg, shop_id, frame=None):
+        calls.append(shop_id)
+        release.wait(5)
+        return 0.5, ["新消息"]
+
+    engine = PollEngine(max_workers=2, poll_fn=slow_poll, window_check_fn=lambda title: True,
+                        grab_fn=lambda regions: "frame")
+    engine.tick_timeout = 0.05
+    shops = [(1, "千牛", {"auto_mode": True})]
+
+    assert engine.run_tick(shops, now=1000.0) == []
+    assert engine.run_tick(shops, now=1000.25) == []
+    assert calls == [1]
+
+    release.set()
+    engine.pool.shutdown(wait=True)
+    # 迟到的结果只返回一次，并按结果调整下次到期时间
+    assert engine.run_tick(shops, now=1000.5) == [(1, 0.5, ["新消息"])]
+    assert engine.run_tick(shops, now=1000.75) == []
+    assert engine.get_stats()["late_results"] == 1
+    engine.shutdown()
+
+
+class _ShapeEngine:
+    """测试用 OCR 引擎：返回图像尺寸与均值，验证共享内存传参"""
+
+    def ocr(self, pixels, cls=True):
+        return [[[None, (f"{pixels.shape[1]}x{pixels.shape[0]}:{int(pixels.mean())}", 0.99)]]]
+
+
+def _shape_engine_factory():
+    return _ShapeEngine()
+
+
+def test_ocr_service_process_pool():
+    """OCR 进程池：共享内存传图，多个并发任务合批识别"""
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from houduan.services.ocr_service import OCRService
+
+    service = OCRService(workers=2, batch_size=8, batch_window_ms=50,
+                         engine_factory=_shape_engine_factory, mp_context="fork")
+    try:
+        images = [np.full((20 + i, 30, 3), i * 10, dtype=np.uint8) for i in range(6)]
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            texts = list(pool.map(service.recognize, images))
+        assert texts == [f"30x{20 + i}:{i * 10}" for i in range(6)]
+
+        stats = service.get_stats()
+        assert stats["completed"] == 6 and stats["failed"] == 0 and stats["timeouts"] == 0
+        assert stats["batches"] < 6
+        assert stats["latency_ms"]["p50"] is not None
+    finally:
+        service.shutdown()
+
+
+def test_ocr_service_in_process_and_wait_timeout(monkeypatch):
+    """未启用进程池时在本进程识别；等待超时经服务计数（含 ocr_texts_cached）"""
+    import numpy as np
+    from concurrent.futures import Future
+    from houduan.services import qianniu_monitor
+    from houduan.services.ocr_service import OCRService
+
+    service = OCRService(workers=0, engine_factory=_shape_engine_factory)
+    assert not service.enabled
+    assert service.recognize(np.full((20, 30, 3), 10, dtype=np.uint8)) == "30x20:10"
+    assert service.wait(Future(), timeout=0.01) == ""
+    stats = service.get_stats()
+    assert stats["completed"] == 1 and stats["timeouts"] == 1
+
+    monkeypatch.setattr(qianniu_monitor, "ocr_service", service)
+    monkeypatch.setattr(service, "submit", lambda image: Future())
+    monkeypatch.setattr(service, "timeout", 0.01)
+    qianniu_monitor._ocr_result_cache.clear()
+    assert qianniu_monitor.ocr_texts_cached([np.zeros((8, 8, 3), dtype=np.uint8)], hashes=["h"]) == []
+    assert service.get_stats()["timeouts"] == 2
+
+
+def test_chat_diff_only_new_bubbles():
+    """聊天区域差分：滚动后只返回新滚入的气泡，顶部截断的气泡被忽略"""
+    import numpy as np
+    from houduan.services.chat_diff import ChatDiffer, split_bubbles
+
+    def chat(bubbles, height=200, width=120):
+        pixels = np.full((height, width, 3), 240, dtype=np.uint8)
+        y = 4
+        for shade in bubbles:
+            pixels[y:y + 20, 10:100] = 255
+            pixels[y + 5:y + 15, 15:15 + shade] = 30  # 文本
+            y += 30
+        return pixels
+
+    differ = ChatDiffer()
+    first = chat([20, 40, 60])
+    assert len(split_bubbles(first)) == 3
+    assert len(differ.diff("k", first)) == 3
+
+    # 不变：无新气泡
+    assert differ.diff("k", first) == []
+
+    # 向上滚动一个气泡并新增两条：只返回最后两条
+    scrolled = np.full_like(first, 240)
+    scrolled[:-30] = first[30:]
+    scrolled[94:114, 10:100] = 255
+    scrolled[99:109, 15:85] = 30
+    scrolled[124:144, 10:100] = 255
+    scrolled[129:139, 15:95] = 30
+    new = differ.diff("k", scrolled)
+    assert [(b.top, b.bottom) for b in new] == [(94, 114), (124, 144)]
+
+    # 区域数超限时只淘汰最久未比对的区域
+    bounded = ChatDiffer(max_regions=2)
+    for key in ("a", "b", "a", "c"):
+        bounded.diff(key, first)
+    assert bounded.diff("a", first) == []
+    assert len(bounded.diff("b", first)) == 3
+
+
+def test_poll_and_capture_messages_incremental(monkeypatch):
+    """增量OCR：只对新气泡识别，每个气泡一条消息"""
+    import numpy as np
+    from PIL import Image
+    from houduan.services import qianniu_monitor
+    from houduan.services.chat_diff import chat_differ
+    from houduan.services.screen_capture import CapturedFrame
+
+    recognized = []
+
+    class _Future:
+        def __init__(self, image):
+            recognized.append(np.asarray(image).shape[:2])
+            self.text = f"气泡{len(recognized)}"
+
+        def result(self, timeout=None):
+            return self.text
+
+    monkeypatch.setattr(qianniu_monitor.ocr_service, "submit", _Future)
+    chat_differ.reset()
+    qianniu_monitor._region_hash_cache.clear()
+
+    pixels = np.full((300, 300, 3), 240, dtype=np.uint8)
+    pixels[0:20, 0:40] = (230, 20, 20)          # 红点
+    for y in (110, 150):
+        pixels[y:y + 20, 10:200] = 255
+        pixels[y + 5:y + 15, 20:20 + y // 2] = 30
+    frame = CapturedFrame(array=pixels)
+    cfg = {"ocr_region": [0, 0, 300, 100], "chat_region": [0, 100, 300, 200], "unread_threshold": 0.001}
+
+    score, texts = qianniu_monitor.poll_and_capture_messages(cfg, shop_id=99, frame=frame)
+    assert score > 0
+    assert texts == ["气泡1", "气泡2"]
+    assert recognized == [(20, 300), (20, 300)]
+
+
+def test_dedupe_store_rolling_window(tmp_path, monkeypatch):
+    """滚动去重：跨分钟边界不重复放行，可见消息持续刷新，过期后才重新放行，重启后保留"""
+    from houduan.services.dedupe_store import DedupeStore
+
+    # 默认窗口只有几分钟，客户隔段时间重复发送的"在吗"仍会入库
+    monkeypatch.delenv("DEDUPE_WINDOW_MINUTES", raising=False)
+    short = DedupeStore(max_entries=100)
+    assert short.window_minutes == 3
+    assert short.seen("在吗", 1, now=1_700_000_000) is False
+    assert short.seen("在吗", 1, now=1_700_000_000 + 300) is False
+
+    path = str(tmp_path / "dedupe.json")
+    store = DedupeStore(window_minutes=3, max_entries=100, persist_path=path)
+    t0 = 1_700_000_000 - 1_700_000_000 % 60 + 59  # 分钟的最后一秒
+
+    assert store.seen("有现货吗？", 1, now=t0) is False
+    assert store.seen("有现货吗", 1, now=t0 + 2) is True      # 跨分钟 + 标点差异
+    assert store.seen("有现货吗", 2, now=t0 + 2) is False     # 不同店铺
+    assert store.seen("有现货吗", 1, now=t0 + 120) is True    # 仍在屏幕上，刷新到当前桶
+    assert store.seen("有现货吗", 1, now=t0 + 240) is True
+    assert store.seen("有现货吗", 1, now=t0 + 600) is False   # 超过窗口未出现，重新放行
+
+    store.flush()
+    restored = DedupeStore(window_minutes=10 ** 8, max_entries=100, persist_path=path)
+    assert restored.seen("有现货吗", 1) is True
+
+    bounded = DedupeStore(window_minutes=60, max_entries=10)
+    for i in range(50):
+        bounded.seen(f"消息{i}", 1, now=t0 + i * 60)
+    assert len(bounded) <= 10
+
+    # 同一分钟内超出上限：当前桶不被淘汰，刚记录的消息仍视为已见
+    burst = DedupeStore(window_minutes=60, max_entries=3)
+    for i in range(5):
+        assert burst.seen(f"消息{i}", 1, now=t0) is False
+    assert burst.seen("消息4", 1, now=t0) is True and len(burst) == 5
+
+
+def test_memory_cache_lru_ttl():
+    """内存缓存：LRU 淘汰最久未使用项，TTL/最大存活时间生效，统计命中率"""
+    import time as _time
+    from houduan.utils.cache_manager import MemoryCache
+
+    cache = MemoryCache(max_size=2, default_ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1          # a 变为最近使用
+    cache.set("c", 3)                   # 淘汰 b
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.set("short", "x", ttl=0.01)
+    _time.sleep(0.02)
+    assert cache.get("short") is None
+    assert cache.get("a", max_age=0) is None
+
+    stats = cache.get_stats()
+    assert stats["evictions"] == 2
+    assert stats["hits"] == 3 and stats["misses"] == 3
+    assert stats["hit_rate"] == 0.5
+
+
+def test_replay_driver_reports_stages(tmp_path, monkeypatch):
+    """回放驱动：按录制帧跑完整检测链路，统计阶段耗时与消息数"""
+    import numpy as np
+    from PIL import Image
+    from houduan.services import qianniu_monitor
+    from houduan.services.chat_diff import chat_differ
+    from houduan.services.platform_backend import NullBackend, get_platform, set_platform
+    from houduan.services.replay import ReplayDriver, load_frames
+
+    class _Future:
+        def __init__(self, image):
+            self.text = f"气泡{int(np.asarray(image)[:, :, 0].sum()) % 997}"
+
+        def result(self, timeout=None):
+            return self.text
+
+    monkeypatch.setattr(qianniu_monitor.ocr_service, "submit", _Future)
+    chat_differ.reset()
+    qianniu_monitor._region_hash_cache.clear()
+
+    base = np.full((300, 300, 3), 240, dtype=np.uint8)
+    base[0:20, 0:40] = (230, 20, 20)
+    frames = []
+    for i in range(3):
+        pixels = base.copy()
+        for j in range(i + 1):
+            y = 110 + j * 40
+            pixels[y:y + 20, 10:200] = 255
+            pixels[y + 5:y + 15, 20:40 + j * 30] = 30
+        pixels[0:20, 260:262 + i * 10] = (230, 20, 20)  # 每帧红点区域不同，触发哈希变化
+        Image.fromarray(pixels).save(tmp_path / f"{1700000000 + i * 2}.png")
+        frames.append(pixels)
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    loaded = load_frames(str(tmp_path))
+    assert [f.timestamp for f in loaded] == [1700000000, 1700000002, 1700000004]
+
+    set_platform(NullBackend())
+    sunk = []
+    cfg = {"ocr_region": [0, 0, 300, 100], "chat_region": [0, 100, 300, 200],
+           "unread_threshold": 0.001, "hash_threshold": 0}
+    report = ReplayDriver(loaded, cfg, shop_id=77, sink=lambda sid, texts: sunk.extend(texts)).run()
+
+    assert isinstance(get_platform(), NullBackend)  # 回放结束后恢复原后端
+    assert report.frames == 3
+    assert report.messages == 3 and sunk == report.texts
+    summary = report.to_dict()["stages"]
+    for stage in ("decode", "capture", "unread", "hash", "diff", "ocr", "dedupe", "total"):
+        assert summary[stage]["count"] >= 1
+
+
+def test_poll_engine_probe_escalation():
+    """红点探测：画面无变化时探测间隔指数退避，出现新未读时立即升级为完整轮询"""
+    import numpy as np
+    from houduan.services.poll_engine import PollEngine
+    from houduan.services.screen_capture import CapturedFrame
+
+    screen = np.full((200, 200, 3), 255, dtype=np.uint8)
+    polled = []
+
+    def fake_poll(cfg, shop_id, frame=None):
+        polled.append(shop_id)
+        return 0.0, []
+
+    engine = PollEngine(max_workers=2, min_interval=2, max_interval=30, backoff=2,
+                        poll_fn=fake_poll, window_check_fn=lambda title: True,
+                        grab_fn=lambda regions: CapturedFrame(array=screen))
+    engine.probe_min_interval, engine.probe_max_interval = 0.25, 2.0
+    shops = [(1, "千牛", {"auto_mode": True, "ocr_region": [0, 0, 100, 100], "unread_threshold": 0.01})]
+
+    engine.run_tick(shops, now=0.0)                  # 首次完整轮询，确认窗口存在
+    assert polled == [1]
+    assert engine.run_probe(shops, now=0.5) == []    # 首次探测建立签名（无未读）
+    assert engine.run_probe(shops, now=0.75) == []   # 无变化：退避
+    assert engine.get_stats()["shops"][1]["probe_interval"] == 0.5
+    assert engine.run_probe(shops, now=0.9) == []    # 未到探测时间
+
+    screen[10:30, 10:30] = (230, 20, 20)             # 新未读红点
+    assert engine.run_probe(shops, now=1.25) == [1]
+    engine.run_tick(shops, now=1.25)
+    assert polled == [1, 1]                           # 未等到 interval 即被升级
+    assert engine.get_stats()["escalations"] == 1
+    engine.shutdown()
+
+
+def test_change_detect_int_dhash():
+    """整数 dHash：与区域变化判定一致，汉明距离用 popcount，共享帧灰度只计算一次"""
+    import numpy as np
+    from houduan.services.change_detect import dhash_int, hamming, hash_hex, to_gray
+    from houduan.services.screen_capture import CapturedFrame
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (90, 160, 3), dtype=np.uint8)
+    h1 = dhash_int(pixels)
+    assert 0 <= h1 < 2 ** 64
+    assert dhash_int(to_gray(pixels)) == h1
+    assert len(hash_hex(h1)) == 16
+
+    brighter = np.clip(pixels.astype(int) + 10, 0, 255).astype(np.uint8)
+    assert hamming(h1, dhash_int(brighter)) <= 4        # 亮度整体变化不敏感
+    assert hamming(h1, dhash_int(pixels[:, ::-1])) > 10  # 内容变化敏感
+    assert hamming(0b1011, 0b0001) == 2
+
+    frame = CapturedFrame(array=pixels)
+    view = frame.gray_view((10, 10, 50, 40))
+    assert view.shape == (40, 50)
+    assert np.shares_memory(view, frame.gray)
+    assert frame.gray is frame.gray
+
+
+def test_request_session_shared_engine(test_app):
+    """请求级会话即 db.session，与 db_manager 共用同一引擎，请求结束关闭；连接池按URL复用引擎"""
+    from sqlalchemy import text
+    from sqlalchemy.pool import QueuePool
+    from houduan.app import db
+    from houduan.utils.connection_pool import pool_manager
+    from houduan.utils.db_manager import get_app_engine, get_request_session
+
+    with test_app.test_request_context():
+        assert get_request_session() is db.session
+        session = db.session()
+        assert get_app_engine() is db.engine
+        assert isinstance(db.engine.pool, QueuePool)
+        session.execute(text("SELECT 1"))
+        assert session.in_transaction()
+    assert not session.in_transaction()              # teardown 已关闭并归还连接
+
+    with test_app.app_context():
+        engine = get_app_engine()
+    with test_app.app_context():
+        assert get_app_engine() is engine
+
+    url = test_app.config["SQLALCHEMY_DATABASE_URI"]
+    first = pool_manager.create_optimized_pool(url, "unit")
+    other = pool_manager.create_optimized_pool("sqlite://", "unit")
+    assert other is not first
+    assert pool_manager.create_optimized_pool(url, "unit") is first
+
+
+def test_user_loader_identity_cache(test_app, monkeypatch):
+    """身份缓存：命中时 user_loader 不访问数据库，失效后重新加载"""
+    from houduan.app import login_manager
+    from houduan.utils import db_manager
+    from houduan.utils.security import (UserIdentity, cache_identity, get_cached_identity,
+                                        invalidate_user_identity)
+
+    calls = []
+    real_engine = db_manager.get_app_engine
+
+    def counting_engine():
+        calls.append(1)
+        return real_engine()
+
+    monkeypatch.setattr(db_manager, "get_app_engine", counting_engine)
+    invalidate_user_identity(1)
+    with test_app.app_context():
+        user = login_manager._user_callback("1")
+        assert user.role == "superadmin" and user.shop_id is None
+        assert len(calls) == 1
+        login_manager._user_callback("1")
+        assert len(calls) == 1                      # 命中缓存，无数据库往返
+
+        cache_identity(UserIdentity(id=1, username="admin", role="agent", shop_id=3))
+        assert login_manager._user_callback("1").role == "agent"
+        invalidate_user_identity(1)
+        assert get_cached_identity(1) is None
+        assert login_manager._user_callback("1").role == "superadmin"
+        assert len(calls) == 2
+
+
+def test_verify_required_indexes(test_app):
+    """热点索引：create_all 建出模型声明的索引，缺失时能被检出"""
+    from sqlalchemy import create_engine, text
+    from houduan.utils.query_optimizer import index_manager
+
+    names = {ix["index_name"] for ix in index_manager.required_indexes()}
+    assert {"ix_messages_shop_customer_id", "ix_ai_replies_message_id_id",
+            "ix_audit_queue_status_id", "ix_knowledge_base_shop_category"} <= names
+
+    with test_app.app_context():
+        from houduan.utils.db_manager import get_app_engine
+        assert index_manager.verify_required_indexes(get_app_engine())["status"] == "ok"
+
+    bare = create_engine("sqlite://")
+    with bare.begin() as conn:
+        conn.execute(text("CREATE TABLE messages (id INTEGER PRIMARY KEY, shop_id INTEGER)"))
+    report = index_manager.verify_required_indexes(bare)
+    assert report["status"] == "missing"
+    assert "ix_messages_shop_customer_id" in {ix["index_name"] for ix in report["missing"]}
+
+
+def test_fulltext_search_bigram_fts5(test_app):
+    """全文检索：中文二元组切分，FTS5 随 ORM 写入同步，按相关度排序"""
+    from houduan.app import db
+    from houduan.models import KnowledgeBaseItem, Message, Shop
+    from houduan.services.fulltext import fts5_query, fulltext_search, tokenize
+
+    assert tokenize("我要退款 ABC") == ["我要", "要退", "退款", "款", "abc"]
+    assert fts5_query("退款") == '"退款"'
+    assert fts5_query("退") == '"退"*'
+
+    with test_app.app_context():
+        shop = Shop(name="检索店铺", qianniu_title="千牛检索")
+        db.session.add(shop)
+        db.session.commit()
+        first = Message(shop_id=shop.id, customer_id="a", content="我要退款，订单号 A1001")
+        second = Message(shop_id=shop.id, customer_id="b", content="退款退款，什么时候退款到账")
+        other = Message(shop_id=shop.id, customer_id="c", content="什么时候发货")
+        kb = KnowledgeBaseItem(question="怎么申请退款", answer="在订单页提交申请")
+        db.session.add_all([first, second, other, kb])
+        db.session.commit()
+
+        conn = db.session.connection()
+        assert fulltext_search.backend(conn) == "fts5"
+        ranked = fulltext_search.ranked_ids(conn, "messages", "退款", shop.id)
+        assert [i for i, _ in ranked] == [second.id, first.id]
+        assert fulltext_search.ranked_ids(conn, "messages", "a1001", shop.id)[0][0] == first.id
+        assert [i for i, _ in fulltext_search.ranked_ids(conn, "knowledge_base", "申请退款")] == [kb.id]
+
+        other.content = "退款进度怎么查"
+        first.status = "answered"
+        db.session.commit()
+        assert len(fulltext_search.ranked_ids(db.session.connection(), "messages", "退款", shop.id)) == 3
+        db.session.delete(second)
+        db.session.commit()
+        assert second.id not in [i for i, _ in fulltext_search.ranked_ids(
+            db.session.connection(), "messages", "退款", shop.id)]
+
+
+def test_stats_aggregator_counts_and_flush(test_app):
+    """统计聚合：入库即计数，批量落库为原子自增，读取合并未落库增量"""
+    from datetime import date, datetime
+    from houduan.app import db
+    from houduan.models import Message, Shop, StatisticsCounter
+    from houduan.services.stats_aggregator import histogram_percentile, stats_aggregator
+
+    with test_app.app_context():
+        stats_aggregator.drain()  # 丢弃其他用例残留的内存增量
+        shop = Shop(name="统计店铺", qianniu_title="千牛统计")
+        db.session.add(shop)
+        db.session.commit()
+        db.session.add_all([Message(shop_id=shop.id, customer_id="a", content="在吗", source="qianniu"),
+                            Message(shop_id=shop.id, customer_id="a", content="好的", source="system_reply")])
+        db.session.commit()
+        # 回滚的插入不计数
+        db.session.add(Message(shop_id=shop.id, customer_id="b", content="回滚", source="qianniu"))
+        db.session.flush()
+        db.session.rollback()
+        stats_aggregator.record_result(shop.id, "kb", True, latency=0.08, model="kb", confidence=0.9)
+        stats_aggregator.record_result(shop.id, "ai", False, latency=3.0, model="qwen", confidence=0.5)
+
+        today = date.today()
+        conn = db.session.connection()
+        pending = stats_aggregator.daily_totals(conn, today, today, shop.id)[today]
+        assert pending["messages"] == 1 and pending["kb_hits"] == 1 and pending["auto_sent"] == 1
+
+        assert stats_aggregator.flush(db.engine) > 0
+        stats_aggregator.incr("messages", shop.id)
+        assert stats_aggregator.flush(db.engine) == 1
+        rows = db.session.query(StatisticsCounter).filter_by(shop_id=shop.id, metric="messages").all()
+        assert len(rows) == 1 and rows[0].value == 2
+
+        flushed = stats_aggregator.daily_totals(db.session.connection(), today, today, shop.id)[today]
+        assert flushed["messages"] == 2 and flushed["latency_count"] == 2
+        assert histogram_percentile(flushed, 0.5) == 100
+        assert histogram_percentile(flushed, 0.95) == 5000
+        hourly = stats_aggregator.hourly_totals(db.session.connection(), today, shop.id)
+        assert hourly[datetime.now().hour]["ai_suggestions"] == 1
+
+
+def test_stats_flush_upsert_across_processes(tmp_path):
+    """统计落库：多个进程的增量在数据库端累加；fork 后子进程不重复计数继承的增量"""
+    from datetime import datetime
+    from sqlalchemy import create_engine, select
+    from houduan.models import StatisticsCounter
+    from houduan.services.stats_aggregator import StatisticsAggregator
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    StatisticsCounter.__table__.create(engine)
+    at = datetime(2024, 5, 1, 9)
+    workers = [StatisticsAggregator(), StatisticsAggregator()]
+    for worker in workers:
+        worker.bind(engine)
+        worker.incr("messages", 1, 3, at=at)
+        worker.incr("auto_sent", 1, at=at)
+    assert [worker.flush() for worker in workers] == [2, 2]
+    workers[0].incr("messages", 1, at=at)
+    assert workers[0].flush() == 1
+
+    table = StatisticsCounter.__table__
+    with engine.connect() as conn:
+        values = dict(conn.execute(select(table.c.metric, table.c.value)).all())
+    assert values == {"messages": 7, "auto_sent": 2}
+
+    child = StatisticsAggregator()
+    child.incr("messages", 1)
+    child._after_fork()
+    assert child.drain() == {}
+
+    # 退出时落库失败不再放回增量（进程即将退出），只记录错误
+    exiting = StatisticsAggregator()
+    exiting.bind(create_engine("sqlite://"))
+    exiting.incr("messages", 1)
+    exiting.flush_on_exit()
+    assert exiting.drain() == {}
+
+
+def test_tracing_histogram_and_pipeline_spans(test_app):
+    """链路追踪：对数-线性直方图分位误差受限，消息处理各阶段按店铺 / 模型记录"""
+    from houduan.app import db
+    from houduan.models import Message, Shop
+    from houduan.services.message_handler import process_message
+    from houduan.utils.tracing import LatencyHistogram, tracer
+
+    hist = LatencyHistogram()
+    for value in range(1, 10001):
+        hist.record(value)
+    for q in (0.5, 0.9, 0.99):
+        assert abs(hist.percentile(q) - q * 10000) <= q * 10000 / 16
+    assert hist.percentile(1.0) == 10000 and hist.summary()["max_ms"] == 10.0
+
+    tracer.reset()
+    with test_app.app_context():
+        shop = Shop(name="追踪店铺", qianniu_title="千牛追踪")
+        db.session.add(shop)
+        db.session.commit()
+        shop_id = shop.id
+        message = Message(shop_id=shop_id, customer_id="t", content="你们几点发货呢")
+        db.session.add(message)
+        db.session.commit()
+        result = process_message(message)
+
+    stages = tracer.snapshot()["stages"]
+    for stage in ("pipeline", "config_load", "rule_check", "kb_match", "llm_call", "db_commit"):
+        assert stages[stage]["all"]["count"] == 1, stage
+        assert stages[stage]["by_shop"][str(shop_id)]["count"] == 1
+    assert result.source == "ai"
+    assert stages["llm_call"]["by_model"]["stub"]["count"] == 1
+    assert "stub" not in stages["config_load"]["by_model"]
+
+
+def test_query_profiler_engine_events(tmp_path):
+    """SQL 计时：引擎事件按指纹聚合，慢查询附执行计划并识别全表扫描"""
+    from sqlalchemy import create_engine, text
+    from houduan.utils.query_optimizer import QueryProfiler, fingerprint_sql
+
+    assert fingerprint_sql("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'") == \
+        "SELECT * FROM t WHERE id IN (...) AND name = ?"
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'q.db'}")
+    profiler = QueryProfiler(slow_threshold=0)
+    profiler.install(engine)
+    profiler.install(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO items (name) VALUES (:name)"), [{"name": f"n{i}"} for i in range(20)])
+        for i in range(5):
+            conn.execute(text("SELECT * FROM items WHERE name = :name"), {"name": f"n{i}"})
+        try:
+            conn.execute(text("SELECT * FROM missing_table"))
+        except Exception:
+            pass
+
+    stats = profiler.get_query_stats()
+    assert stats["total_queries"] == 8
+    rows = {row["fingerprint"]: row for row in profiler.get_fingerprint_stats(order_by="count")}
+    select = rows["SELECT * FROM items WHERE name = ?"]
+    assert select["count"] == 5 and select["p50_ms"] <= select["p99_ms"] <= select["max_ms"]
+    assert rows["SELECT * FROM missing_table"]["errors"] == 1
+
+    # 同一指纹只取一次执行计划
+    samples = [s for s in profiler.get_slow_queries(50) if s["fingerprint"] == "SELECT * FROM items WHERE name = ?"]
+    plans = [s["explain"] for s in samples if s["explain"]]
+    assert len(samples) == 5 and len(plans) == 1
+    assert plans[0][0].startswith("SCAN") and any(s["full_scan"] for s in samples)